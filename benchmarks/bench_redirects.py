@@ -0,0 +1,119 @@
+import os
+import sys
+import argparse
+import asyncio
+import json
+import subprocess
+import time
+
+# Run against the app's DB settings (.env in the source directory)
+SOURCE_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "source")
+sys.path.append(SOURCE_DIR)
+os.chdir(SOURCE_DIR)
+
+
+def make_scope(path):
+    return {
+        "type": "http",
+        "asgi": {"version": "3.0", "spec_version": "2.3"},
+        "http_version": "1.1",
+        "method": "GET",
+        "scheme": "http",
+        "path": path,
+        "raw_path": path.encode("latin-1"),
+        "root_path": "",
+        "query_string": b"",
+        "headers": [(b"host", b"localhost:8000"), (b"user-agent", b"bench")],
+        "client": ("127.0.0.1", 50000),
+        "server": ("localhost", 8000),
+    }
+
+
+async def call(app, path):
+    status = None
+
+    async def receive():
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message):
+        nonlocal status
+        if message["type"] == "http.response.start":
+            status = message["status"]
+
+    await app(make_scope(path), receive, send)
+    return status
+
+
+async def run_requests(app, paths, concurrency):
+    statuses = {}
+    queue = list(reversed(paths))
+
+    async def worker():
+        while queue:
+            status = await call(app, queue.pop())
+            statuses[status] = statuses.get(status, 0) + 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*[worker() for _ in range(concurrency)])
+    elapsed = time.perf_counter() - started
+    return {"requests": len(paths), "seconds": round(elapsed, 3), "rps": round(len(paths) / elapsed, 1),
+            "statuses": statuses}
+
+
+# Runs in a subprocess, so FAST_REDIRECT_ENABLED is read fresh by main.py
+def run_worker(args):
+    import main
+    from helpers.db_connection import pooled_connection
+    from helpers import visit_counter
+
+    with pooled_connection() as db:
+        cursor = db.cursor()
+        cursor.execute("SELECT urlx_slug FROM urls WHERE urlx_is_safe = true LIMIT %s", (args.slugs,))
+        slugs = [row[0] for row in cursor.fetchall()]
+        cursor.close()
+    if not slugs:
+        raise SystemExit("No safe URLs in the urls table - shorten a few URLs first")
+
+    hit_paths = ["/" + slugs[i % len(slugs)] for i in range(args.requests)]
+    miss_paths = ["/zzBench" + str(i % args.slugs) for i in range(args.requests)]
+
+    async def run():
+        # Warm up the caches, then measure
+        await run_requests(main.app, hit_paths[:len(slugs)] + miss_paths[:args.slugs], args.concurrency)
+        return {
+            "redirect": await run_requests(main.app, hit_paths, args.concurrency),
+            "not_found": await run_requests(main.app, miss_paths, args.concurrency),
+        }
+
+    result = asyncio.run(run())
+    visit_counter.stop()
+    print(json.dumps(result))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark GET /{slug} with and without the redirect fast path.")
+    parser.add_argument("--requests", type=int, default=20000, help="requests per scenario")
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--slugs", type=int, default=1000, help="distinct slugs to request")
+    parser.add_argument("--log-level", default="WARNING", help="LOG_LEVEL of the app while benchmarking")
+    parser.add_argument("--worker", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        run_worker(args)
+        return
+
+    results = {}
+    for name, enabled in (("before", "false"), ("after", "true")):
+        env = dict(os.environ, FAST_REDIRECT_ENABLED=enabled, LOG_LEVEL=args.log_level)
+        output = subprocess.run([sys.executable, os.path.abspath(__file__), "--worker",
+                                 "--requests", str(args.requests), "--concurrency", str(args.concurrency),
+                                 "--slugs", str(args.slugs)],
+                                env=env, check=True, capture_output=True, text=True).stdout
+        results[name] = json.loads(output.strip().splitlines()[-1])
+        print(json.dumps({name: results[name]}), flush=True)
+    return results
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,317 @@
+import os
+import sys
+import argparse
+import asyncio
+import json
+import logging
+import platform
+import random
+import socket
+import statistics
+import subprocess
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Relative --output / --compare paths are relative to where the suite was started
+INVOCATION_DIR = os.getcwd()
+
+# Run against the app's DB settings (.env in the source directory), with DATABASE_NAME replaced by --database
+SOURCE_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "source")
+sys.path.append(SOURCE_DIR)
+os.chdir(SOURCE_DIR)
+
+# Same URLs and slugs as the lookup benchmark
+from bench_urls_lookup import make_row, make_slug
+
+# The load generator's own request logging would distort the results
+logging.getLogger("httpx").setLevel(logging.WARNING)
+
+SCENARIOS = ("redirect", "shorten", "original")
+INSERT_BATCH_SIZE = 5000
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Seed a benchmark database, start the app against local stubs of "
+                                                 "reCAPTCHA / Safe Browsing / SendGrid, and load test it.")
+    parser.add_argument("--database", default="zaplink_bench", help="MySQL database to create and seed")
+    parser.add_argument("--rows", type=int, default=1000000, help="rows in the urls table")
+    parser.add_argument("--skip-seed", action="store_true", help="reuse the already seeded benchmark database")
+    parser.add_argument("--scenarios", nargs="+", choices=SCENARIOS, default=list(SCENARIOS))
+    parser.add_argument("--requests", type=int, default=5000, help="requests per scenario")
+    parser.add_argument("--warmup", type=int, default=200, help="unmeasured requests per scenario")
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--miss-ratio", type=float, default=0.1, help="share of redirect requests for unknown slugs")
+    parser.add_argument("--workers", type=int, default=1, help="uvicorn worker processes")
+    parser.add_argument("--port", type=int, default=8099)
+    parser.add_argument("--env", nargs="*", default=[], metavar="NAME=VALUE",
+                        help="extra environment for the app, e.g. FAST_REDIRECT_ENABLED=false")
+    parser.add_argument("--output", help="write the results as JSON to this file")
+    parser.add_argument("--compare", help="results JSON of an earlier run to compare against")
+    parser.add_argument("--threshold", type=float, default=10.0,
+                        help="percent of RPS drop / p95 increase reported as a regression (exit code 1)")
+    return parser.parse_args()
+
+
+# -- Database --
+
+def connect(database=None):
+    import mysql.connector
+    from dotenv import load_dotenv
+
+    load_dotenv()
+    return mysql.connector.connect(host=os.getenv("DATABASE_HOST"), user=os.getenv("DATABASE_USER"),
+                                   password=os.getenv("DATABASE_PASSWORD"), database=database)
+
+
+def seed_database(args):
+    import migrate
+
+    db = connect()
+    cursor = db.cursor()
+    cursor.execute("DROP DATABASE IF EXISTS `" + args.database + "`")
+    cursor.execute("CREATE DATABASE `" + args.database + "` DEFAULT CHARACTER SET utf8mb4 "
+                   "COLLATE utf8mb4_general_ci")
+    cursor.execute("USE `" + args.database + "`")
+
+    # Same structure as db/zaplink.sql, then the migrations on top
+    cursor.execute("CREATE TABLE urls ("
+                   "urlx_id bigint(20) NOT NULL AUTO_INCREMENT PRIMARY KEY, "
+                   "urlx_original_url varchar(255) NOT NULL, "
+                   "urlx_hash varchar(255) NOT NULL, "
+                   "urlx_slug varchar(20) NOT NULL, "
+                   "urlx_is_safe tinyint(1) NOT NULL DEFAULT 0, "
+                   "urlx_unsafe_details text DEFAULT NULL, "
+                   "urlx_visit_count int(11) NOT NULL DEFAULT 0, "
+                   "created_on datetime NOT NULL DEFAULT current_timestamp(), "
+                   "updated_on timestamp NOT NULL DEFAULT current_timestamp() ON UPDATE current_timestamp()"
+                   ") ENGINE=InnoDB DEFAULT CHARSET=utf8mb4")
+    query = ("INSERT INTO urls (urlx_original_url, urlx_hash, urlx_slug, urlx_is_safe, urlx_unsafe_details) "
+             "VALUES (%s, %s, %s, 1, '{}')")
+    started = time.perf_counter()
+    for start in range(0, args.rows, INSERT_BATCH_SIZE):
+        cursor.executemany(query, [make_row(i) for i in range(start, min(start + INSERT_BATCH_SIZE, args.rows))])
+        db.commit()
+    cursor.close()
+
+    migrate.ensure_migrations_table(db)
+    for version, path, _ in migrate.list_migrations(False):
+        migrate.apply_migration(db, version, path)
+    db.close()
+    print("Seeded " + str(args.rows) + " rows in " + str(round(time.perf_counter() - started, 1)) + "s", flush=True)
+
+
+def get_questions(db):
+    cursor = db.cursor()
+    cursor.execute("SHOW GLOBAL STATUS LIKE 'Questions'")
+    value = int(cursor.fetchone()[1])
+    cursor.close()
+    return value
+
+
+# -- Stubs: reCAPTCHA and Safe Browsing answer instantly, every URL is safe --
+
+class StubHandler(BaseHTTPRequestHandler):
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get("content-length", 0)))
+        body = b'{"success": true}' if self.path.startswith("/recaptcha") else b"{}"
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_stub_server():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, "http://127.0.0.1:" + str(server.server_address[1])
+
+
+# -- App --
+
+def start_app(args, stub_url):
+    env = dict(os.environ, DATABASE_NAME=args.database, RECAPTCHA_VERIFY_URL=stub_url + "/recaptcha",
+               RECAPTCHA_SECRET_KEY="bench", GOOGLE_SAFE_BROWSING_API_KEY="bench",
+               SAFE_BROWSING_MODE="lookup", SAFE_BROWSING_API_URL=stub_url + "/v4",
+               ALERT_TRANSPORT="file", ALERT_FILE_PATH=os.devnull, LOG_LEVEL="WARNING")
+    for item in args.env:
+        name, _, value = item.partition("=")
+        env[name] = value
+    process = subprocess.Popen([sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1",
+                                "--port", str(args.port), "--workers", str(args.workers), "--log-level", "warning",
+                                "--no-access-log"], cwd=SOURCE_DIR, env=env)
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(("127.0.0.1", args.port), timeout=1).close()
+            return process
+        except OSError:
+            if process.poll() is not None:
+                raise SystemExit("App exited during startup")
+            time.sleep(0.2)
+    process.terminate()
+    raise SystemExit("App did not start within 60s")
+
+
+# -- Load --
+
+# reCAPTCHA tokens are single use (replays get a 400), so every form gets its own - the stub accepts any token
+def make_token():
+    return "bench-" + uuid.uuid4().hex
+
+
+def make_requests(args, scenario, count, base_url):
+    requests = []
+    for _ in range(count):
+        if scenario == "redirect":
+            if random.random() < args.miss_ratio:
+                requests.append(("GET", "/zzMiss" + str(random.randrange(10 ** 6)), None))
+            else:
+                requests.append(("GET", "/" + make_slug(random.randrange(args.rows)), None))
+        elif scenario == "shorten":
+            # Mostly new URLs (insert path), some existing ones (lookup path)
+            if random.random() < 0.2:
+                url = "https://example.com/page/" + str(random.randrange(args.rows))
+            else:
+                url = "https://example.org/bench/" + str(random.getrandbits(64))
+            requests.append(("POST", "/", {"original_url": url, "g-recaptcha-response": make_token()}))
+        else:
+            short_url = base_url + "/" + make_slug(random.randrange(args.rows))
+            requests.append(("POST", "/get-original-url", {"short_url": short_url,
+                                                           "g-recaptcha-response": make_token()}))
+    return requests
+
+
+async def run_load(base_url, requests, concurrency):
+    import httpx
+
+    latencies = []
+    statuses = {}
+    errors = 0
+    queue = list(reversed(requests))
+
+    async def worker(client):
+        nonlocal errors
+        while queue:
+            method, path, data = queue.pop()
+            started = time.perf_counter()
+            try:
+                response = await client.request(method, path, data=data)
+                statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+            except httpx.HTTPError:
+                errors += 1
+                continue
+            latencies.append((time.perf_counter() - started) * 1000)
+
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=30, follow_redirects=False) as client:
+        started = time.perf_counter()
+        await asyncio.gather(*[worker(client) for _ in range(concurrency)])
+        elapsed = time.perf_counter() - started
+    return latencies, statuses, errors, elapsed
+
+
+def percentile(values, fraction):
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def run_scenario(args, scenario, base_url, db):
+    asyncio.run(run_load(base_url, make_requests(args, scenario, args.warmup, base_url), args.concurrency))
+
+    requests = make_requests(args, scenario, args.requests, base_url)
+    questions_before = get_questions(db)
+    latencies, statuses, errors, elapsed = asyncio.run(run_load(base_url, requests, args.concurrency))
+    # Minus the status query itself
+    queries = get_questions(db) - questions_before - 1
+
+    latencies.sort()
+    result = {
+        "requests": len(requests),
+        "errors": errors,
+        "statuses": {str(status): count for status, count in sorted(statuses.items())},
+        "seconds": round(elapsed, 3),
+        "rps": round(len(requests) / elapsed, 1),
+        "p50_ms": round(statistics.median(latencies), 3) if latencies else None,
+        "p95_ms": round(percentile(latencies, 0.95), 3) if latencies else None,
+        "p99_ms": round(percentile(latencies, 0.99), 3) if latencies else None,
+        "max_ms": round(latencies[-1], 3) if latencies else None,
+        "queries_per_request": round(queries / len(requests), 3),
+    }
+    print(json.dumps({scenario: result}), flush=True)
+    return result
+
+
+def get_git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+# -- Compare --
+
+def compare(baseline, results, threshold):
+    regressions = []
+    for scenario, result in results["scenarios"].items():
+        old = baseline.get("scenarios", {}).get(scenario)
+        if not old:
+            continue
+        rps_change = (result["rps"] - old["rps"]) / old["rps"] * 100
+        p95_change = ((result["p95_ms"] - old["p95_ms"]) / old["p95_ms"] * 100) if old["p95_ms"] else 0
+        queries_change = result["queries_per_request"] - old["queries_per_request"]
+        print(scenario + ": rps " + str(old["rps"]) + " -> " + str(result["rps"]) + " (" + format(rps_change, "+.1f") +
+              "%), p95 " + str(old["p95_ms"]) + " -> " + str(result["p95_ms"]) + " ms (" +
+              format(p95_change, "+.1f") + "%), queries/request " + str(old["queries_per_request"]) + " -> " +
+              str(result["queries_per_request"]))
+        if rps_change < -threshold or p95_change > threshold or queries_change > 0.05:
+            regressions.append(scenario)
+    if regressions:
+        print("Regressions: " + ", ".join(regressions))
+    return regressions
+
+
+def main():
+    args = parse_args()
+
+    if not args.skip_seed:
+        seed_database(args)
+
+    stub_server, stub_url = start_stub_server()
+    process = start_app(args, stub_url)
+    base_url = "http://127.0.0.1:" + str(args.port)
+    db = connect(args.database)
+    try:
+        results = {
+            "meta": {
+                "commit": get_git_commit(),
+                "time": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+                "python": platform.python_version(),
+                "args": {name: value for name, value in vars(args).items()
+                         if name not in ("output", "compare", "skip_seed")},
+            },
+            "scenarios": {scenario: run_scenario(args, scenario, base_url, db) for scenario in args.scenarios},
+        }
+    finally:
+        db.close()
+        process.terminate()
+        process.wait(timeout=30)
+        stub_server.shutdown()
+
+    if args.output:
+        with open(os.path.join(INVOCATION_DIR, args.output), "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+    if args.compare:
+        with open(os.path.join(INVOCATION_DIR, args.compare), encoding="utf-8") as f:
+            if compare(json.load(f), results, args.threshold):
+                sys.exit(1)
+    return results
+
+
+if __name__ == "__main__":
+    main()
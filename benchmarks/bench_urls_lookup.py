@@ -0,0 +1,149 @@
+import os
+import sys
+import argparse
+import hashlib
+import json
+import random
+import statistics
+import string
+import time
+
+# Run against the app's DB settings (.env in the source directory)
+SOURCE_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "source")
+sys.path.append(SOURCE_DIR)
+os.chdir(SOURCE_DIR)
+
+from helpers.db_connection import create_connection
+
+# Benchmark table - a copy of the `urls` structure, so the real table is never touched
+BENCH_TABLE = "urls_bench"
+INSERT_BATCH_SIZE = 5000
+SLUG_ALPHABET = string.ascii_letters + string.digits
+
+
+def create_bench_table(db):
+    cursor = db.cursor()
+    cursor.execute("DROP TABLE IF EXISTS " + BENCH_TABLE)
+    cursor.execute("CREATE TABLE " + BENCH_TABLE + " ("
+                   "urlx_id bigint(20) NOT NULL AUTO_INCREMENT PRIMARY KEY, "
+                   "urlx_original_url varchar(255) NOT NULL, "
+                   "urlx_hash varchar(255) NOT NULL, "
+                   "urlx_slug varchar(20) NOT NULL, "
+                   "urlx_is_safe tinyint(1) NOT NULL DEFAULT 0, "
+                   "urlx_unsafe_details text DEFAULT NULL, "
+                   "urlx_visit_count int(11) NOT NULL DEFAULT 0, "
+                   "created_on datetime NOT NULL DEFAULT current_timestamp(), "
+                   "updated_on timestamp NOT NULL DEFAULT current_timestamp() ON UPDATE current_timestamp()"
+                   ") ENGINE=InnoDB DEFAULT CHARSET=utf8mb4")
+    db.commit()
+    cursor.close()
+
+
+# Unique, random-looking 8-char slugs: i * prime is a bijection modulo 62^8
+SLUG_SPACE = len(SLUG_ALPHABET) ** 8
+SLUG_MULTIPLIER = 1000000007
+
+
+def make_slug(i):
+    n = (i * SLUG_MULTIPLIER) % SLUG_SPACE
+    chars = []
+    for _ in range(8):
+        n, remainder = divmod(n, len(SLUG_ALPHABET))
+        chars.append(SLUG_ALPHABET[remainder])
+    return "".join(chars)
+
+
+def make_row(i):
+    url = "https://example.com/page/" + str(i)
+    slug = make_slug(i)
+    return url, hashlib.sha256(url.encode("utf-8")).hexdigest(), slug
+
+
+def seed(db, rows):
+    cursor = db.cursor()
+    query = ("INSERT INTO " + BENCH_TABLE + " (urlx_original_url, urlx_hash, urlx_slug, urlx_is_safe) "
+             "VALUES (%s, %s, %s, 1)")
+    sample = []
+    for start in range(0, rows, INSERT_BATCH_SIZE):
+        batch = [make_row(i) for i in range(start, min(start + INSERT_BATCH_SIZE, rows))]
+        cursor.executemany(query, batch)
+        db.commit()
+        sample.extend(random.sample(batch, min(10, len(batch))))
+    cursor.close()
+    return sample
+
+
+def add_indexes(db):
+    cursor = db.cursor()
+    # Same as db/migrations/0001_add_urls_slug_and_hash_indexes.sql
+    cursor.execute("ALTER TABLE " + BENCH_TABLE + " "
+                   "MODIFY urlx_slug varchar(20) CHARACTER SET ascii COLLATE ascii_bin NOT NULL, "
+                   "MODIFY urlx_hash char(64) CHARACTER SET ascii COLLATE ascii_bin NOT NULL, "
+                   "ADD UNIQUE KEY idx_urls_slug (urlx_slug), "
+                   "ADD UNIQUE KEY idx_urls_hash (urlx_hash)")
+    db.commit()
+    cursor.close()
+
+
+def time_queries(db, query, params_list):
+    cursor = db.cursor()
+    timings = []
+    for params in params_list:
+        started = time.perf_counter()
+        cursor.execute(query, params)
+        cursor.fetchall()
+        timings.append((time.perf_counter() - started) * 1000)
+    cursor.close()
+    timings.sort()
+    return {
+        "p50_ms": round(statistics.median(timings), 3),
+        "p95_ms": round(timings[int(len(timings) * 0.95) - 1], 3),
+        "max_ms": round(timings[-1], 3),
+    }
+
+
+def run_lookups(db, sample, lookups):
+    picks = [random.choice(sample) for _ in range(lookups)]
+    misses = ["~" + "".join(random.choices(SLUG_ALPHABET, k=7)) for _ in range(lookups)]
+    return {
+        "slug_hit": time_queries(db, "SELECT urlx_id, urlx_original_url FROM " + BENCH_TABLE +
+                                 " WHERE urlx_is_safe = true AND urlx_slug = %s", [(row[2],) for row in picks]),
+        "slug_miss": time_queries(db, "SELECT urlx_id, urlx_original_url FROM " + BENCH_TABLE +
+                                  " WHERE urlx_is_safe = true AND urlx_slug = %s", [(slug,) for slug in misses]),
+        "hash_hit": time_queries(db, "SELECT urlx_id, urlx_slug FROM " + BENCH_TABLE +
+                                 " WHERE urlx_hash = %s LIMIT 1", [(row[1],) for row in picks]),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark urls lookups before and after adding indexes.")
+    parser.add_argument("--rows", type=int, nargs="+", default=[1000000, 10000000])
+    parser.add_argument("--lookups", type=int, default=200, help="queries per lookup type with indexes")
+    parser.add_argument("--scan-lookups", type=int, default=20,
+                        help="queries per lookup type without indexes (each one is a full table scan)")
+    parser.add_argument("--keep-table", action="store_true", help="do not drop the benchmark table afterwards")
+    args = parser.parse_args()
+
+    db = create_connection()
+    results = []
+    try:
+        for rows in args.rows:
+            create_bench_table(db)
+            sample = seed(db, rows)
+            before = run_lookups(db, sample, args.scan_lookups)
+            add_indexes(db)
+            after = run_lookups(db, sample, args.lookups)
+            result = {"rows": rows, "before": before, "after": after}
+            results.append(result)
+            print(json.dumps(result), flush=True)
+        if not args.keep_table:
+            cursor = db.cursor()
+            cursor.execute("DROP TABLE IF EXISTS " + BENCH_TABLE)
+            cursor.close()
+    finally:
+        db.close()
+    return results
+
+
+if __name__ == "__main__":
+    main()
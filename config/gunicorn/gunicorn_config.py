@@ -1,3 +1,26 @@
+import os
+import glob
+from dotenv import load_dotenv
+
 bind = "0.0.0.0:8001"
 workers = 2
-worker_class = "uvicorn.workers.UvicornWorker"
\ No newline at end of file
+worker_class = "uvicorn.workers.UvicornWorker"
+
+# Prometheus metrics (METRICS_ENABLED) of all workers are aggregated through the files in PROMETHEUS_MULTIPROC_DIR
+load_dotenv()
+
+
+def on_starting(server):
+    # Values of a previous run must not be added to the new one
+    multiproc_dir = os.getenv("PROMETHEUS_MULTIPROC_DIR")
+    if multiproc_dir:
+        os.makedirs(multiproc_dir, exist_ok=True)
+        for path in glob.glob(os.path.join(multiproc_dir, "*.db")):
+            os.remove(path)
+
+
+def child_exit(server, worker):
+    # Drop the live gauges of an exited worker
+    if os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+        from prometheus_client import multiprocess
+        multiprocess.mark_process_dead(worker.pid)
@@ -0,0 +1,18 @@
+--
+-- Unique indexes for the hot lookups on the `urls` table:
+-- - get_url_by_slug, check_short_url_exists, update_url_visit_count filter on `urlx_slug`
+-- - get_url_by_original_url filters on `urlx_hash`
+--
+-- Slugs are case-sensitive (shortuuid) and hashes are hex SHA-256, so both columns use a
+-- fixed-width / binary ascii collation. This also makes the indexes much smaller than utf8mb4.
+--
+-- Note: the unique indexes fail if duplicates already exist. Check first with:
+--   SELECT urlx_slug, COUNT(*) FROM urls GROUP BY BINARY urlx_slug HAVING COUNT(*) > 1;
+--   SELECT urlx_hash, COUNT(*) FROM urls GROUP BY urlx_hash HAVING COUNT(*) > 1;
+--
+
+ALTER TABLE `urls`
+  MODIFY `urlx_slug` varchar(20) CHARACTER SET ascii COLLATE ascii_bin NOT NULL,
+  MODIFY `urlx_hash` char(64) CHARACTER SET ascii COLLATE ascii_bin NOT NULL,
+  ADD UNIQUE KEY `idx_urls_slug` (`urlx_slug`),
+  ADD UNIQUE KEY `idx_urls_hash` (`urlx_hash`);
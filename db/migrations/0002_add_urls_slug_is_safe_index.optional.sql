@@ -0,0 +1,9 @@
+--
+-- Optional: covering index for lookups that filter on both `urlx_slug` and `urlx_is_safe`
+-- (get_url_by_slug, check_short_url_exists). idx_urls_slug already narrows these to one row,
+-- so this only saves the row read for the safety flag.
+-- Applied with: python migrate.py --with-optional
+--
+
+ALTER TABLE `urls`
+  ADD INDEX `idx_urls_slug_is_safe` (`urlx_slug`, `urlx_is_safe`);
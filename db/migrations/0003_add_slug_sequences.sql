@@ -0,0 +1,13 @@
+--
+-- ID blocks for the "block" slug allocator (SLUG_ALLOCATOR=block).
+-- Each worker reserves SLUG_BLOCK_SIZE ids at a time and encodes them to base62 slugs.
+-- Ids start at 62^5, so block slugs are at least 6 characters long.
+--
+
+CREATE TABLE IF NOT EXISTS `slug_sequences` (
+  `name` varchar(50) NOT NULL,
+  `next_id` bigint(20) NOT NULL,
+  PRIMARY KEY (`name`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
+
+INSERT IGNORE INTO `slug_sequences` (`name`, `next_id`) VALUES ('urls', 916132832);
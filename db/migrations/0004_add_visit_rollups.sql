@@ -0,0 +1,34 @@
+--
+-- Visit analytics rollups, written by the compactor from the local visit event log (VISIT_EVENTS_ENABLED=true).
+-- Buckets are UTC. visit_rollup_segments records compacted segments, so no segment is counted twice.
+--
+
+CREATE TABLE IF NOT EXISTS `visit_rollups_hourly` (
+  `slug` varchar(20) CHARACTER SET ascii COLLATE ascii_bin NOT NULL,
+  `bucket_start` datetime NOT NULL,
+  `visits` int(11) NOT NULL DEFAULT 0,
+  PRIMARY KEY (`slug`, `bucket_start`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
+
+CREATE TABLE IF NOT EXISTS `visit_rollups_daily` (
+  `slug` varchar(20) CHARACTER SET ascii COLLATE ascii_bin NOT NULL,
+  `bucket_start` date NOT NULL,
+  `visits` int(11) NOT NULL DEFAULT 0,
+  PRIMARY KEY (`slug`, `bucket_start`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
+
+CREATE TABLE IF NOT EXISTS `visit_rollups_daily_dims` (
+  `slug` varchar(20) CHARACTER SET ascii COLLATE ascii_bin NOT NULL,
+  `bucket_start` date NOT NULL,
+  `dimension` varchar(20) NOT NULL,
+  `value` varchar(255) NOT NULL,
+  `visits` int(11) NOT NULL DEFAULT 0,
+  PRIMARY KEY (`slug`, `dimension`, `bucket_start`, `value`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
+
+CREATE TABLE IF NOT EXISTS `visit_rollup_segments` (
+  `name` varchar(255) NOT NULL,
+  `events` int(11) NOT NULL,
+  `compacted_on` datetime NOT NULL DEFAULT current_timestamp(),
+  PRIMARY KEY (`name`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
@@ -0,0 +1,13 @@
+--
+-- Fixed-width dedup key for the `urls` table: `urlx_hash_bin` is the 32-byte SHA-256 of the canonical URL
+-- (see canonicalize_url() in helpers/url.py), so "https://Example.com" and "https://example.com/" share one row.
+-- BINARY(32) keeps the unique index at half the size of the hex `urlx_hash` char(64).
+--
+-- The column is nullable and added in place without locking the table. Existing rows are filled by
+-- backfill_url_hashes.py in small chunks, new rows once URL_HASH_BINARY=true. See README "URL hashing".
+--
+
+ALTER TABLE `urls`
+  ADD COLUMN `urlx_hash_bin` binary(32) DEFAULT NULL AFTER `urlx_hash`,
+  ADD UNIQUE KEY `idx_urls_hash_bin` (`urlx_hash_bin`),
+  ALGORITHM=INPLACE, LOCK=NONE;
@@ -0,0 +1,12 @@
+--
+-- Per-link redirect policy, NULL = the defaults REDIRECT_STATUS / REDIRECT_CACHE_TTL:
+-- - urlx_redirect_status: 301, 302, 307 or 308
+-- - urlx_cache_ttl: seconds browsers and the nginx proxy_cache may keep the redirect (0 = not cached)
+--
+-- Both columns are nullable and added in place without locking the table.
+--
+
+ALTER TABLE `urls`
+  ADD COLUMN `urlx_redirect_status` smallint(6) DEFAULT NULL AFTER `urlx_unsafe_details`,
+  ADD COLUMN `urlx_cache_ttl` int(11) DEFAULT NULL AFTER `urlx_redirect_status`,
+  ALGORITHM=INPLACE, LOCK=NONE;
@@ -0,0 +1,23 @@
+--
+-- Schema of the embedded SQLite backend (STORAGE_BACKEND=sqlite), applied by SQLiteStorage on first connect.
+-- Same columns and unique indexes as the MySQL `urls` table after all migrations (see zaplink.sql, migrations/).
+--
+
+CREATE TABLE IF NOT EXISTS urls (
+  urlx_id INTEGER PRIMARY KEY AUTOINCREMENT,
+  urlx_original_url TEXT NOT NULL,
+  urlx_hash TEXT NOT NULL,
+  urlx_hash_bin BLOB DEFAULT NULL,
+  urlx_slug TEXT NOT NULL,
+  urlx_is_safe INTEGER NOT NULL DEFAULT 0,
+  urlx_unsafe_details TEXT DEFAULT NULL,
+  urlx_redirect_status INTEGER DEFAULT NULL,
+  urlx_cache_ttl INTEGER DEFAULT NULL,
+  urlx_visit_count INTEGER NOT NULL DEFAULT 0,
+  created_on TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP,
+  updated_on TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE UNIQUE INDEX IF NOT EXISTS idx_urls_slug ON urls (urlx_slug);
+CREATE UNIQUE INDEX IF NOT EXISTS idx_urls_hash ON urls (urlx_hash);
+CREATE UNIQUE INDEX IF NOT EXISTS idx_urls_hash_bin ON urls (urlx_hash_bin);
@@ -0,0 +1,126 @@
+import os
+import sys
+import argparse
+import time
+
+# Add the source directory to the Python path, so that helpers are found when run from any directory
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+# Import helper functions
+from helpers.common import initialize_logging
+from helpers.db_connection import create_connection
+from helpers.url import generate_url_key
+from mysql.connector import IntegrityError
+
+# Initialize logging
+logger = initialize_logging("backfill_url_hashes.py")
+
+# Fills urls.urlx_hash_bin (migration 0005) for existing rows, walking the primary key in small chunks.
+# Each chunk is one short transaction touching only its own rows, so the table stays writable while it runs.
+# Rows whose canonical URL is already taken by a row with a lower id are duplicates - they keep NULL and are
+# still found by slug, and by their exact URL through urlx_hash.
+
+
+def fetch_chunk(db, after_id: int, chunk_size: int):
+    logger.debug("fetch_chunk() called.")
+
+    cursor = db.cursor()
+    cursor.execute("SELECT urlx_id, urlx_original_url FROM urls WHERE urlx_id > %s AND urlx_hash_bin IS NULL "
+                   "ORDER BY urlx_id LIMIT %s", (after_id, chunk_size))
+    rows = cursor.fetchall()
+    cursor.close()
+    return rows
+
+
+def get_taken_keys(db, keys: list):
+    logger.debug("get_taken_keys() called.")
+
+    cursor = db.cursor()
+    cursor.execute("SELECT urlx_hash_bin FROM urls WHERE urlx_hash_bin IN (" + ", ".join(["%s"] * len(keys)) + ")",
+                   keys)
+    taken = {bytes(row[0]) for row in cursor.fetchall()}
+    cursor.close()
+    return taken
+
+
+def update_keys(db, updates: list):
+    logger.debug("update_keys() called.")
+
+    # One UPDATE per chunk - a row the app wrote in the meantime fails the unique key and is retried row by row
+    cursor = db.cursor()
+    try:
+        query = ("UPDATE urls SET urlx_hash_bin = CASE urlx_id " + " ".join(["WHEN %s THEN %s"] * len(updates)) +
+                 " END WHERE urlx_id IN (" + ", ".join(["%s"] * len(updates)) + ") AND urlx_hash_bin IS NULL")
+        params = [value for update in updates for value in update] + [url_id for url_id, _ in updates]
+        cursor.execute(query, params)
+        db.commit()
+        cursor.close()
+        return len(updates), 0
+    except IntegrityError:
+        db.rollback()
+
+    updated = 0
+    for url_id, key in updates:
+        try:
+            cursor.execute("UPDATE urls SET urlx_hash_bin = %s WHERE urlx_id = %s AND urlx_hash_bin IS NULL",
+                           (key, url_id))
+            db.commit()
+            updated += 1
+        except IntegrityError:
+            db.rollback()
+            logger.info("update_keys() :: URL %s is a duplicate of another canonical URL, left unset.", url_id)
+    cursor.close()
+    return updated, len(updates) - updated
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fill urls.urlx_hash_bin for existing rows in small chunks.")
+    parser.add_argument("--chunk-size", type=int, default=1000, help="rows per chunk (default: 1000)")
+    parser.add_argument("--sleep", type=float, default=0.1, help="seconds to pause between chunks (default: 0.1)")
+    parser.add_argument("--start-id", type=int, default=0, help="only rows with a higher urlx_id (default: 0)")
+    parser.add_argument("--dry-run", action="store_true", help="count the rows to fill without writing")
+    args = parser.parse_args()
+
+    db = create_connection()
+    scanned = updated = duplicates = 0
+    try:
+        after_id = args.start_id
+        while True:
+            rows = fetch_chunk(db, after_id, args.chunk_size)
+            if not rows:
+                break
+            after_id = rows[-1][0]
+            scanned += len(rows)
+
+            # Lowest id wins within the chunk as well as against rows filled before
+            keys = [(url_id, generate_url_key(original_url)) for url_id, original_url in rows]
+            taken = get_taken_keys(db, [key for _, key in keys])
+            updates = []
+            for url_id, key in keys:
+                if key in taken:
+                    duplicates += 1
+                    logger.info("main() :: URL %s is a duplicate of another canonical URL, left unset.", url_id)
+                    continue
+                taken.add(key)
+                updates.append((url_id, key))
+
+            if args.dry_run:
+                updated += len(updates)
+            elif updates:
+                chunk_updated, chunk_duplicates = update_keys(db, updates)
+                updated += chunk_updated
+                duplicates += chunk_duplicates
+            db.rollback()  # Ends the read snapshot, so the next chunk sees rows written since
+
+            print(f"up to id {after_id}: {scanned} scanned, {updated} filled, {duplicates} duplicates")
+            if args.sleep > 0:
+                time.sleep(args.sleep)
+    finally:
+        db.close()
+
+    print(("dry run: " if args.dry_run else "") + f"{scanned} rows scanned, {updated} filled, "
+          f"{duplicates} duplicates left unset")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,31 @@
+import os
+import sys
+import argparse
+
+# Add the source directory to the Python path and run from it, so that helpers and assets are found
+SOURCE_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(SOURCE_DIR)
+os.chdir(SOURCE_DIR)
+
+# Import helper functions
+from helpers.common import initialize_logging
+from helpers.assets import build_assets, ASSETS_PURGE_CSS, ASSETS_DIST_DIR
+
+# Initialize logging
+logger = initialize_logging("build_assets.py")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fingerprint and precompress the files in assets/ into "
+                                                 + ASSETS_DIST_DIR + ".")
+    parser.add_argument("--purge-css", action="store_true", default=ASSETS_PURGE_CSS,
+                        help="drop CSS rules not used by the templates and scripts (default: ASSETS_PURGE_CSS)")
+    args = parser.parse_args()
+
+    manifest = build_assets(purge=args.purge_css)
+    for path, dist_path in sorted(manifest.items()):
+        print(path + " -> " + dist_path)
+
+
+if __name__ == "__main__":
+    main()
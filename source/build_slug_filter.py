@@ -0,0 +1,41 @@
+import os
+import sys
+import argparse
+import time
+
+# Add the source directory to the Python path, so that helpers are found when run from any directory
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+# Import helper functions
+from helpers.common import initialize_logging
+from helpers.db_connection import pooled_connection
+from helpers.slug_filter import build_filter, SLUG_FILTER_SNAPSHOT_PATH
+
+# Initialize logging
+logger = initialize_logging("build_slug_filter.py")
+
+# Builds the slug filter from the urls table and writes it as a snapshot file, which the workers map
+# (SLUG_FILTER_SNAPSHOT_PATH). Run it periodically, e.g. from cron - workers pick up a new file within
+# SLUG_FILTER_SYNC_INTERVAL seconds and add slugs created since from the DB.
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build the slug filter snapshot from the urls table.")
+    parser.add_argument("--output", default=SLUG_FILTER_SNAPSHOT_PATH,
+                        help="snapshot file to write (default: SLUG_FILTER_SNAPSHOT_PATH)")
+    args = parser.parse_args()
+    if not args.output:
+        parser.error("no output file, set SLUG_FILTER_SNAPSHOT_PATH or pass --output")
+
+    started = time.monotonic()
+    with pooled_connection() as db:
+        bloom = build_filter(db)
+    bloom.write(args.output)
+
+    print(f"{args.output}: {bloom.item_count} slugs up to id {bloom.max_id}, {len(bloom.bits)} bytes, "
+          f"{bloom.hash_count} hashes, estimated false positive rate {bloom.estimated_fp_rate():.6f}, "
+          f"built in {time.monotonic() - started:.2f}s")
+
+
+if __name__ == "__main__":
+    main()
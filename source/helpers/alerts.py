@@ -0,0 +1,248 @@
+import os
+from dotenv import load_dotenv
+from email.message import EmailMessage
+import json
+import queue
+import smtplib
+import threading
+import time
+
+# Import helper functions
+from helpers.common import initialize_logging
+from helpers.email import send_email
+from helpers.metrics import stage_timer
+
+# Load environment variables
+load_dotenv()
+
+# Initialize logging
+logger = initialize_logging("alerts.py")
+
+# Admin alert settings (per gunicorn worker process)
+# - ALERT_TRANSPORT: "sendgrid", "smtp" (e.g. a local SMTP sink) or "file" (one JSON line per email)
+# - ALERT_QUEUE_SIZE: max alerts waiting to be processed, further alerts are dropped
+# - ALERT_DIGEST_WINDOW: seconds in which repeats of an identical alert are folded into one digest email
+# - ALERT_RATE_LIMIT_PER_MINUTE / ALERT_RATE_LIMIT_BURST: max emails sent, further emails are dropped
+ALERT_TRANSPORT = os.getenv("ALERT_TRANSPORT", "sendgrid").lower()
+ALERT_QUEUE_SIZE = int(os.getenv("ALERT_QUEUE_SIZE", "1000"))
+ALERT_DIGEST_WINDOW = float(os.getenv("ALERT_DIGEST_WINDOW", "300"))
+ALERT_RATE_LIMIT_PER_MINUTE = float(os.getenv("ALERT_RATE_LIMIT_PER_MINUTE", "10"))
+ALERT_RATE_LIMIT_BURST = int(os.getenv("ALERT_RATE_LIMIT_BURST", "20"))
+ALERT_FILE_PATH = os.getenv("ALERT_FILE_PATH", "alerts.log")
+ALERT_SMTP_HOST = os.getenv("ALERT_SMTP_HOST", "localhost")
+ALERT_SMTP_PORT = int(os.getenv("ALERT_SMTP_PORT", "1025"))
+
+# Seconds between checks for digests that are due
+DIGEST_CHECK_INTERVAL = 5
+
+
+# Transport interface
+class AlertTransport:
+    def send(self, to_email, subject, content):
+        raise NotImplementedError
+
+
+class SendGridTransport(AlertTransport):
+    def send(self, to_email, subject, content):
+        send_email(to_email=to_email, subject=subject, content=content)
+
+
+class SMTPTransport(AlertTransport):
+    def __init__(self, host, port):
+        self.host = host
+        self.port = port
+
+    def send(self, to_email, subject, content):
+        message = EmailMessage()
+        message["From"] = os.getenv('SITE_ADMIN_EMAIL')
+        message["To"] = to_email
+        message["Subject"] = subject
+        message.set_content(content, subtype="html")
+        with smtplib.SMTP(self.host, self.port, timeout=10) as smtp:
+            smtp.send_message(message)
+
+
+class FileTransport(AlertTransport):
+    def __init__(self, path):
+        self.path = path
+
+    def send(self, to_email, subject, content):
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.write(json.dumps({"time": time.time(), "to": to_email, "subject": subject, "content": content}) + "\n")
+
+
+def create_transport(name):
+    logger.debug("create_transport() called.")
+
+    if name == "sendgrid":
+        return SendGridTransport()
+    if name == "smtp":
+        return SMTPTransport(ALERT_SMTP_HOST, ALERT_SMTP_PORT)
+    if name == "file":
+        return FileTransport(ALERT_FILE_PATH)
+    raise ValueError(f"Unknown alert transport: '{name}'")
+
+
+# Configured transport
+transport = create_transport(ALERT_TRANSPORT)
+
+_queue = queue.Queue(maxsize=ALERT_QUEUE_SIZE)
+
+# Per alert key: {"subject", "content", "last_sent", "suppressed", "first_suppressed", "last_suppressed"}
+_recent = {}
+
+# Token bucket for outgoing emails
+_tokens = float(ALERT_RATE_LIMIT_BURST)
+_tokens_updated = time.monotonic()
+
+# Stats
+_stats = {"queued": 0, "dropped_queue_full": 0, "sent": 0, "digests_sent": 0, "suppressed": 0,
+          "dropped_rate_limited": 0, "send_errors": 0}
+_stats_lock = threading.Lock()
+
+_worker = None
+_worker_pid = None
+_worker_lock = threading.Lock()
+
+# Queue item that stops the worker
+_STOP = object()
+
+
+def _count(name, value=1):
+    with _stats_lock:
+        _stats[name] += value
+
+
+def _take_token():
+    global _tokens, _tokens_updated
+
+    now = time.monotonic()
+    _tokens = min(float(ALERT_RATE_LIMIT_BURST), _tokens + (now - _tokens_updated) * ALERT_RATE_LIMIT_PER_MINUTE / 60)
+    _tokens_updated = now
+    if _tokens < 1:
+        return False
+    _tokens -= 1
+    return True
+
+
+def _deliver(subject, content):
+    if not _take_token():
+        _count("dropped_rate_limited")
+        logger.info("alerts :: Rate limit reached, alert dropped: %s", subject)
+        return False
+    try:
+        with stage_timer("email_send"):
+            transport.send(os.getenv('SITE_ADMIN_EMAIL'), subject, content)
+        return True
+    except Exception as e:
+        _count("send_errors")
+        logger.info("alerts :: Sending alert failed: %s", e)
+        return False
+
+
+def _handle_alert(subject, content):
+    key = (subject, content)
+    now = time.monotonic()
+    entry = _recent.get(key)
+
+    # Repeats within the digest window are only counted, they go out later as one digest email
+    if entry is not None and now - entry["last_sent"] < ALERT_DIGEST_WINDOW:
+        entry["suppressed"] += 1
+        entry["last_suppressed"] = time.time()
+        if entry["first_suppressed"] is None:
+            entry["first_suppressed"] = entry["last_suppressed"]
+        _count("suppressed")
+        return
+
+    if _deliver(subject, content):
+        _count("sent")
+    _recent[key] = {"subject": subject, "content": content, "last_sent": now, "suppressed": 0,
+                    "first_suppressed": None, "last_suppressed": None}
+
+
+def _send_due_digests(force=False):
+    now = time.monotonic()
+    for key, entry in list(_recent.items()):
+        if not force and now - entry["last_sent"] < ALERT_DIGEST_WINDOW:
+            continue
+        if entry["suppressed"] == 0:
+            # Nothing folded in and the window is over - forget the alert
+            if now - entry["last_sent"] >= ALERT_DIGEST_WINDOW:
+                del _recent[key]
+            continue
+
+        content = (entry["content"] + "<br/><br/>Repeated " + str(entry["suppressed"]) + " more times between " +
+                   time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(entry["first_suppressed"])) + " and " +
+                   time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(entry["last_suppressed"])) + ".")
+        if _deliver(entry["subject"] + " (digest: " + str(entry["suppressed"]) + " more)", content):
+            _count("digests_sent")
+        entry.update({"last_sent": now, "suppressed": 0, "first_suppressed": None, "last_suppressed": None})
+
+
+def _run_worker():
+    while True:
+        try:
+            item = _queue.get(timeout=DIGEST_CHECK_INTERVAL)
+        except queue.Empty:
+            item = None
+
+        if item is _STOP:
+            _send_due_digests(force=True)
+            return
+        if item is not None:
+            _handle_alert(*item)
+        _send_due_digests()
+
+
+def _ensure_started():
+    global _worker, _worker_pid
+
+    # Each gunicorn worker needs its own dispatcher thread (threads do not survive a fork)
+    pid = os.getpid()
+    if _worker is not None and _worker_pid == pid:
+        return
+    with _worker_lock:
+        if _worker is None or _worker_pid != pid:
+            _worker = threading.Thread(target=_run_worker, name="alert-dispatcher", daemon=True)
+            _worker.start()
+            _worker_pid = pid
+
+
+# Queue an alert email to the Site Admin - never blocks the caller
+def send_alert(subject, content):
+    logger.debug("send_alert() called.")
+
+    _ensure_started()
+    try:
+        _queue.put_nowait((subject, content))
+        _count("queued")
+    except queue.Full:
+        _count("dropped_queue_full")
+        logger.info("send_alert() :: Alert queue full, alert dropped: %s", subject)
+
+
+def start():
+    logger.debug("alerts.start() called.")
+
+    _ensure_started()
+
+
+# Stop the dispatcher, sending pending alerts and digests - called on graceful shutdown
+def stop():
+    global _worker
+    logger.debug("alerts.stop() called.")
+
+    if _worker is not None and _worker_pid == os.getpid():
+        try:
+            _queue.put(_STOP, timeout=5)
+        except queue.Full:
+            logger.info("alerts.stop() :: Alert queue full, pending alerts dropped.")
+        _worker.join(timeout=30)
+        _worker = None
+
+
+def get_alert_stats():
+    with _stats_lock:
+        stats = dict(_stats)
+    stats["queue_size"] = _queue.qsize()
+    return stats
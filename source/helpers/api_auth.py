@@ -0,0 +1,51 @@
+import os
+from dotenv import load_dotenv
+from fastapi import Header, HTTPException
+import hmac
+
+# Import helper functions
+from helpers.common import initialize_logging
+
+# Load environment variables
+load_dotenv()
+
+# Initialize logging
+logger = initialize_logging("api_auth.py")
+
+# API keys for the JSON API, as comma-separated "name:key" pairs, e.g. API_KEYS=campaigns:abc123,partner:def456
+API_KEYS = os.getenv("API_KEYS", "")
+
+
+def parse_api_keys(value: str):
+    api_keys = {}
+    for pair in value.split(","):
+        name, _, key = pair.strip().partition(":")
+        if name and key:
+            api_keys[name] = key
+    return api_keys
+
+
+# API key name -> key
+api_keys = parse_api_keys(API_KEYS)
+
+
+def get_api_key_name(key: str):
+    logger.debug("get_api_key_name() called.")
+
+    if not key:
+        return None
+    # Compare against every key in constant time, so the timing does not leak which key matched
+    matched_name = None
+    for name, expected_key in api_keys.items():
+        if hmac.compare_digest(key.encode("utf-8"), expected_key.encode("utf-8")):
+            matched_name = name
+    return matched_name
+
+
+# FastAPI dependency - returns the name of the API key sent in the X-API-Key header
+def require_api_key(x_api_key: str = Header(None)):
+    api_key_name = get_api_key_name(x_api_key)
+    if api_key_name is None:
+        logger.info("require_api_key() :: Invalid or missing API key.")
+        raise HTTPException(status_code=401, detail="Invalid or missing API key")
+    return api_key_name
@@ -1,14 +1,23 @@
 import os
 from dotenv import load_dotenv
 from fastapi import Request
-import shortuuid
 import json
 from urllib.parse import urlparse
 
 # Import helper functions
 from helpers.common import initialize_logging
-from helpers.email import send_email
-from helpers.url import (check_is_url_safe, generate_url_hash)
+from helpers.concurrency import run_blocking
+from helpers.db_connection import read_from_replica, record_write
+from helpers.storage import get_storage, DuplicateKeyError
+from helpers.alerts import send_alert
+from helpers.metrics import timed, stage_timer
+from helpers.cache import slug_cache, invalidate_slug, announce_invalidation, get_slug_cache_ttl, NOT_FOUND
+from helpers import shared_cache
+from helpers import visit_counter
+from helpers import slug_allocator
+from helpers import slug_filter
+from helpers import redirects
+from helpers.url import (check_is_url_safe, generate_url_hash, generate_url_key)
 
 # Load environment variables
 load_dotenv()
@@ -16,6 +25,17 @@ load_dotenv()
 # Initialize logging
 logger = initialize_logging("app.py")
 
+# URL dedup hash (see db/migrations/0005_add_urls_hash_bin.sql)
+# - URL_HASH_BINARY: look URLs up by urlx_hash_bin, the BINARY(32) SHA-256 of the canonical URL, instead of urlx_hash,
+#   the hex SHA-256 of the URL as submitted - run python backfill_url_hashes.py before and right after enabling it
+URL_HASH_BINARY = os.getenv("URL_HASH_BINARY", "false").lower() == "true"
+LOOKUP_HASH_COLUMN = "urlx_hash_bin" if URL_HASH_BINARY else "urlx_hash"
+
+# Rows written by create_url() / create_urls_bulk(), see get_url_row()
+URL_INSERT_COLUMNS = ["urlx_original_url", "urlx_hash", "urlx_slug", "urlx_is_safe", "urlx_unsafe_details"]
+if URL_HASH_BINARY:
+    URL_INSERT_COLUMNS.append("urlx_hash_bin")
+
 
 def get_current_domain(request: Request):
     logger.debug("get_current_domain() called.")
@@ -27,50 +47,40 @@ def get_current_domain(request: Request):
     return current_domain
 
 
-def get_shortened_url(db, req_original_url: str):
+async def get_shortened_url(db, req_original_url: str):
     logger.debug("get_shortened_url() called.")
 
-    # Check if URL is safe or not
-    url_is_safe_result = check_is_url_safe(req_original_url)
-    url_is_safe = url_is_safe_result["is_safe"]
-    url_is_safe_details_str = json.dumps(url_is_safe_result)
-
-    # Check if the original URL already exists
-    existing_slug = get_url_by_original_url(db, req_original_url)
+    # Check if the original URL already exists - its stored safety verdict is reused, skipping the remote check
+    existing_slug = await run_blocking(get_url_by_original_url, db, req_original_url)
     if existing_slug:
-        logger.info("get_shortened_url() :: Original URL: " + req_original_url + " already exists, returning existing "
-                                                                              "slug: " + existing_slug)
-    else:
-        logger.info("get_shortened_url() :: existing_slug: " + str(existing_slug))
-
-    # If not existing URL, generate a new short URL slug and verify it is unique before inserting into database
-    if existing_slug is None:
-        short_url_slug = shortuuid.ShortUUID().random(length=8)
-        logger.info("get_shortened_url() :: New slug generated: " + short_url_slug)
-        while check_short_url_exists(db, short_url_slug):
-            logger.info("get_shortened_url() :: Found existing slug: " + short_url_slug + ", generating new slug.")
-            short_url_slug = shortuuid.ShortUUID().random(length=8)
-            logger.info("get_shortened_url() :: New slug generated as it was not unique: " + short_url_slug)
-
-        # Insert the new URL into the database
-        create_url(db, req_original_url, short_url_slug, url_is_safe, url_is_safe_details_str)
-    else:
+        logger.info("get_shortened_url() :: Original URL: %s already exists, returning existing slug: %s",
+                    req_original_url, existing_slug)
         short_url_slug = existing_slug
+        url_is_safe = await run_blocking(get_url_by_slug, db, existing_slug) is not None
+    else:
+        logger.info("get_shortened_url() :: existing_slug: %s", existing_slug)
+
+        # Check if URL is safe or not
+        url_is_safe_result = await check_is_url_safe(req_original_url)
+        url_is_safe = url_is_safe_result["is_safe"]
+        url_is_safe_details_str = json.dumps(url_is_safe_result)
+
+        # Insert it with a newly allocated slug - uniqueness is enforced by the DB
+        short_url_slug = await run_blocking(create_url_with_new_slug, db, req_original_url, url_is_safe,
+                                            url_is_safe_details_str)
 
     # Response based on if URL is safe or not
     if url_is_safe:
-        logger.info("get_shortened_url() :: short_url_slug: " + short_url_slug)
+        logger.info("get_shortened_url() :: short_url_slug: %s", short_url_slug)
         return short_url_slug
     else:
         logger.info("get_shortened_url() :: Unsafe URL has been submitted.")
 
-        # Send an email alert to Site Admin - if an unsafe URL is submitted
+        # Queue an email alert to Site Admin - if an unsafe URL is submitted
         logger.info("get_shortened_url() :: Sending email alert - Unsafe URL has been submitted.")
-        env_site_admin_email = os.getenv('SITE_ADMIN_EMAIL')
         env_site_name = os.getenv('SITE_NAME')
 
-        send_email(
-            to_email=env_site_admin_email,
+        send_alert(
             subject=env_site_name + ": Unsafe URL submitted",
             content="Unsafe URL Submitted.<br/><br/>URL Slug: " + short_url_slug
         )
@@ -78,70 +88,242 @@ def get_shortened_url(db, req_original_url: str):
         return "UNSAFE"
 
 
-def check_short_url_exists(db, short_url: str) -> bool:
-    logger.debug("check_short_url_exists() called.")
+# Hash a URL is looked up by: hex SHA-256 of the URL (urlx_hash) or SHA-256 bytes of the canonical URL (urlx_hash_bin)
+def get_url_lookup_hash(url: str):
+    return generate_url_key(url) if URL_HASH_BINARY else generate_url_hash(url)
+
+
+def get_lookup_cache_key(lookup_hash):
+    return "key:" + lookup_hash.hex() if URL_HASH_BINARY else "hash:" + lookup_hash
+
 
-    cursor = db.cursor()
-    query = "SELECT COUNT(*) FROM urls WHERE urlx_is_safe = true AND urlx_slug = %s"
-    cursor.execute(query, (short_url,))
-    count = cursor.fetchone()[0]
-    cursor.close()
-    return count > 0
+# Column values of a new urls row, in the order of URL_INSERT_COLUMNS
+def get_url_row(original_url: str, short_url_slug: str, url_is_safe: bool, unsafe_details: str):
+    row = (original_url, generate_url_hash(original_url), short_url_slug, url_is_safe, unsafe_details)
+    if URL_HASH_BINARY:
+        row += (generate_url_key(original_url),)
+    return row
 
 
+@timed("query:create_url")
 def create_url(db, req_original_url: str, short_url_slug: str, url_is_safe: bool, unsafe_details: str):
     logger.debug("create_url() called.")
 
-    # Generate the hash for the original url
-    original_url_hash = generate_url_hash(req_original_url)
-
     # Insert into database
-    cursor = db.cursor()
-    query = ("INSERT INTO urls (urlx_original_url, urlx_hash, urlx_slug, urlx_is_safe, urlx_unsafe_details) VALUES ("
-             "%s, %s, %s, %s, %s)")
-    cursor.execute(query, (req_original_url, original_url_hash, short_url_slug, url_is_safe, unsafe_details))
-    db.commit()
-    cursor.close()
-    logger.info("Inserted new url in database - slug: " + short_url_slug)
+    get_storage().insert_urls(db, URL_INSERT_COLUMNS,
+                              [get_url_row(req_original_url, short_url_slug, url_is_safe, unsafe_details)])
+
+    # Drop any cached "not found" results for the new slug and URL, and read both from the primary until replicated
+    lookup_hash = get_url_lookup_hash(req_original_url)
+    invalidate_slug(short_url_slug)
+    shared_cache.invalidate("redirect:" + short_url_slug, get_lookup_cache_key(lookup_hash))
+    record_write(short_url_slug, lookup_hash)
+    if url_is_safe:
+        slug_filter.add_slug(short_url_slug)
+    logger.info("Inserted new url in database - slug: %s", short_url_slug)
+
+
+def create_url_with_new_slug(db, req_original_url: str, url_is_safe: bool, unsafe_details: str):
+    logger.debug("create_url_with_new_slug() called.")
+
+    # Insert and let the unique indexes catch duplicates, instead of checking the slug first
+    for attempt in range(slug_allocator.SLUG_MAX_ATTEMPTS):
+        short_url_slug = slug_allocator.allocate_slug(db)
+        try:
+            create_url(db, req_original_url, short_url_slug, url_is_safe, unsafe_details)
+            return short_url_slug
+        except DuplicateKeyError as e:
+            # The same URL was inserted concurrently by another request - use its slug
+            if e.key == "hash":
+                existing_slug = get_url_by_original_url_hash_from_db(db, get_url_lookup_hash(req_original_url))
+                if existing_slug is None and URL_HASH_BINARY:
+                    # Same URL in a row the hash backfill has not reached yet
+                    existing_slug = get_url_by_original_url_hash_from_db(db, generate_url_hash(req_original_url),
+                                                                         "urlx_hash")
+                if existing_slug is not None:
+                    logger.info("create_url_with_new_slug() :: URL inserted concurrently, slug: %s", existing_slug)
+                    return existing_slug
+                raise
+
+            slug_allocator.record_collision(will_retry=attempt + 1 < slug_allocator.SLUG_MAX_ATTEMPTS)
+            logger.info("create_url_with_new_slug() :: Slug collision: %s, attempt: %d", short_url_slug, attempt + 1)
+
+    slug_allocator.record_failure()
+    raise ValueError(f"Could not allocate a unique slug after {slug_allocator.SLUG_MAX_ATTEMPTS} attempts")
+
+
+@timed("query:get_urls_by_hashes")
+def get_urls_by_hashes(db, original_url_hashes: list) -> dict:
+    logger.debug("get_urls_by_hashes() called.")
+
+    # lookup hash (see get_url_lookup_hash()) -> {"slug": ..., "is_safe": ...}, one IN (...) query per batch
+    return get_storage().find_urls_by_hashes(db, LOOKUP_HASH_COLUMN, original_url_hashes)
+
+
+@timed("query:create_urls_bulk")
+def create_urls_bulk(db, new_urls: list) -> dict:
+    logger.debug("create_urls_bulk() called.")
+
+    # new_urls: list of (original_url, url_is_safe, unsafe_details) - returns original_url -> slug
+    # All rows go in with one multi-row INSERT per batch and one commit. On a duplicate key (slug collision, or a URL
+    # inserted concurrently) the transaction is rolled back, URLs that now exist are dropped and the rest retried.
+    pending = list(new_urls)
+    created = {}
+    for attempt in range(slug_allocator.SLUG_MAX_ATTEMPTS):
+        rows = [get_url_row(original_url, slug_allocator.allocate_slug(db), url_is_safe, unsafe_details)
+                for original_url, url_is_safe, unsafe_details in pending]
+        lookup_hashes = [row[5] if URL_HASH_BINARY else row[1] for row in rows]
+        try:
+            get_storage().insert_urls(db, URL_INSERT_COLUMNS, rows)
+        except DuplicateKeyError as e:
+            slug_allocator.record_collision(will_retry=attempt + 1 < slug_allocator.SLUG_MAX_ATTEMPTS)
+            logger.info("create_urls_bulk() :: Duplicate key, retrying: %s", e)
+
+            existing = get_urls_by_hashes(db, lookup_hashes)
+            for row, lookup_hash in zip(rows, lookup_hashes):
+                if lookup_hash in existing:
+                    created[row[0]] = existing[lookup_hash]["slug"]
+            if URL_HASH_BINARY:
+                # Same URLs in rows the hash backfill has not reached yet, like in create_url_with_new_slug()
+                hex_hashes = [row[1] for row in rows if row[0] not in created]
+                existing = get_storage().find_urls_by_hashes(db, "urlx_hash", hex_hashes) if hex_hashes else {}
+                for row in rows:
+                    if row[1] in existing:
+                        created[row[0]] = existing[row[1]]["slug"]
+            pending = [item for item in pending if item[0] not in created]
+            continue
+
+        for row, lookup_hash in zip(rows, lookup_hashes):
+            original_url, short_url_slug = row[0], row[2]
+            created[original_url] = short_url_slug
+            invalidate_slug(short_url_slug)
+            shared_cache.invalidate("redirect:" + short_url_slug, get_lookup_cache_key(lookup_hash))
+            record_write(short_url_slug, lookup_hash)
+            if row[3]:
+                slug_filter.add_slug(short_url_slug)
+        logger.info("create_urls_bulk() :: Inserted %d new urls in database.", len(rows))
+        return created
+
+    slug_allocator.record_failure()
+    raise ValueError(f"Could not insert bulk urls after {slug_allocator.SLUG_MAX_ATTEMPTS} attempts")
 
 
 def get_url_by_original_url(db, req_original_url: str):
     logger.debug("get_url_by_original_url() called.")
 
-    # Generate the hash for the original url
-    original_url_hash = generate_url_hash(req_original_url)
+    # Generate the lookup hash for the original url
+    lookup_hash = get_url_lookup_hash(req_original_url)
+
+    # Check the shared cache first, only one caller per URL queries the DB on a miss
+    return shared_cache.load(get_lookup_cache_key(lookup_hash),
+                             lambda: read_from_replica(get_url_by_original_url_hash_from_db, db, lookup_hash))
+
+
+@timed("query:get_url_by_original_url_hash_from_db")
+def get_url_by_original_url_hash_from_db(db, original_url_hash, hash_column: str = LOOKUP_HASH_COLUMN):
+    logger.debug("get_url_by_original_url_hash_from_db() called.")
 
-    cursor = db.cursor(dictionary=True)
-    query = "SELECT urlx_id, urlx_slug FROM urls WHERE urlx_hash = %s LIMIT 1"
-    cursor.execute(query, (original_url_hash,))
-    result = cursor.fetchone()
-    cursor.close()
-    if result:
-        return result.get('urlx_slug')  # Safely get the 'urlx_slug' value
-    return None  # Return None if no result is found
+    return get_storage().find_slug_by_hash(db, hash_column, original_url_hash)
 
 
 def get_url_by_slug(db, req_slug: str):
     logger.debug("get_url_by_slug() called.")
 
-    cursor = db.cursor(dictionary=True)
-    query = "SELECT urlx_id, urlx_original_url FROM urls WHERE urlx_is_safe = true AND urlx_slug = %s"
-    cursor.execute(query, (req_slug,))
-    result = cursor.fetchone()
-    cursor.close()
-    if result:
-        return result.get('urlx_original_url')  # Safely get the 'urlx_original_url' value
-    return None  # Return None if no result is found
+    redirect = get_redirect(db, req_slug)
+    return redirect[0] if redirect is not None else None
+
+
+# (original URL, redirect status, cache TTL) of a slug, or None - see helpers/redirects.py for the policy defaults
+def get_redirect(db, req_slug: str):
+    logger.debug("get_redirect() called.")
+
+    # Check the in-process cache first - cached redirects are dropped whenever a link changes
+    cached_redirect = slug_cache.get(req_slug)
+    if cached_redirect is NOT_FOUND:
+        return None
+    if cached_redirect is not None:
+        return cached_redirect
+
+    # Slugs the filter has never seen (random / mistyped slugs) are answered without any lookup
+    if not slug_filter.might_contain(req_slug):
+        return None
+
+    # Then the shared cache, only one caller per slug queries the DB on a miss
+    redirect = redirects.decode_redirect(shared_cache.load(
+        "redirect:" + req_slug,
+        lambda: redirects.encode_redirect(read_from_replica(get_redirect_from_db, db, req_slug))))
+    cached_value = NOT_FOUND if redirect is None else redirect
+    slug_cache.set(req_slug, cached_value, get_slug_cache_ttl(cached_value))
+    if redirect is None:
+        slug_filter.record_false_positive()
+    return redirect
+
+
+@timed("query:get_redirect_from_db")
+def get_redirect_from_db(db, req_slug: str):
+    logger.debug("get_redirect_from_db() called.")
+
+    return get_storage().find_redirect(db, req_slug)
 
 
 def update_url_visit_count(db, req_slug: str):
     logger.debug("update_url_visit_count() called.")
 
-    cursor = db.cursor()
-    query = "UPDATE urls SET urlx_visit_count = urlx_visit_count + 1 WHERE urlx_is_safe = true AND urlx_slug = %s"
-    cursor.execute(query, (req_slug,))
-    db.commit()
-    cursor.close()
+    # Buffer the visit in memory, it is written in a batch by the visit counter flusher
+    if visit_counter.is_buffered():
+        visit_counter.add_visit(req_slug)
+        return
+
+    with stage_timer("query:update_url_visit_count"):
+        get_storage().increment_visits(db, {req_slug: 1})
+
+
+@timed("query:update_url_visit_counts")
+def update_url_visit_counts(db, slug_counts: dict):
+    logger.debug("update_url_visit_counts() called.")
+
+    # One multi-row UPDATE per batch of slugs, committed once
+    get_storage().increment_visits(db, slug_counts)
+
+
+@timed("query:update_url_is_safe")
+def update_url_is_safe(db, req_slug: str, url_is_safe: bool, unsafe_details: str = None):
+    logger.debug("update_url_is_safe() called.")
+
+    get_storage().update_is_safe(db, req_slug, url_is_safe, unsafe_details)
+
+    # Cached redirects must not outlive a change of the safety flag - in this process, the shared cache and nginx
+    invalidate_redirect(req_slug)
+    if url_is_safe:
+        slug_filter.add_slug(req_slug)
+        record_write(req_slug)
+    else:
+        redirects.purge(req_slug)
+    logger.info("update_url_is_safe() :: Updated safety flag - slug: %s, is_safe: %s", req_slug, url_is_safe)
+
+
+@timed("query:update_redirect_policy")
+def update_redirect_policy(db, req_slug: str, redirect_status: int = None, cache_ttl: int = None):
+    logger.debug("update_redirect_policy() called.")
+
+    # None = the defaults (REDIRECT_STATUS / REDIRECT_CACHE_TTL)
+    redirects.validate_redirect_status(redirect_status)
+    redirects.validate_cache_ttl(cache_ttl)
+    get_storage().update_redirect_policy(db, req_slug, redirect_status, cache_ttl)
+
+    invalidate_redirect(req_slug)
+    redirects.purge(req_slug)
+    logger.info("update_redirect_policy() :: Updated redirect policy - slug: %s, status: %s, cache_ttl: %s",
+                req_slug, redirect_status, cache_ttl)
+
+
+def invalidate_redirect(req_slug: str):
+    logger.debug("invalidate_redirect() called.")
+
+    # This worker drops the slug now, the others clear their slug cache on their next check
+    invalidate_slug(req_slug)
+    shared_cache.invalidate("redirect:" + req_slug)
+    announce_invalidation()
 
 
 def extract_slug(full_short_url: str) -> str:
@@ -0,0 +1,277 @@
+import os
+from dotenv import load_dotenv
+from starlette.datastructures import Headers
+from starlette.responses import FileResponse
+from starlette.staticfiles import StaticFiles, NotModifiedResponse
+import gzip
+import hashlib
+import json
+import mimetypes
+import re
+
+# Import helper functions
+from helpers.common import initialize_logging, templates, get_accepted_encodings
+
+# Load environment variables
+load_dotenv()
+
+# Initialize logging
+logger = initialize_logging("assets.py")
+
+# Static asset settings
+# - ASSETS_DIST_DIR: output of the asset build (fingerprinted and precompressed files + manifest.json)
+# - ASSETS_BUILD_ON_STARTUP: run the asset build when a worker starts (otherwise run: python build_assets.py)
+# - ASSETS_PURGE_CSS: drop CSS rules whose classes / ids are not used by the templates or scripts
+# - ASSETS_PURGE_CSS_SAFELIST: extra class names to keep, e.g. classes only added by 3rd party scripts
+ASSETS_SOURCE_DIR = "assets"
+ASSETS_DIST_DIR = os.getenv("ASSETS_DIST_DIR", "dist/assets")
+ASSETS_BUILD_ON_STARTUP = os.getenv("ASSETS_BUILD_ON_STARTUP", "false").lower() == "true"
+ASSETS_PURGE_CSS = os.getenv("ASSETS_PURGE_CSS", "false").lower() == "true"
+ASSETS_PURGE_CSS_SAFELIST = [name.strip() for name in os.getenv(
+    "ASSETS_PURGE_CSS_SAFELIST", "show,showing,hide,hiding,fade,collapse,collapsing,active,disabled,"
+                                 "was-validated,is-valid,is-invalid,modal-open,modal-backdrop").split(",")
+                             if name.strip()]
+
+ASSETS_URL_PREFIX = "/assets/"
+MANIFEST_FILENAME = "manifest.json"
+
+# Files that get .gz / .br siblings - images like PNG are compressed already
+COMPRESSIBLE_EXTENSIONS = (".css", ".js", ".svg", ".json", ".webmanifest", ".ico", ".txt")
+PRECOMPRESSED_ENCODINGS = (("br", ".br"), ("gzip", ".gz"))
+
+# Fingerprinted files never change, any other file is revalidated
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+DEFAULT_CACHE_CONTROL = "no-cache"
+
+FINGERPRINT_LENGTH = 10
+
+# Logical path ("css/styles.css") -> fingerprinted path ("css/styles.0a1b2c3d4e.css")
+_manifest = {}
+_fingerprinted_paths = set()
+
+
+def fingerprint_path(path: str, content: bytes):
+    digest = hashlib.sha256(content).hexdigest()[:FINGERPRINT_LENGTH]
+    base, extension = os.path.splitext(path)
+    return base + "." + digest + extension
+
+
+def _write_file(path: str, content: bytes):
+    # Write to a temp file and rename, so workers never serve a half written file
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = path + ".tmp" + str(os.getpid())
+    with open(tmp_path, "wb") as f:
+        f.write(content)
+    os.replace(tmp_path, path)
+
+
+def _compress(path: str, content: bytes):
+    _write_file(path + ".gz", gzip.compress(content, compresslevel=9, mtime=0))
+    try:
+        import brotli
+        _write_file(path + ".br", brotli.compress(content, quality=11))
+    except ImportError:
+        pass
+
+
+# -- CSS purge --
+
+def get_used_selectors(templates_dir: str, scripts_dir: str):
+    logger.debug("get_used_selectors() called.")
+
+    classes = set(ASSETS_PURGE_CSS_SAFELIST)
+    ids = set()
+    for directory, pattern in ((templates_dir, r"\.html$"), (scripts_dir, r"\.js$")):
+        for root, _, filenames in os.walk(directory):
+            for filename in filenames:
+                if not re.search(pattern, filename):
+                    continue
+                with open(os.path.join(root, filename), encoding="utf-8") as f:
+                    text = f.read()
+                # Jinja expressions inside attributes are not class names
+                text = re.sub(r"\{\{.*?\}\}|\{%.*?%\}", " ", text)
+                for value in re.findall(r"class\s*=\s*[\"']([^\"']*)[\"']", text):
+                    classes.update(value.split())
+                for value in re.findall(r"id\s*=\s*[\"']([^\"']*)[\"']", text):
+                    ids.update(value.split())
+                # Classes set from scripts: classList.add('x'), classList.toggle('x'), querySelector('.x')
+                for value in re.findall(r"classList\.\w+\(\s*[\"']([\w-]+)[\"']", text):
+                    classes.add(value)
+                for value in re.findall(r"querySelector(?:All)?\(\s*[\"']([^\"']+)[\"']", text):
+                    classes.update(re.findall(r"\.([\w-]+)", value))
+                    ids.update(re.findall(r"#([\w-]+)", value))
+    return classes, ids
+
+
+def _split_css_blocks(css: str):
+    # Top level items of a stylesheet: (prelude, body) for blocks, (statement, None) for "@import ...;" and the like
+    items = []
+    depth = 0
+    start = 0
+    body_start = None
+    i = 0
+    length = len(css)
+    while i < length:
+        char = css[i]
+        if char == "/" and css.startswith("/*", i):
+            end = css.find("*/", i + 2)
+            i = length if end == -1 else end + 2
+            continue
+        if char in "\"'":
+            end = i + 1
+            while end < length and css[end] != char:
+                end += 2 if css[end] == "\\" else 1
+            i = end + 1
+            continue
+        if char == "{":
+            if depth == 0:
+                body_start = i + 1
+            depth += 1
+        elif char == "}":
+            depth -= 1
+            if depth == 0:
+                items.append((css[start:body_start - 1].strip(), css[body_start:i]))
+                start = i + 1
+        elif char == ";" and depth == 0:
+            items.append((css[start:i + 1].strip(), None))
+            start = i + 1
+        i += 1
+    return items
+
+
+def _split_selectors(prelude: str):
+    # Split a selector list on commas that are not inside :is(.a, .b) and the like
+    selectors = []
+    depth = 0
+    start = 0
+    for i, char in enumerate(prelude):
+        if char == "(":
+            depth += 1
+        elif char == ")":
+            depth -= 1
+        elif char == "," and depth == 0:
+            selectors.append(prelude[start:i].strip())
+            start = i + 1
+    selectors.append(prelude[start:].strip())
+    return selectors
+
+
+def _is_selector_used(selector: str, classes: set, ids: set):
+    # Classes inside :not(), :is(), :where() and :has() are not required to be present
+    selector = re.sub(r":(?:not|is|where|has)\([^)]*\)", "", selector)
+    selector = re.sub(r"\[[^\]]*\]", "", selector)
+    return (all(name in classes for name in re.findall(r"\.(-?[_a-zA-Z][\w-]*)", selector))
+            and all(name in ids for name in re.findall(r"#(-?[_a-zA-Z][\w-]*)", selector)))
+
+
+def purge_css(css: str, classes: set, ids: set):
+    logger.debug("purge_css() called.")
+
+    output = []
+    for prelude, body in _split_css_blocks(css):
+        prelude = re.sub(r"/\*.*?\*/", "", prelude, flags=re.S).strip()
+        if body is None:
+            output.append(prelude)
+        elif prelude.startswith(("@media", "@supports", "@container", "@layer")):
+            inner = purge_css(body, classes, ids)
+            if inner:
+                output.append(prelude + "{" + inner + "}")
+        elif prelude.startswith("@"):
+            # @font-face, @keyframes, @page, ... are kept as they are
+            output.append(prelude + "{" + body + "}")
+        else:
+            selectors = [selector for selector in _split_selectors(prelude)
+                         if _is_selector_used(selector, classes, ids)]
+            if selectors:
+                output.append(",".join(selectors) + "{" + body.strip() + "}")
+    return "\n".join(output)
+
+
+# -- Build --
+
+def build_assets(purge: bool = ASSETS_PURGE_CSS):
+    logger.debug("build_assets() called.")
+
+    used_classes, used_ids = (get_used_selectors(templates.env.loader.searchpath[0], ASSETS_SOURCE_DIR)
+                              if purge else (None, None))
+    manifest = {}
+    for root, _, filenames in os.walk(ASSETS_SOURCE_DIR):
+        for filename in sorted(filenames):
+            source_path = os.path.join(root, filename)
+            path = os.path.relpath(source_path, ASSETS_SOURCE_DIR).replace(os.sep, "/")
+            with open(source_path, "rb") as f:
+                content = f.read()
+            if purge and path.endswith(".css"):
+                purged = purge_css(content.decode("utf-8"), used_classes, used_ids).encode("utf-8")
+                logger.info("build_assets() :: Purged CSS %s: %d -> %d bytes", path, len(content), len(purged))
+                content = purged
+
+            dist_path = fingerprint_path(path, content)
+            full_dist_path = os.path.join(ASSETS_DIST_DIR, dist_path)
+            if not os.path.exists(full_dist_path):
+                _write_file(full_dist_path, content)
+                if path.endswith(COMPRESSIBLE_EXTENSIONS):
+                    _compress(full_dist_path, content)
+            manifest[path] = dist_path
+
+    # Files of earlier builds are kept, pages cached by browsers may still reference them
+    _write_file(os.path.join(ASSETS_DIST_DIR, MANIFEST_FILENAME), json.dumps(manifest, indent=2).encode("utf-8"))
+    logger.info("build_assets() :: Built %d assets into %s", len(manifest), ASSETS_DIST_DIR)
+    load_manifest()
+    return manifest
+
+
+def load_manifest():
+    global _manifest, _fingerprinted_paths
+    logger.debug("load_manifest() called.")
+
+    try:
+        with open(os.path.join(ASSETS_DIST_DIR, MANIFEST_FILENAME), encoding="utf-8") as f:
+            manifest = json.load(f)
+    except FileNotFoundError:
+        logger.info("load_manifest() :: No asset build found, serving assets without fingerprints.")
+        manifest = {}
+    _manifest = manifest
+    _fingerprinted_paths = set(manifest.values())
+    return manifest
+
+
+# URL of an asset, fingerprinted once the asset build has run - used as {{ asset_url('css/styles.css') }}
+def asset_url(path: str):
+    return ASSETS_URL_PREFIX + _manifest.get(path, path)
+
+
+templates.env.globals["asset_url"] = asset_url
+
+
+# StaticFiles serving the asset build (falling back to the source assets) with precompressed variants
+class AssetStaticFiles(StaticFiles):
+    def __init__(self):
+        super().__init__(directory=ASSETS_SOURCE_DIR)
+        self.all_directories = [ASSETS_DIST_DIR, ASSETS_SOURCE_DIR]
+
+    def file_response(self, full_path, stat_result, scope, status_code=200):
+        request_headers = Headers(scope=scope)
+        path = os.path.relpath(full_path, os.path.realpath(ASSETS_DIST_DIR)).replace(os.sep, "/")
+        media_type = mimetypes.guess_type(str(full_path))[0] or "text/plain"
+
+        headers = {"cache-control": IMMUTABLE_CACHE_CONTROL if path in _fingerprinted_paths else DEFAULT_CACHE_CONTROL}
+        if str(full_path).endswith(COMPRESSIBLE_EXTENSIONS):
+            headers["vary"] = "Accept-Encoding"
+            accepted = get_accepted_encodings(request_headers.get("accept-encoding", ""))
+            for encoding, suffix in PRECOMPRESSED_ENCODINGS:
+                if encoding not in accepted and "*" not in accepted:
+                    continue
+                try:
+                    compressed_stat = os.stat(str(full_path) + suffix)
+                except OSError:
+                    continue
+                full_path, stat_result = str(full_path) + suffix, compressed_stat
+                headers["content-encoding"] = encoding
+                break
+
+        response = FileResponse(full_path, status_code=status_code, stat_result=stat_result,
+                                media_type=media_type, headers=headers)
+        if self.is_not_modified(response.headers, request_headers):
+            return NotModifiedResponse(response.headers)
+        return response
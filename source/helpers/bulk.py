@@ -0,0 +1,134 @@
+import os
+from dotenv import load_dotenv
+import json
+
+# Import helper functions
+from helpers.common import initialize_logging
+from helpers.concurrency import run_blocking
+from helpers.db_connection import async_pooled_connection
+from helpers.alerts import send_alert
+from helpers.url import validate_url, check_urls_safety
+from helpers.app import get_url_lookup_hash, get_urls_by_hashes, create_urls_bulk
+
+# Load environment variables
+load_dotenv()
+
+# Initialize logging
+logger = initialize_logging("bulk.py")
+
+# Bulk API settings
+# - BULK_API_MAX_URLS: max URLs accepted per call
+# - BULK_API_CHUNK_SIZE: URLs processed (deduped, checked, inserted in one transaction) at a time
+# - BULK_API_STREAM_THRESHOLD: inputs larger than this are answered with streamed NDJSON
+BULK_API_MAX_URLS = int(os.getenv("BULK_API_MAX_URLS", "50000"))
+BULK_API_CHUNK_SIZE = int(os.getenv("BULK_API_CHUNK_SIZE", "1000"))
+BULK_API_STREAM_THRESHOLD = int(os.getenv("BULK_API_STREAM_THRESHOLD", "1000"))
+
+
+# Parse the request body: JSON {"urls": [...]} or NDJSON with one URL (string or {"url": ...}) per line
+def parse_bulk_request(body: bytes, content_type: str):
+    logger.debug("parse_bulk_request() called.")
+
+    try:
+        if content_type.startswith("application/x-ndjson"):
+            urls = []
+            for line in body.decode("utf-8").splitlines():
+                if not line.strip():
+                    continue
+                item = json.loads(line)
+                urls.append(item.get("url") if isinstance(item, dict) else item)
+        else:
+            urls = json.loads(body).get("urls")
+    except (ValueError, AttributeError):
+        raise ValueError("Request body must be JSON {\"urls\": [...]} or NDJSON")
+
+    if not isinstance(urls, list) or not all(isinstance(url, str) for url in urls):
+        raise ValueError("urls must be a list of strings")
+    if len(urls) > BULK_API_MAX_URLS:
+        raise ValueError(f"Too many urls, max {BULK_API_MAX_URLS} per call")
+    return urls
+
+
+async def shorten_chunk(db, urls: list, current_domain: str):
+    logger.debug("shorten_chunk() called.")
+
+    # Validate and dedupe by hash
+    results = {}
+    hashes = {}
+    for url in urls:
+        if url in results or url in hashes:
+            continue
+        if not validate_url(url):
+            results[url] = {"original_url": url, "status": "invalid"}
+        else:
+            hashes[url] = get_url_lookup_hash(url)
+
+    # Existing URLs - one IN (...) query
+    existing = await run_blocking(get_urls_by_hashes, db, list(set(hashes.values())))
+    new_urls = []
+    first_url_by_hash = {}
+    for url, url_hash in hashes.items():
+        if url_hash in existing:
+            results[url] = {"original_url": url, "slug": existing[url_hash]["slug"],
+                            "status": "existing" if existing[url_hash]["is_safe"] else "unsafe"}
+        elif url_hash not in first_url_by_hash:
+            # URLs with the same canonical form (URL_HASH_BINARY) are inserted once
+            first_url_by_hash[url_hash] = url
+            new_urls.append(url)
+
+    # Safety check of new URLs in batches, then one bulk insert
+    if new_urls:
+        verdicts = await check_urls_safety(new_urls)
+        created = await run_blocking(create_urls_bulk, db, [(url, verdicts[url]["is_safe"], json.dumps(verdicts[url]))
+                                                            for url in new_urls])
+        unsafe_slugs = []
+        for url in new_urls:
+            results[url] = {"original_url": url, "slug": created[url],
+                            "status": "created" if verdicts[url]["is_safe"] else "unsafe"}
+            if not verdicts[url]["is_safe"]:
+                unsafe_slugs.append(created[url])
+        for url, url_hash in hashes.items():
+            if url not in results:
+                results[url] = dict(results[first_url_by_hash[url_hash]], original_url=url)
+
+        # Queue one email alert to Site Admin per chunk with unsafe URLs
+        if unsafe_slugs:
+            logger.info("shorten_chunk() :: Sending email alert - Unsafe URLs have been submitted.")
+            send_alert(
+                subject=os.getenv('SITE_NAME') + ": Unsafe URLs submitted (bulk API)",
+                content="Unsafe URLs Submitted.<br/><br/>URL Slugs: " + ", ".join(unsafe_slugs)
+            )
+
+    # Unsafe URLs get no short URL, same as the form
+    chunk_results = []
+    for url in urls:
+        result = dict(results[url])
+        if result["status"] in ("created", "existing"):
+            result["short_url"] = current_domain + "/" + result["slug"]
+        else:
+            result.pop("slug", None)
+        chunk_results.append(result)
+    return chunk_results
+
+
+# Shorten the URLs chunk by chunk, yielding the results of each chunk in input order
+async def shorten_urls_bulk(urls: list, current_domain: str):
+    logger.debug("shorten_urls_bulk() called.")
+
+    async with async_pooled_connection() as db:
+        for start in range(0, len(urls), BULK_API_CHUNK_SIZE):
+            yield await shorten_chunk(db, urls[start:start + BULK_API_CHUNK_SIZE], current_domain)
+
+
+async def stream_ndjson(urls: list, current_domain: str):
+    # The 200 status is sent before the first chunk is done - a failing chunk cannot turn the response into an error,
+    # so the URLs not processed yet get one error line each instead of the response being cut off
+    processed = 0
+    try:
+        async for chunk_results in shorten_urls_bulk(urls, current_domain):
+            processed += len(chunk_results)
+            yield "".join(json.dumps(result) + "\n" for result in chunk_results)
+    except Exception as e:
+        logger.info("stream_ndjson() :: Bulk shortening failed after %d of %d urls: %s", processed, len(urls), e)
+        error = {"status": "error", "detail": "URL not processed, please retry"}
+        yield "".join(json.dumps(dict(original_url=url, **error)) + "\n" for url in urls[processed:])
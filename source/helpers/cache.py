@@ -0,0 +1,218 @@
+import os
+from dotenv import load_dotenv
+from collections import OrderedDict
+import threading
+import time
+import uuid
+
+# Import helper functions
+from helpers.common import initialize_logging
+from helpers import shared_cache
+
+# Load environment variables
+load_dotenv()
+
+# Initialize logging
+logger = initialize_logging("cache.py")
+
+# Slug cache settings (per gunicorn worker process)
+# - SLUG_CACHE_MAX_SIZE: max number of slugs kept, least recently used are evicted first (0 = disabled)
+# - SLUG_CACHE_TTL: seconds a found slug is cached
+# - SLUG_CACHE_NEGATIVE_TTL: seconds a not-found slug is cached
+SLUG_CACHE_MAX_SIZE = int(os.getenv("SLUG_CACHE_MAX_SIZE", "10000"))
+SLUG_CACHE_TTL = float(os.getenv("SLUG_CACHE_TTL", "300"))
+SLUG_CACHE_NEGATIVE_TTL = float(os.getenv("SLUG_CACHE_NEGATIVE_TTL", "30"))
+
+# Changes of a link by another worker or process (flagged unsafe, new redirect policy, e.g. python manage_link.py)
+# - SLUG_CACHE_INVALIDATION_INTERVAL: seconds between checks of the invalidation key in the shared cache - a worker
+#   clears its slug cache when another one changed a link
+# - SLUG_CACHE_MAX_STALE: without a shared cache, changes cannot be announced - if set, slugs are cached at most this
+#   long instead of SLUG_CACHE_TTL / SLUG_CACHE_NEGATIVE_TTL (0 = no limit)
+SLUG_CACHE_INVALIDATION_INTERVAL = float(os.getenv("SLUG_CACHE_INVALIDATION_INTERVAL", "1"))
+SLUG_CACHE_MAX_STALE = float(os.getenv("SLUG_CACHE_MAX_STALE", "0"))
+
+# Shared cache key holding a new random value after each change of a link
+INVALIDATION_KEY = "slug-cache-invalidation"
+
+# Marker for a cached "not found" result, so that it can be told apart from a cache miss
+NOT_FOUND = object()
+
+
+class LRUCache:
+    def __init__(self, max_size, ttl, negative_ttl=None):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.negative_ttl = ttl if negative_ttl is None else negative_ttl
+
+        # key -> (value, expires_at), ordered from least to most recently used
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+        # Stats
+        self._hits = 0
+        self._negative_hits = 0
+        self._misses = 0
+        self._evictions = 0
+        self._expirations = 0
+        self._invalidations = 0
+
+    # Returns the cached value, NOT_FOUND for a cached negative result, or None on a cache miss
+    def get(self, key):
+        if self.max_size <= 0:
+            return None
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self._misses += 1
+                return None
+
+            value, expires_at = entry
+            if expires_at <= time.monotonic():
+                del self._entries[key]
+                self._expirations += 1
+                self._misses += 1
+                return None
+
+            self._entries.move_to_end(key)
+            if value is NOT_FOUND:
+                self._negative_hits += 1
+            else:
+                self._hits += 1
+            return value
+
+    # Like get(), without counting the lookup or refreshing the entry's position
+    def peek(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[1] <= time.monotonic():
+                return None
+            return entry[0]
+
+    def set(self, key, value, ttl=None):
+        if self.max_size <= 0:
+            return
+
+        if ttl is None:
+            ttl = self.negative_ttl if value is NOT_FOUND else self.ttl
+        if ttl <= 0:
+            return
+
+        with self._lock:
+            self._entries[key] = (value, time.monotonic() + ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self._evictions += 1
+
+    def invalidate(self, key):
+        with self._lock:
+            if self._entries.pop(key, None) is not None:
+                self._invalidations += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self._hits + self._negative_hits + self._misses
+            return {
+                "max_size": self.max_size,
+                "size": len(self._entries),
+                "hits": self._hits,
+                "negative_hits": self._negative_hits,
+                "misses": self._misses,
+                "hit_ratio": (self._hits + self._negative_hits) / lookups if lookups else 0.0,
+                "evictions": self._evictions,
+                "expirations": self._expirations,
+                "invalidations": self._invalidations,
+            }
+
+
+# Slug -> (original URL, redirect status, cache TTL) cache, used by get_redirect()
+slug_cache = LRUCache(SLUG_CACHE_MAX_SIZE, SLUG_CACHE_TTL, SLUG_CACHE_NEGATIVE_TTL)
+
+
+# Last value of INVALIDATION_KEY seen by this worker, and the watcher thread reading it
+_invalidation_value = None
+_invalidation_clears = 0
+_stopping = threading.Event()
+_watcher = None
+_watcher_pid = None
+
+
+def invalidate_slug(slug: str):
+    logger.debug("invalidate_slug() called.")
+
+    slug_cache.invalidate(slug)
+
+
+# TTL of a slug cache entry - capped when other workers cannot announce changes of the link
+def get_slug_cache_ttl(value):
+    ttl = SLUG_CACHE_NEGATIVE_TTL if value is NOT_FOUND else SLUG_CACHE_TTL
+    if shared_cache.backend is None and SLUG_CACHE_MAX_STALE > 0:
+        ttl = min(ttl, SLUG_CACHE_MAX_STALE)
+    return ttl
+
+
+# Tell every worker to drop its cached redirects - called after a link changed
+def announce_invalidation():
+    logger.debug("announce_invalidation() called.")
+
+    shared_cache.set_value(INVALIDATION_KEY, uuid.uuid4().hex)
+
+
+# Clear the slug cache if a link was changed since the last check
+def check_invalidations():
+    global _invalidation_value, _invalidation_clears
+
+    value = shared_cache.get_value(INVALIDATION_KEY)
+    if value is not None and value != _invalidation_value:
+        _invalidation_value = value
+        slug_cache.clear()
+        _invalidation_clears += 1
+        logger.info("cache :: Link changed by another worker, slug cache cleared.")
+
+
+def _run_watcher():
+    global _invalidation_value
+
+    # Changes made before this worker started are in the DB already
+    _invalidation_value = shared_cache.get_value(INVALIDATION_KEY)
+    while not _stopping.wait(SLUG_CACHE_INVALIDATION_INTERVAL):
+        check_invalidations()
+
+
+def start():
+    global _watcher, _watcher_pid
+    logger.debug("cache.start() called.")
+
+    if SLUG_CACHE_MAX_SIZE <= 0:
+        return
+    if shared_cache.backend is None:
+        if SLUG_CACHE_MAX_STALE <= 0:
+            logger.warning("cache.start() :: No shared cache - link changes by other workers or manage_link.py reach "
+                           "this worker only after SLUG_CACHE_TTL (%ss) or SLUG_CACHE_MAX_STALE.", SLUG_CACHE_TTL)
+        return
+    if _watcher is None or _watcher_pid != os.getpid():
+        _stopping.clear()
+        _watcher = threading.Thread(target=_run_watcher, name="slug-cache-invalidation", daemon=True)
+        _watcher.start()
+        _watcher_pid = os.getpid()
+
+
+def stop():
+    global _watcher
+    logger.debug("cache.stop() called.")
+
+    if _watcher is not None and _watcher_pid == os.getpid():
+        _stopping.set()
+        _watcher.join(timeout=5)
+        _watcher = None
+
+
+def get_cache_stats():
+    logger.debug("get_cache_stats() called.")
+
+    return {"slug_cache": slug_cache.stats(), "invalidation_clears": _invalidation_clears}
@@ -1,9 +1,14 @@
 import os
 from dotenv import load_dotenv
-import requests
+import hashlib
+import time
+import httpx
 
 # Import helper functions
 from helpers.common import initialize_logging
+from helpers.http_client import get_http_client
+from helpers.cache import LRUCache
+from helpers.metrics import stage_timer
 
 # Load environment variables
 load_dotenv()
@@ -11,6 +16,41 @@ load_dotenv()
 # Initialize logging
 logger = initialize_logging("captcha.py")
 
+# reCAPTCHA verify endpoint (can point to a local stub server)
+RECAPTCHA_VERIFY_URL = os.getenv("RECAPTCHA_VERIFY_URL", "https://www.google.com/recaptcha/api/siteverify")
+
+# Captcha verification settings (per worker)
+# - CAPTCHA_VERIFIER: "recaptcha", or "fake" for tests and local development (accepts tokens starting with
+#   CAPTCHA_FAKE_TOKEN - tokens are single use, so send e.g. "fake-token-1", "fake-token-2", ...)
+# - CAPTCHA_TIMEOUT / CAPTCHA_CONNECT_TIMEOUT: seconds a verify call may take in total / to connect
+# - CAPTCHA_BREAKER_FAILURES: consecutive failed verify calls after which the verifier is skipped (circuit open)
+# - CAPTCHA_BREAKER_RESET: seconds the circuit stays open before one trial call is let through
+# - CAPTCHA_FAIL_OPEN: accept forms while the verifier is unavailable (true) or reject them (false)
+# - CAPTCHA_REPLAY_TTL / CAPTCHA_REPLAY_CACHE_SIZE: seconds / number of used tokens kept to reject replays
+CAPTCHA_VERIFIER = os.getenv("CAPTCHA_VERIFIER", "recaptcha").lower()
+CAPTCHA_FAKE_TOKEN = os.getenv("CAPTCHA_FAKE_TOKEN", "fake-token")
+CAPTCHA_TIMEOUT = float(os.getenv("CAPTCHA_TIMEOUT", "3"))
+CAPTCHA_CONNECT_TIMEOUT = float(os.getenv("CAPTCHA_CONNECT_TIMEOUT", "1"))
+CAPTCHA_BREAKER_FAILURES = int(os.getenv("CAPTCHA_BREAKER_FAILURES", "5"))
+CAPTCHA_BREAKER_RESET = float(os.getenv("CAPTCHA_BREAKER_RESET", "30"))
+CAPTCHA_FAIL_OPEN = os.getenv("CAPTCHA_FAIL_OPEN", "false").lower() == "true"
+CAPTCHA_REPLAY_TTL = int(os.getenv("CAPTCHA_REPLAY_TTL", "120"))
+CAPTCHA_REPLAY_CACHE_SIZE = int(os.getenv("CAPTCHA_REPLAY_CACHE_SIZE", "10000"))
+
+# reCAPTCHA tokens are at most a few KB, anything longer is not sent to the verifier
+MAX_TOKEN_LENGTH = 8192
+
+# Tokens seen by this worker, keyed by their SHA-256 - every token is single use
+used_tokens = LRUCache(CAPTCHA_REPLAY_CACHE_SIZE, CAPTCHA_REPLAY_TTL)
+
+_stats = {"verified": 0, "rejected": 0, "missing": 0, "replays": 0, "errors": 0, "circuit_open": 0,
+          "fail_open_accepted": 0}
+
+# Circuit breaker - verify calls all run on the worker's event loop, so no lock is needed
+_consecutive_failures = 0
+_opened_at = None
+_trial_in_flight = False
+
 
 def get_recaptcha_secret_key():
     logger.debug("get_recaptcha_secret_key() called.")
@@ -22,14 +62,151 @@ def get_recaptcha_secret_key():
     return recaptcha_secret_key
 
 
-def verify_recaptcha(token: str):
+# Raised by verifiers when no verdict could be obtained (timeout, connection error, bad response)
+class CaptchaUnavailableError(Exception):
+    pass
+
+
+# Verifier interface - returns True if the token is valid
+class CaptchaVerifier:
+    async def verify(self, token, remote_ip=None):
+        raise NotImplementedError
+
+
+class RecaptchaVerifier(CaptchaVerifier):
+    def __init__(self, verify_url):
+        self.verify_url = verify_url
+        self.timeout = httpx.Timeout(CAPTCHA_TIMEOUT, connect=CAPTCHA_CONNECT_TIMEOUT)
+
+    async def verify(self, token, remote_ip=None):
+        payload = {
+            'secret': get_recaptcha_secret_key(),
+            'response': token
+        }
+        if remote_ip:
+            payload['remoteip'] = remote_ip
+        try:
+            with stage_timer("captcha"):
+                response = await get_http_client().post(self.verify_url, data=payload, timeout=self.timeout)
+            response.raise_for_status()
+            result = response.json()
+        except (httpx.HTTPError, ValueError) as e:
+            raise CaptchaUnavailableError(f"reCAPTCHA verify call failed: {type(e).__name__}: {str(e).splitlines()[0] if str(e) else ''}")
+        if not result.get("success", False):
+            logger.info("RecaptchaVerifier :: Token rejected: %s", result.get("error-codes"))
+        return bool(result.get("success", False))
+
+
+# Accepts any token with the given prefix, like reCAPTCHA hands out a new token per form
+class FakeCaptchaVerifier(CaptchaVerifier):
+    def __init__(self, token_prefix):
+        self.token_prefix = token_prefix
+
+    async def verify(self, token, remote_ip=None):
+        return token.startswith(self.token_prefix)
+
+
+def create_verifier(name):
+    logger.debug("create_verifier() called.")
+
+    if name == "recaptcha":
+        return RecaptchaVerifier(RECAPTCHA_VERIFY_URL)
+    if name == "fake":
+        return FakeCaptchaVerifier(CAPTCHA_FAKE_TOKEN)
+    raise ValueError(f"Unknown captcha verifier: '{name}'")
+
+
+verifier = create_verifier(CAPTCHA_VERIFIER)
+
+
+def set_verifier(new_verifier):
+    global verifier
+    verifier = new_verifier
+
+
+# -- Circuit breaker --
+
+def _is_call_allowed():
+    global _trial_in_flight
+
+    if _opened_at is None:
+        return True
+    # Open: skip the verifier until the reset time has passed, then let one trial call through
+    if time.monotonic() - _opened_at < CAPTCHA_BREAKER_RESET or _trial_in_flight:
+        return False
+    _trial_in_flight = True
+    return True
+
+
+def _record_success():
+    global _consecutive_failures, _opened_at, _trial_in_flight
+
+    if _opened_at is not None:
+        logger.info("captcha :: Verifier available again, circuit closed.")
+    _consecutive_failures = 0
+    _opened_at = None
+    _trial_in_flight = False
+
+
+def _record_failure():
+    global _consecutive_failures, _opened_at, _trial_in_flight
+
+    _consecutive_failures += 1
+    _trial_in_flight = False
+    if _opened_at is not None or _consecutive_failures >= CAPTCHA_BREAKER_FAILURES:
+        if _opened_at is None:
+            logger.info("captcha :: %d verify calls failed in a row, circuit opened for %ss.", _consecutive_failures,
+                        CAPTCHA_BREAKER_RESET)
+        _opened_at = time.monotonic()
+
+
+def _unavailable_verdict():
+    if CAPTCHA_FAIL_OPEN:
+        _stats["fail_open_accepted"] += 1
+        return True
+    _stats["rejected"] += 1
+    return False
+
+
+async def verify_recaptcha(token: str, remote_ip: str = None):
+    global _trial_in_flight
     logger.debug("verify_recaptcha() called.")
 
-    recaptcha_secret_key = get_recaptcha_secret_key()
-    payload = {
-        'secret': recaptcha_secret_key,
-        'response': token
-    }
-    response = requests.post("https://www.google.com/recaptcha/api/siteverify", data=payload)
-    result = response.json()
-    return result.get("success", False)
+    if not token or len(token) > MAX_TOKEN_LENGTH:
+        _stats["missing"] += 1
+        return False
+
+    # A token is only valid once - replays are rejected without a remote call
+    token_key = hashlib.sha256(token.encode("utf-8")).digest()
+    if used_tokens.get(token_key) is not None:
+        _stats["replays"] += 1
+        logger.info("verify_recaptcha() :: Replayed token rejected.")
+        return False
+
+    if not _is_call_allowed():
+        _stats["circuit_open"] += 1
+        return _unavailable_verdict()
+
+    try:
+        is_valid = await verifier.verify(token, remote_ip)
+    except CaptchaUnavailableError as e:
+        _stats["errors"] += 1
+        _record_failure()
+        logger.info("verify_recaptcha() :: %s", e)
+        return _unavailable_verdict()
+    except Exception:
+        # Not an outage (e.g. no secret key set) - never let it decide the verdict, but free the trial call
+        _trial_in_flight = False
+        raise
+    _record_success()
+
+    used_tokens.set(token_key, True)
+    _stats["verified" if is_valid else "rejected"] += 1
+    return is_valid
+
+
+def get_captcha_stats():
+    stats = dict(_stats)
+    stats["circuit"] = "closed" if _opened_at is None else "open"
+    stats["consecutive_failures"] = _consecutive_failures
+    return stats
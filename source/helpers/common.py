@@ -4,6 +4,8 @@ import logging
 from fastapi.templating import Jinja2Templates
 import re
 
+from helpers.logs import configure_logging
+
 # Load environment variables
 load_dotenv()
 
@@ -11,24 +13,10 @@ load_dotenv()
 templates = Jinja2Templates(directory="templates")
 
 
+# Logger of a helper module - logging itself is configured once per process, see helpers/logs.py
 def initialize_logging(filename):
-    print("init_logging() called - file: " + filename)
-    # -- Initialize logging --
-    # Default log level if the environment variable is not set
-    default_log_level = 'INFO'
-
-    # Get the log level from the environment variable
-    env_log_level = os.getenv('LOG_LEVEL', default_log_level).upper()
-
-    # Map the string log level to the logging level
-    log_level = getattr(logging, env_log_level, logging.INFO)
-    print("LOG_LEVEL: " + env_log_level)
-
-    logging.basicConfig(level=log_level,
-                        format='%(asctime)s | %(levelname)s | %(filename)s | %(message)s',
-                        datefmt='%Y-%m-%d %H:%M:%S')
-    logger = logging.getLogger(__name__)
-    return logger
+    configure_logging()
+    return logging.getLogger(os.path.splitext(filename)[0])
 
 
 # Initialize logging
@@ -38,19 +26,19 @@ logger = initialize_logging("common.py")
 def error_page(request, error_code, error_message):
     logger.info("error_page() called.")
 
-    # Env
-    env_site_name = os.getenv("SITE_NAME")
-
-    return templates.TemplateResponse(
-            "error.html",
-            {
-                "request": request,
-                "SITE_NAME": env_site_name,
-                "error_code": error_code,
-                "error_message": error_message,
-            },
-            status_code=error_code
-        )
+    # Pre-rendered once per error code and message
+    from helpers.pages import get_error_page, page_response
+    return page_response(request, get_error_page(error_code, error_message), status_code=error_code)
+
+
+# Content codings the client accepts (Accept-Encoding header), without the ones refused with q=0
+def get_accepted_encodings(accept_encoding):
+    accepted = set()
+    for item in accept_encoding.split(","):
+        coding, _, params = item.strip().partition(";")
+        if params.replace(" ", "") not in ("q=0", "q=0.0", "q=0.00", "q=0.000"):
+            accepted.add(coding.strip().lower())
+    return accepted
 
 
 def extract_filename_with_relative_path(log_entry):
@@ -0,0 +1,38 @@
+import os
+from dotenv import load_dotenv
+import functools
+import anyio
+
+# Import helper functions
+from helpers.common import initialize_logging
+
+# Load environment variables
+load_dotenv()
+
+# Initialize logging
+logger = initialize_logging("concurrency.py")
+
+# Max threads used for blocking calls (DB queries, SendGrid) made from async handlers, per worker
+BLOCKING_THREADPOOL_SIZE = int(os.getenv("BLOCKING_THREADPOOL_SIZE", "20"))
+
+# Created on first use, as it has to be created inside the running event loop
+_limiter = None
+
+
+def get_limiter():
+    global _limiter
+    if _limiter is None:
+        _limiter = anyio.CapacityLimiter(BLOCKING_THREADPOOL_SIZE)
+    return _limiter
+
+
+# Run a blocking function in the bounded thread pool, so that it does not stall the event loop
+async def run_blocking(func, *args, **kwargs):
+    return await anyio.to_thread.run_sync(functools.partial(func, *args, **kwargs), limiter=get_limiter())
+
+
+def get_threadpool_stats():
+    # The limiter only exists once a blocking call has been made in this worker
+    if _limiter is None:
+        return {"size": BLOCKING_THREADPOOL_SIZE, "in_use": 0}
+    return {"size": BLOCKING_THREADPOOL_SIZE, "in_use": _limiter.borrowed_tokens}
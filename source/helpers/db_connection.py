@@ -3,9 +3,17 @@ from dotenv import load_dotenv
 import mysql.connector
 from mysql.connector import Error
 import logging
+import itertools
+import queue
+import threading
+import time
+from contextlib import contextmanager, asynccontextmanager
 
 # Import helper functions
+from helpers.cache import LRUCache
 from helpers.common import initialize_logging
+from helpers.concurrency import run_blocking
+from helpers.metrics import timed
 
 # Load environment variables from .env file
 load_dotenv()
@@ -19,17 +27,56 @@ DATABASE_USER = os.getenv("DATABASE_USER")
 DATABASE_PASSWORD = os.getenv("DATABASE_PASSWORD")
 DATABASE_NAME = os.getenv("DATABASE_NAME")
 
+# Connection pool settings (per gunicorn worker process)
+# - DATABASE_POOL_SIZE: connections kept open and reused
+# - DATABASE_POOL_MAX_OVERFLOW: extra connections opened under load, closed when returned
+# - DATABASE_POOL_PRE_PING: ping connections on checkout and reconnect if they went stale
+# - DATABASE_POOL_RECYCLE: max lifetime of a connection in seconds (0 = no limit)
+# - DATABASE_POOL_TIMEOUT: max seconds to wait for a free connection
+DATABASE_POOL_SIZE = int(os.getenv("DATABASE_POOL_SIZE", "5"))
+DATABASE_POOL_MAX_OVERFLOW = int(os.getenv("DATABASE_POOL_MAX_OVERFLOW", "10"))
+DATABASE_POOL_PRE_PING = os.getenv("DATABASE_POOL_PRE_PING", "true").lower() == "true"
+DATABASE_POOL_RECYCLE = int(os.getenv("DATABASE_POOL_RECYCLE", "3600"))
+DATABASE_POOL_TIMEOUT = float(os.getenv("DATABASE_POOL_TIMEOUT", "10"))
 
-def create_connection():
+# Read replicas (optional, per gunicorn worker)
+# - DATABASE_REPLICA_HOSTS: comma-separated host[:port] list - slug and URL lookups are spread over them round-robin,
+#   writes always go to DATABASE_HOST (empty = no replicas, all queries go to DATABASE_HOST)
+# - DATABASE_REPLICA_MAX_LAG: replicas further behind the primary than this many seconds are skipped
+# - DATABASE_REPLICA_CHECK_INTERVAL: seconds between health / lag checks of the replicas (run in a background thread)
+# - DATABASE_REPLICA_POOL_SIZE: connections kept open per replica
+# - DATABASE_REPLICA_CONNECT_TIMEOUT: seconds before connecting to (or reading from) a replica fails - a replica that
+#   is down does not hold up lookups, they go to the primary
+DATABASE_REPLICA_HOSTS = [host.strip() for host in os.getenv("DATABASE_REPLICA_HOSTS", "").split(",") if host.strip()]
+DATABASE_REPLICA_MAX_LAG = float(os.getenv("DATABASE_REPLICA_MAX_LAG", "5"))
+DATABASE_REPLICA_CHECK_INTERVAL = float(os.getenv("DATABASE_REPLICA_CHECK_INTERVAL", "10"))
+DATABASE_REPLICA_POOL_SIZE = int(os.getenv("DATABASE_REPLICA_POOL_SIZE", "5"))
+DATABASE_REPLICA_CONNECT_TIMEOUT = int(os.getenv("DATABASE_REPLICA_CONNECT_TIMEOUT", "2"))
+
+# Max seconds to wait for a free replica connection - a busy replica is skipped rather than waited for
+REPLICA_POOL_TIMEOUT = 0.1
+
+# Max number of slugs / URL hashes remembered as written by this worker (see record_write())
+RECENT_WRITES_MAX_SIZE = 10000
+
+
+@timed("db_connect")
+def create_connection(host: str = None, timeout: int = None):
     logger.debug("create_connection() called.")
 
+    # host: "host[:port]", defaults to the primary (DATABASE_HOST)
+    # timeout: connect / socket timeout in seconds, defaults to the connector's
+    host, _, port = (host or DATABASE_HOST or "").partition(":")
+    options = {"connection_timeout": timeout} if timeout else {}
     connection = None
     try:
         connection = mysql.connector.connect(
-            host=DATABASE_HOST,
+            host=host or None,
+            port=int(port) if port else 3306,
             user=DATABASE_USER,
             passwd=DATABASE_PASSWORD,
-            database=DATABASE_NAME
+            database=DATABASE_NAME,
+            **options
         )
         logging.info("Successfully connected to the database")
     except Error as e:
@@ -37,11 +84,466 @@ def create_connection():
     return connection
 
 
-def get_db_connection():
-    logger.debug("get_db_connection() called.")
+def create_replica_connection(host: str):
+    return create_connection(host, timeout=DATABASE_REPLICA_CONNECT_TIMEOUT)
+
+
+class ConnectionPool:
+    def __init__(self, size, max_overflow, pre_ping, recycle, timeout, connect=create_connection):
+        self.size = size
+        self.max_overflow = max_overflow
+        self.pre_ping = pre_ping
+        self.recycle = recycle
+        self.timeout = timeout
+        self.connect = connect
+
+        # Idle connections, stored as (connection, created_at)
+        self._idle = queue.LifoQueue()
+        self._lock = threading.Lock()
+        self._total = 0
+        self._in_use = 0
+
+        # Stats
+        self._checkouts = 0
+        self._wait_time_total = 0.0
+        self._wait_time_max = 0.0
+        self._timeouts = 0
+
+    def _open(self):
+        return self.connect(), time.monotonic()
+
+    def _discard(self, connection):
+        try:
+            connection.close()
+        except Error:
+            pass
+        with self._lock:
+            self._total -= 1
+
+    def _is_expired(self, created_at):
+        return self.recycle > 0 and time.monotonic() - created_at > self.recycle
+
+    @timed("db_checkout")
+    def checkout(self):
+        logger.debug("ConnectionPool.checkout() called.")
+
+        started = time.monotonic()
+        deadline = started + self.timeout
+        while True:
+            entry = None
+            can_open = False
+            try:
+                entry = self._idle.get_nowait()
+            except queue.Empty:
+                with self._lock:
+                    if self._total < self.size + self.max_overflow:
+                        self._total += 1
+                        can_open = True
+
+            if entry is None and not can_open:
+                # Pool exhausted - wait for a connection to be returned
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    with self._lock:
+                        self._timeouts += 1
+                    raise ValueError(f"DB connection pool timeout: no connection available after {self.timeout}s")
+                # Wait in short slices so that slots freed by discarded connections are noticed
+                try:
+                    entry = self._idle.get(timeout=min(remaining, 0.1))
+                except queue.Empty:
+                    continue
+
+            if can_open:
+                try:
+                    entry = self._open()
+                except ValueError:
+                    with self._lock:
+                        self._total -= 1
+                    raise
+
+            connection, created_at = entry
+
+            # Drop connections past their max lifetime
+            if self._is_expired(created_at):
+                self._discard(connection)
+                continue
+
+            # Health check on checkout
+            if self.pre_ping:
+                try:
+                    connection.ping(reconnect=True, attempts=1, delay=0)
+                except Error:
+                    logger.info("ConnectionPool.checkout() :: Stale connection discarded.")
+                    self._discard(connection)
+                    continue
+
+            waited = time.monotonic() - started
+            with self._lock:
+                self._in_use += 1
+                self._checkouts += 1
+                self._wait_time_total += waited
+                self._wait_time_max = max(self._wait_time_max, waited)
+            return connection, created_at
+
+    def release(self, connection, created_at):
+        logger.debug("ConnectionPool.release() called.")
+
+        with self._lock:
+            self._in_use -= 1
+
+        # Never hand a connection with an open transaction to the next request
+        try:
+            connection.rollback()
+        except Error:
+            self._discard(connection)
+            return
+
+        if self._is_expired(created_at) or self._idle.qsize() >= self.size:
+            # Overflow connections are closed instead of being kept idle
+            self._discard(connection)
+            return
+        self._idle.put((connection, created_at))
+
+    def close(self):
+        logger.debug("ConnectionPool.close() called.")
+
+        while True:
+            try:
+                connection, _ = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            self._discard(connection)
+
+    def stats(self):
+        with self._lock:
+            checkouts = self._checkouts
+            return {
+                "size": self.size,
+                "max_overflow": self.max_overflow,
+                "total": self._total,
+                "in_use": self._in_use,
+                "idle": self._idle.qsize(),
+                "checkouts": checkouts,
+                "timeouts": self._timeouts,
+                "wait_time_total": self._wait_time_total,
+                "wait_time_avg": self._wait_time_total / checkouts if checkouts else 0.0,
+                "wait_time_max": self._wait_time_max,
+            }
+
+
+# Process-wide pool, created lazily so that each gunicorn worker gets its own after fork
+_pool = None
+_pool_pid = None
+_pool_lock = threading.Lock()
+
+
+def get_pool():
+    global _pool, _pool_pid
+
+    pid = os.getpid()
+    if _pool is None or _pool_pid != pid:
+        with _pool_lock:
+            if _pool is None or _pool_pid != pid:
+                # Imported here to avoid circular imports (the storage backends use create_connection())
+                from helpers.storage import get_storage
+
+                _pool = ConnectionPool(
+                    size=DATABASE_POOL_SIZE,
+                    max_overflow=DATABASE_POOL_MAX_OVERFLOW,
+                    pre_ping=DATABASE_POOL_PRE_PING,
+                    recycle=DATABASE_POOL_RECYCLE,
+                    timeout=DATABASE_POOL_TIMEOUT,
+                    connect=lambda: get_storage().connect()
+                )
+                _pool_pid = pid
+    return _pool
+
+
+def get_pool_stats():
+    logger.debug("get_pool_stats() called.")
+
+    return get_pool().stats()
+
+
+def close_pool():
+    logger.debug("close_pool() called.")
+
+    if _pool is not None and _pool_pid == os.getpid():
+        _pool.close()
+    if _replica_set is not None and _replica_set_pid == os.getpid():
+        _replica_set.close()
+
+
+# -- Read replicas --
+
+class Replica:
+    def __init__(self, host, connect):
+        self.host = host
+        self.pool = ConnectionPool(
+            size=DATABASE_REPLICA_POOL_SIZE,
+            max_overflow=DATABASE_POOL_MAX_OVERFLOW,
+            pre_ping=DATABASE_POOL_PRE_PING,
+            recycle=DATABASE_POOL_RECYCLE,
+            timeout=REPLICA_POOL_TIMEOUT,
+            connect=lambda: connect(host)
+        )
+
+        # Health state, updated by the checker thread of ReplicaSet - a new replica is not used before its first check
+        self.healthy = False
+        self.lag = None
+
+        # Stats
+        self.reads = 0
+        self.misses = 0
+        self.errors = 0
+
+    # Seconds behind the primary, None if replication is stopped - a server that is no replica reports 0
+    def get_lag(self):
+        db, created_at = self.pool.checkout()
+        try:
+            cursor = db.cursor(dictionary=True)
+            try:
+                cursor.execute("SHOW REPLICA STATUS")
+            except Error:
+                # MySQL before 8.0.22 / MariaDB before 10.5.1
+                cursor.execute("SHOW SLAVE STATUS")
+            rows = cursor.fetchall()
+            cursor.close()
+        finally:
+            self.pool.release(db, created_at)
+
+        if not rows:
+            return 0.0
+        lag = rows[0].get("Seconds_Behind_Source", rows[0].get("Seconds_Behind_Master"))
+        return None if lag is None else float(lag)
+
+
+class ReplicaSet:
+    def __init__(self, hosts, connect=create_replica_connection):
+        self.replicas = [Replica(host, connect) for host in hosts]
+        self._counter = itertools.count()
+        self._lock = threading.Lock()
+        self._fallbacks = 0
+        self._rereads = 0
+
+        # Background health / lag checks, so that a slow or unreachable replica never delays a request
+        self._stopping = threading.Event()
+        self._checker = None
+
+    def _check_replica(self, replica):
+        try:
+            lag = replica.get_lag()
+            healthy = lag is not None and lag <= DATABASE_REPLICA_MAX_LAG
+            reason = "replication stopped" if lag is None else "lag %ss" % lag
+        except Exception as e:
+            lag, healthy, reason = None, False, str(e)
+
+        with self._lock:
+            was_healthy = replica.healthy
+            replica.healthy = healthy
+            replica.lag = lag
+        if healthy != was_healthy:
+            logger.info("ReplicaSet :: Replica %s %s (%s).", replica.host, "in use" if healthy else "skipped",
+                        reason)
+
+    def check(self):
+        logger.debug("ReplicaSet.check() called.")
 
-    db = create_connection()
+        for replica in self.replicas:
+            self._check_replica(replica)
+
+    def _run_checker(self):
+        while not self._stopping.is_set():
+            self.check()
+            self._stopping.wait(DATABASE_REPLICA_CHECK_INTERVAL)
+
+    def start(self):
+        logger.debug("ReplicaSet.start() called.")
+
+        if self._checker is None:
+            self._stopping.clear()
+            self._checker = threading.Thread(target=self._run_checker, name="replica-checker", daemon=True)
+            self._checker.start()
+
+    def stop(self):
+        logger.debug("ReplicaSet.stop() called.")
+
+        if self._checker is not None:
+            self._stopping.set()
+            self._checker.join(timeout=5)
+            self._checker = None
+
+    # Next healthy replica, round-robin - returns (replica, connection, created_at), or None to use the primary.
+    # Only reads the state of the last check - no query runs here besides the lookup itself.
+    def checkout(self):
+        logger.debug("ReplicaSet.checkout() called.")
+
+        start = next(self._counter)
+        for offset in range(len(self.replicas)):
+            replica = self.replicas[(start + offset) % len(self.replicas)]
+            if not replica.healthy:
+                continue
+            try:
+                db, created_at = replica.pool.checkout()
+            except ValueError as e:
+                self.mark_down(replica, e)
+                continue
+            return replica, db, created_at
+        return None
+
+    # Skip a failing replica until its next check
+    def mark_down(self, replica, error):
+        with self._lock:
+            replica.errors += 1
+            if not replica.healthy:
+                return
+            replica.healthy = False
+        logger.info("ReplicaSet :: Replica %s skipped (%s).", replica.host, error)
+
+    def record_read(self, replica, found):
+        with self._lock:
+            if found:
+                replica.reads += 1
+            else:
+                replica.misses += 1
+
+    def record_fallback(self):
+        with self._lock:
+            self._fallbacks += 1
+
+    def record_reread(self):
+        with self._lock:
+            self._rereads += 1
+
+    def close(self):
+        self.stop()
+        for replica in self.replicas:
+            replica.pool.close()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "fallbacks": self._fallbacks,
+                "rereads": self._rereads,
+                "replicas": {replica.host: {"healthy": replica.healthy, "lag": replica.lag, "reads": replica.reads,
+                                            "misses": replica.misses, "errors": replica.errors}
+                             for replica in self.replicas},
+            }
+
+
+# Process-wide replica set, created lazily per gunicorn worker like the pool (None without DATABASE_REPLICA_HOSTS)
+_replica_set = None
+_replica_set_pid = None
+
+
+def get_replica_set():
+    global _replica_set, _replica_set_pid
+
+    if not DATABASE_REPLICA_HOSTS:
+        return None
+    pid = os.getpid()
+    if _replica_set is None or _replica_set_pid != pid:
+        with _pool_lock:
+            if _replica_set is None or _replica_set_pid != pid:
+                _replica_set = ReplicaSet(DATABASE_REPLICA_HOSTS)
+                _replica_set_pid = pid
+    return _replica_set
+
+
+def set_replica_set(replica_set):
+    global _replica_set, _replica_set_pid
+
+    _replica_set = replica_set
+    _replica_set_pid = os.getpid()
+
+
+# Start the replica checks of this worker - until a replica passed its first check, lookups go to the primary
+def start_replica_checks():
+    logger.debug("start_replica_checks() called.")
+
+    replica_set = get_replica_set()
+    if replica_set is not None:
+        # Imported here to avoid circular imports, like in get_pool()
+        from helpers.storage import require_mysql
+
+        require_mysql("DATABASE_REPLICA_HOSTS")
+        replica_set.start()
+
+
+# Run a read query func(db, *args) on a replica. The primary connection db is used instead when no replica is healthy,
+# the replica fails, or the replica finds nothing - the row may not have replicated yet (read-your-writes).
+def read_from_replica(func, db, *args):
+    replica_set = _replica_set if _replica_set_pid == os.getpid() else get_replica_set()
+    if replica_set is None:
+        return func(db, *args)
+
+    checked_out = replica_set.checkout()
+    if checked_out is None:
+        replica_set.record_fallback()
+        return func(db, *args)
+
+    replica, replica_db, created_at = checked_out
+    result = None
+    failed = False
+    try:
+        result = func(replica_db, *args)
+        replica_set.record_read(replica, bool(result))
+    except Error as e:
+        replica_set.mark_down(replica, e)
+        failed = True
+    finally:
+        replica.pool.release(replica_db, created_at)
+    if failed:
+        return func(db, *args)
+
+    # A miss is only read again from the primary when it can be replication lag: the replica was behind at its last
+    # check, or the row was written by this worker within the last DATABASE_REPLICA_MAX_LAG seconds
+    if result or not (replica.lag or any(_recent_writes.peek(arg) for arg in args)):
+        return result
+    replica_set.record_reread()
+    return func(db, *args)
+
+
+# Slugs / URL hashes written by this worker - lookups of them may miss on a replica for a while (read your writes)
+_recent_writes = LRUCache(RECENT_WRITES_MAX_SIZE, DATABASE_REPLICA_MAX_LAG)
+
+
+def record_write(*keys):
+    for key in keys:
+        _recent_writes.set(key, True)
+
+
+def get_replica_stats():
+    logger.debug("get_replica_stats() called.")
+
+    replica_set = get_replica_set()
+    return replica_set.stats() if replica_set is not None else {"fallbacks": 0, "rereads": 0, "replicas": {}}
+
+
+# Borrow a pooled connection outside of a request, e.g. in background jobs
+@contextmanager
+def pooled_connection():
+    pool = get_pool()
+    db, created_at = pool.checkout()
+    try:
+        yield db
+    finally:
+        pool.release(db, created_at)
+
+
+# Same as pooled_connection(), for async code - checkout and release run in the blocking thread pool
+@asynccontextmanager
+async def async_pooled_connection():
+    pool = get_pool()
+    db, created_at = await run_blocking(pool.checkout)
     try:
         yield db
     finally:
-        db.close()
+        await run_blocking(pool.release, db, created_at)
+
+
+def get_db_connection():
+    logger.debug("get_db_connection() called.")
+
+    with pooled_connection() as db:
+        yield db
@@ -12,6 +12,16 @@ load_dotenv()
 # Initialize logging
 logger = initialize_logging("email.py")
 
+# SendGrid API client, created once and reused
+_sendgrid_client = None
+
+
+def get_sendgrid_client(sendgrid_api_key):
+    global _sendgrid_client
+    if _sendgrid_client is None:
+        _sendgrid_client = SendGridAPIClient(sendgrid_api_key)
+    return _sendgrid_client
+
 
 def send_email(to_email, subject, content):
     logger.debug("send_email() called.")
@@ -29,8 +39,8 @@ def send_email(to_email, subject, content):
     )
 
     try:
-        # Create the SendGrid API client
-        sg = SendGridAPIClient(sendgrid_api_key)
+        # Get the shared SendGrid API client
+        sg = get_sendgrid_client(sendgrid_api_key)
 
         # Send the email
         response = sg.send(message)
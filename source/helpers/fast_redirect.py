@@ -0,0 +1,113 @@
+import os
+from dotenv import load_dotenv
+from functools import lru_cache
+from urllib.parse import quote
+import re
+
+# Import helper functions
+from helpers.common import initialize_logging
+from helpers.logs import is_sampled
+from helpers.pages import get_error_page
+from helpers.cache import slug_cache, NOT_FOUND, SLUG_CACHE_MAX_SIZE
+from helpers.concurrency import run_blocking
+from helpers.db_connection import pooled_connection
+from helpers import visit_counter
+from helpers import visit_events
+from helpers.redirects import get_redirect_status, get_cache_headers
+from helpers.app import get_redirect, update_url_visit_count
+
+# Load environment variables
+load_dotenv()
+
+# Initialize logging
+logger = initialize_logging("fast_redirect.py")
+
+# Redirect fast path settings
+# - FAST_REDIRECT_ENABLED: serve GET /{slug} from an ASGI middleware instead of the FastAPI route
+FAST_REDIRECT_ENABLED = os.getenv("FAST_REDIRECT_ENABLED", "true").lower() == "true"
+
+# Only plain slugs take the fast path, anything else is left to the FastAPI routes
+FAST_REDIRECT_PATH_PATTERN = re.compile(r"^/([0-9A-Za-z]{1,20})$")
+
+# Same escaping as starlette's RedirectResponse
+LOCATION_SAFE_CHARS = ":/%#?=@[]!$&'()*+,;"
+
+# Response headers of the redirect to url - same as RedirectResponse(url), the cache headers are added per response
+@lru_cache(maxsize=SLUG_CACHE_MAX_SIZE)
+def get_redirect_headers(url: str):
+    return [(b"content-length", b"0"), (b"location", quote(url, safe=LOCATION_SAFE_CHARS).encode("latin-1"))]
+
+
+def _get_header(scope, name: bytes):
+    for key, value in scope["headers"]:
+        if key == name:
+            return value.decode("latin-1")
+    return ""
+
+
+def _lookup_slug(slug: str):
+    # Cache miss - same lookup and visit count as the FastAPI route, on one pooled connection
+    with pooled_connection() as db:
+        redirect = get_redirect(db, slug)
+        if redirect is not None:
+            update_url_visit_count(db, slug)
+    return redirect
+
+
+def _count_visit(slug: str):
+    with pooled_connection() as db:
+        update_url_visit_count(db, slug)
+
+
+# ASGI middleware serving GET /{slug} without routing or dependency injection
+class FastRedirectMiddleware:
+    def __init__(self, app):
+        self.app = app
+        self.reserved_paths = None
+
+    def _get_reserved_paths(self, scope):
+        # Static routes and mounts of the app (/, /get-original-url, /docs, /assets, ...) keep their own handlers
+        if self.reserved_paths is None:
+            self.reserved_paths = {route.path for route in scope["app"].router.routes
+                                   if "{" not in getattr(route, "path", "{")}
+        return self.reserved_paths
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] != "GET" or scope.get("root_path"):
+            await self.app(scope, receive, send)
+            return
+
+        path = scope["path"]
+        match = FAST_REDIRECT_PATH_PATTERN.match(path)
+        if match is None or path in self._get_reserved_paths(scope):
+            await self.app(scope, receive, send)
+            return
+
+        slug = match.group(1)
+        redirect = slug_cache.get(slug)
+        if redirect is None:
+            redirect = await run_blocking(_lookup_slug, slug)
+        elif redirect is not NOT_FOUND:
+            if visit_counter.is_buffered():
+                visit_counter.add_visit(slug)
+            else:
+                await run_blocking(_count_visit, slug)
+
+        if redirect is None or redirect is NOT_FOUND:
+            if is_sampled():
+                logger.info("fast_redirect :: Short URL slug not found: %s", slug)
+            # Same pre-rendered page as error_page(request, error_code=404, error_message="URL not found")
+            status, headers, body = get_error_page(404, "URL not found").respond(
+                404, _get_header(scope, b"accept-encoding"), _get_header(scope, b"if-none-match"))
+            await send({"type": "http.response.start", "status": status, "headers": headers})
+            await send({"type": "http.response.body", "body": body})
+            return
+
+        original_url = redirect[0]
+        logger.debug("fast_redirect :: Short URL slug found: %s, original_url: %s", slug, original_url)
+        if visit_events.VISIT_EVENTS_ENABLED:
+            visit_events.record_visit(slug, _get_header(scope, b"referer"), _get_header(scope, b"user-agent"),
+                                      _get_header(scope, b"x-real-ip") or (scope.get("client") or ("",))[0])
+        await send({"type": "http.response.start", "status": get_redirect_status(redirect),
+                    "headers": get_redirect_headers(original_url) + get_cache_headers(redirect)})
+        await send({"type": "http.response.body", "body": b""})
@@ -0,0 +1,41 @@
+import os
+from dotenv import load_dotenv
+import httpx
+
+# Import helper functions
+from helpers.common import initialize_logging
+
+# Load environment variables
+load_dotenv()
+
+# Initialize logging
+logger = initialize_logging("http_client.py")
+
+# Shared outbound HTTP client settings (reCAPTCHA, Safe Browsing)
+HTTP_CLIENT_TIMEOUT = float(os.getenv("HTTP_CLIENT_TIMEOUT", "5"))
+HTTP_CLIENT_MAX_CONNECTIONS = int(os.getenv("HTTP_CLIENT_MAX_CONNECTIONS", "50"))
+HTTP_CLIENT_MAX_KEEPALIVE = int(os.getenv("HTTP_CLIENT_MAX_KEEPALIVE", "20"))
+
+# One keep-alive client per worker, created on first use
+_client = None
+
+
+def get_http_client():
+    global _client
+    if _client is None or _client.is_closed:
+        logger.debug("get_http_client() :: Creating shared HTTP client.")
+        _client = httpx.AsyncClient(
+            timeout=HTTP_CLIENT_TIMEOUT,
+            limits=httpx.Limits(max_connections=HTTP_CLIENT_MAX_CONNECTIONS,
+                                max_keepalive_connections=HTTP_CLIENT_MAX_KEEPALIVE)
+        )
+    return _client
+
+
+async def close_http_client():
+    global _client
+    logger.debug("close_http_client() called.")
+
+    if _client is not None:
+        await _client.aclose()
+        _client = None
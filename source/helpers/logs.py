@@ -0,0 +1,193 @@
+import os
+from dotenv import load_dotenv
+from contextvars import ContextVar
+import atexit
+import json
+import logging
+import logging.handlers
+import queue
+import random
+import re
+import sys
+import threading
+import time
+
+# Load environment variables
+load_dotenv()
+
+# Logging settings (one logging setup per process, shared by all helper modules)
+# - LOG_LEVEL: DEBUG, INFO, WARNING, ERROR
+# - LOG_FORMAT: text (one line per record) or json (one JSON object per line, with the request id)
+# - LOG_QUEUE_SIZE: records buffered for the background writer thread, further records are dropped - 0 writes inline
+# - LOG_SAMPLE_RATE: share of requests whose high-volume redirect path info lines are logged (0 - 1)
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_FORMAT = os.getenv("LOG_FORMAT", "text").lower()
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+LOG_SAMPLE_RATE = float(os.getenv("LOG_SAMPLE_RATE", "1"))
+
+TEXT_FORMAT = "%(asctime)s | %(levelname)s | %(filename)s | %(request_id)s | %(message)s"
+DATE_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+REQUEST_ID_HEADER = b"x-request-id"
+
+# Request ids taken over from the client / nginx, anything else gets a new id
+REQUEST_ID_PATTERN = re.compile(r"^[0-9A-Za-z._-]{1,64}$")
+
+# (request id, sampled) of the request being handled - copied into threads started by run_blocking()
+_request_context = ContextVar("request_context", default=("-", None))
+
+_stats = {"dropped": 0}
+
+_configured = False
+_configured_lock = threading.Lock()
+_queue_handler = None
+
+
+# -- Request context --
+
+def get_request_id():
+    return _request_context.get()[0]
+
+
+# True if the high-volume info lines of the current request are logged - decided once per request
+def is_sampled():
+    sampled = _request_context.get()[1]
+    if sampled is None:
+        return LOG_SAMPLE_RATE >= 1 or random.random() < LOG_SAMPLE_RATE
+    return sampled
+
+
+def _new_request_id():
+    return os.urandom(8).hex()
+
+
+# ASGI middleware assigning each request an id (X-Request-ID from nginx / the client, or a new one) for the logs
+class RequestIdMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        request_id = None
+        for name, value in scope["headers"]:
+            if name == REQUEST_ID_HEADER:
+                request_id = value.decode("latin-1")
+                break
+        if request_id is None or not REQUEST_ID_PATTERN.match(request_id):
+            request_id = _new_request_id()
+        sampled = LOG_SAMPLE_RATE >= 1 or random.random() < LOG_SAMPLE_RATE
+        token = _request_context.set((request_id, sampled))
+        header = (REQUEST_ID_HEADER, request_id.encode("latin-1"))
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                message["headers"] = list(message.get("headers", [])) + [header]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            _request_context.reset(token)
+
+
+# -- Formatting --
+
+class _RequestIdFilter(logging.Filter):
+    def filter(self, record):
+        record.request_id = _request_context.get()[0]
+        return True
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(record.created)) + ".%03dZ" % record.msecs,
+            "level": record.levelname,
+            "file": record.filename,
+            "request_id": getattr(record, "request_id", "-"),
+            "message": record.getMessage(),
+        }
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False)
+
+
+# Hands records to the writer thread without blocking - records are formatted there, not on the request path
+class _NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    def __init__(self, target_handler):
+        super().__init__(None)
+        self.target_handler = target_handler
+        self.listener = None
+        self.pid = None
+        self.start()
+
+    def start(self):
+        self.queue = queue.Queue(maxsize=LOG_QUEUE_SIZE)
+        self.listener = logging.handlers.QueueListener(self.queue, self.target_handler)
+        self.listener.start()
+        self.pid = os.getpid()
+
+    def stop(self):
+        if self.listener is not None and self.pid == os.getpid():
+            self.listener.stop()
+            self.listener = None
+
+    def prepare(self, record):
+        # The record stays in this process, so message args and exc_info are kept for the writer to format
+        return record
+
+    def enqueue(self, record):
+        if self.pid != os.getpid():
+            # Threads do not survive a fork - each worker process starts its own writer
+            with _configured_lock:
+                if self.pid != os.getpid():
+                    self.start()
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            _stats["dropped"] += 1
+
+
+def configure_logging():
+    global _configured, _queue_handler
+
+    if _configured:
+        return
+    with _configured_lock:
+        if _configured:
+            return
+
+        stream_handler = logging.StreamHandler(sys.stderr)
+        if LOG_FORMAT == "json":
+            stream_handler.setFormatter(JsonFormatter())
+        else:
+            stream_handler.setFormatter(logging.Formatter(TEXT_FORMAT, datefmt=DATE_FORMAT))
+
+        if LOG_QUEUE_SIZE > 0:
+            handler = _queue_handler = _NonBlockingQueueHandler(stream_handler)
+            atexit.register(stop_logging)
+        else:
+            handler = stream_handler
+        handler.addFilter(_RequestIdFilter())
+
+        root_logger = logging.getLogger()
+        for existing_handler in list(root_logger.handlers):
+            root_logger.removeHandler(existing_handler)
+        root_logger.addHandler(handler)
+        root_logger.setLevel(getattr(logging, LOG_LEVEL, logging.INFO))
+        _configured = True
+
+
+# Write all queued records - runs at process exit
+def stop_logging():
+    if _queue_handler is not None:
+        _queue_handler.stop()
+
+
+def get_logging_stats():
+    stats = dict(_stats)
+    stats["queued"] = _queue_handler.queue.qsize() if _queue_handler is not None else 0
+    return stats
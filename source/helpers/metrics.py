@@ -0,0 +1,269 @@
+import os
+from dotenv import load_dotenv
+from contextlib import nullcontext
+import functools
+import threading
+import time
+
+# Import helper functions
+from helpers.common import initialize_logging
+
+# Load environment variables
+load_dotenv()
+
+# Initialize logging
+logger = initialize_logging("metrics.py")
+
+# Prometheus metrics settings (requires: pip install prometheus-client)
+# - METRICS_ENABLED: expose /metrics and record request / stage timings - when off, the timers are no-ops
+# - METRICS_GAUGE_INTERVAL: seconds between updates of the pool / cache / queue gauges
+# - PROMETHEUS_MULTIPROC_DIR: empty directory shared by the gunicorn workers, required with more than one worker
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "false").lower() == "true"
+METRICS_GAUGE_INTERVAL = float(os.getenv("METRICS_GAUGE_INTERVAL", "5"))
+PROMETHEUS_MULTIPROC_DIR = os.getenv("PROMETHEUS_MULTIPROC_DIR", "")
+
+# prometheus_client switches to multiprocess mode when the variable is set at all, even to an empty value (e.g. an
+# empty line in .env) - it would then write .db files to the working directory that generate_metrics() never reads
+if not PROMETHEUS_MULTIPROC_DIR:
+    os.environ.pop("PROMETHEUS_MULTIPROC_DIR", None)
+    os.environ.pop("prometheus_multiproc_dir", None)
+
+# Histogram buckets in seconds
+STAGE_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+REQUEST_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+# Shared no-op timer used while metrics are disabled
+_NULL_TIMER = nullcontext()
+
+_request_duration = None
+_stage_duration = None
+_gauges = {}
+_stage_children = {}
+
+_stopping = threading.Event()
+_updater = None
+_updater_pid = None
+
+if METRICS_ENABLED:
+    try:
+        import prometheus_client
+        from prometheus_client import Histogram, Gauge
+    except ImportError:
+        raise ValueError("METRICS_ENABLED=true requires the prometheus-client package (pip install prometheus-client)")
+
+    _request_duration = Histogram("zaplink_request_duration_seconds", "HTTP request duration by route",
+                                  ["method", "route", "status"], buckets=REQUEST_BUCKETS)
+    _stage_duration = Histogram("zaplink_stage_duration_seconds", "Duration of request stages (captcha, DB, ...)",
+                                ["stage"], buckets=STAGE_BUCKETS)
+
+    # Summed over the live worker processes in multiprocess mode
+    _gauges = {
+        "db_pool_connections": Gauge("zaplink_db_pool_connections", "DB pool connections by state", ["state"],
+                                     multiprocess_mode="livesum"),
+        "db_pool_timeouts": Gauge("zaplink_db_pool_timeouts", "DB pool checkout timeouts since worker start",
+                                  multiprocess_mode="livesum"),
+        "db_replica_healthy": Gauge("zaplink_db_replica_healthy", "1 if the read replica is in use", ["replica"],
+                                    multiprocess_mode="min"),
+        "db_replica_lag": Gauge("zaplink_db_replica_lag_seconds", "Last measured replication lag", ["replica"],
+                                multiprocess_mode="max"),
+        "db_replica_reads": Gauge("zaplink_db_replica_reads", "Lookups since worker start by where they were answered",
+                                  ["result"], multiprocess_mode="livesum"),
+        "cache_entries": Gauge("zaplink_cache_entries", "Entries in the in-process caches", ["cache"],
+                               multiprocess_mode="livesum"),
+        "cache_lookups": Gauge("zaplink_cache_lookups", "Cache lookups since worker start", ["cache", "result"],
+                               multiprocess_mode="livesum"),
+        "slug_filter_bytes": Gauge("zaplink_slug_filter_bytes", "Memory of the slug filter's bit array",
+                                   multiprocess_mode="max"),
+        "slug_filter_slugs": Gauge("zaplink_slug_filter_slugs", "Slugs in the slug filter", multiprocess_mode="max"),
+        "slug_filter_fp_rate": Gauge("zaplink_slug_filter_fp_rate", "Slug filter false positive rate", ["kind"],
+                                     multiprocess_mode="max"),
+        "pending_visits": Gauge("zaplink_visit_counter_pending", "Buffered visit counts not written yet",
+                                multiprocess_mode="livesum"),
+        "alert_queue": Gauge("zaplink_alert_queue_size", "Alerts waiting to be sent", multiprocess_mode="livesum"),
+        "blocking_threads": Gauge("zaplink_blocking_threads_in_use", "Busy threads of the blocking thread pool",
+                                  multiprocess_mode="livesum"),
+    }
+
+
+def is_enabled():
+    return METRICS_ENABLED
+
+
+class _StageTimer:
+    __slots__ = ("histogram", "started")
+
+    def __init__(self, histogram):
+        self.histogram = histogram
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.histogram.observe(time.perf_counter() - self.started)
+        return False
+
+
+def _get_stage_histogram(stage: str):
+    child = _stage_children.get(stage)
+    if child is None:
+        child = _stage_children[stage] = _stage_duration.labels(stage)
+    return child
+
+
+# Context manager timing one stage: with stage_timer("captcha"): ...
+def stage_timer(stage: str):
+    if not METRICS_ENABLED:
+        return _NULL_TIMER
+    return _StageTimer(_get_stage_histogram(stage))
+
+
+# Decorator timing every call of a (sync) function as one stage - returns the function unchanged when disabled
+def timed(stage: str):
+    def decorator(func):
+        if not METRICS_ENABLED:
+            return func
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with _StageTimer(_get_stage_histogram(stage)):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+# -- Gauges --
+
+def update_gauges():
+    logger.debug("update_gauges() called.")
+
+    # Imported here to avoid circular imports (these modules use the timers above)
+    from helpers.db_connection import get_pool_stats, get_replica_stats
+    from helpers.cache import slug_cache
+    from helpers.url import verdict_cache
+    from helpers.visit_counter import get_visit_counter_stats
+    from helpers.alerts import get_alert_stats
+    from helpers.concurrency import get_threadpool_stats
+    from helpers.slug_filter import get_slug_filter_stats
+
+    pool_stats = get_pool_stats()
+    for state in ("in_use", "idle", "total"):
+        _gauges["db_pool_connections"].labels(state).set(pool_stats[state])
+    _gauges["db_pool_timeouts"].set(pool_stats["timeouts"])
+
+    replica_stats = get_replica_stats()
+    replica_reads = {"replica": 0, "replica_miss": 0, "no_replica": replica_stats["fallbacks"]}
+    for host, stats in replica_stats["replicas"].items():
+        _gauges["db_replica_healthy"].labels(host).set(1 if stats["healthy"] else 0)
+        if stats["lag"] is not None:
+            _gauges["db_replica_lag"].labels(host).set(stats["lag"])
+        replica_reads["replica"] += stats["reads"]
+        replica_reads["replica_miss"] += stats["misses"]
+    if replica_stats["replicas"]:
+        for result, count in replica_reads.items():
+            _gauges["db_replica_reads"].labels(result).set(count)
+
+    for name, cache in (("slug", slug_cache), ("safe_browsing_verdict", verdict_cache)):
+        cache_stats = cache.stats()
+        _gauges["cache_entries"].labels(name).set(cache_stats["size"])
+        for result in ("hits", "negative_hits", "misses"):
+            _gauges["cache_lookups"].labels(name, result).set(cache_stats[result])
+
+    filter_stats = get_slug_filter_stats()
+    if filter_stats["ready"]:
+        _gauges["slug_filter_bytes"].set(filter_stats["memory_bytes"])
+        _gauges["slug_filter_slugs"].set(filter_stats["slugs"] + filter_stats["recent_slugs"])
+        _gauges["slug_filter_fp_rate"].labels("estimated").set(filter_stats["estimated_fp_rate"])
+        _gauges["slug_filter_fp_rate"].labels("observed").set(filter_stats["observed_fp_rate"])
+
+    _gauges["pending_visits"].set(get_visit_counter_stats()["pending_visits"])
+    _gauges["alert_queue"].set(get_alert_stats()["queue_size"])
+    _gauges["blocking_threads"].set(get_threadpool_stats()["in_use"])
+
+
+def _run_updater():
+    while not _stopping.wait(METRICS_GAUGE_INTERVAL):
+        try:
+            update_gauges()
+        except Exception as e:
+            logger.info("metrics :: Updating gauges failed: %s", e)
+
+
+def start():
+    global _updater, _updater_pid
+    logger.debug("metrics.start() called.")
+
+    if METRICS_ENABLED and (_updater is None or _updater_pid != os.getpid()):
+        _stopping.clear()
+        _updater = threading.Thread(target=_run_updater, name="metrics-gauges", daemon=True)
+        _updater.start()
+        _updater_pid = os.getpid()
+
+
+def stop():
+    global _updater
+    logger.debug("metrics.stop() called.")
+
+    if _updater is not None and _updater_pid == os.getpid():
+        _stopping.set()
+        _updater.join(timeout=5)
+        _updater = None
+
+
+# Body and content type of the /metrics response - all workers aggregated in multiprocess mode, the gunicorn hooks in
+# config/gunicorn/gunicorn_config.py clear the directory on start and drop the gauges of exited workers
+def generate_metrics():
+    logger.debug("generate_metrics() called.")
+
+    update_gauges()
+    if PROMETHEUS_MULTIPROC_DIR:
+        from prometheus_client import multiprocess
+        registry = prometheus_client.CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = prometheus_client.REGISTRY
+    return prometheus_client.generate_latest(registry), prometheus_client.CONTENT_TYPE_LATEST
+
+
+# -- Requests --
+
+# ASGI middleware recording the duration of every HTTP request by route template
+class MetricsMiddleware:
+    def __init__(self, app):
+        self.app = app
+        self.route_paths = None
+
+    def _get_route(self, scope):
+        if self.route_paths is None:
+            self.route_paths = {}
+            for route in scope["app"].router.routes:
+                endpoint = getattr(route, "endpoint", None) or getattr(route, "app", None)
+                self.route_paths[endpoint] = route.path
+        endpoint = scope.get("endpoint")
+        if endpoint is not None:
+            return self.route_paths.get(endpoint, "other")
+        # Served ahead of routing by the redirect fast path
+        from helpers.fast_redirect import FAST_REDIRECT_PATH_PATTERN
+        if scope["method"] == "GET" and FAST_REDIRECT_PATH_PATTERN.match(scope["path"]):
+            return "/{short_url_slug}"
+        return "unmatched"
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status = 500
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            _request_duration.labels(scope["method"], self._get_route(scope), str(status)).observe(
+                time.perf_counter() - started)
@@ -0,0 +1,191 @@
+import os
+from dotenv import load_dotenv
+from starlette.responses import Response
+import gzip
+import hashlib
+import threading
+import time
+
+# Import helper functions
+from helpers.common import initialize_logging, templates, get_accepted_encodings
+from helpers import assets  # registers asset_url() used by the templates
+from helpers.metrics import stage_timer
+
+# Load environment variables
+load_dotenv()
+
+# Initialize logging
+logger = initialize_logging("pages.py")
+
+# Pre-rendered page settings
+# - PAGES_AUTO_RELOAD: re-render pages when a template file changes (development)
+# - PAGES_BROTLI: also keep a brotli variant of each page (requires: pip install brotli)
+PAGES_AUTO_RELOAD = os.getenv("PAGES_AUTO_RELOAD", "false").lower() == "true"
+PAGES_BROTLI = os.getenv("PAGES_BROTLI", "true").lower() == "true"
+
+# Seconds between template modification checks when PAGES_AUTO_RELOAD is on
+TEMPLATE_CHECK_INTERVAL = 1
+
+TEMPLATES_DIRECTORY = "templates"
+
+# Pages are revalidated with the ETag on every use
+CACHE_CONTROL = b"no-cache"
+
+
+# One rendered page: identity, gzip and brotli bodies and their response headers
+class RenderedPage:
+    def __init__(self, html: str):
+        self.body = html.encode("utf-8")
+        self.etag = '"' + hashlib.sha256(self.body).hexdigest()[:32] + '"'
+
+        # Every encoding gets its own ETag, any of them matches in If-None-Match
+        self.variants = {None: self.body, "gzip": gzip.compress(self.body, compresslevel=9, mtime=0)}
+        if PAGES_BROTLI:
+            try:
+                import brotli
+                self.variants["br"] = brotli.compress(self.body, quality=11)
+            except ImportError:
+                logger.info("RenderedPage :: brotli package not installed, serving gzip and identity only.")
+        self.etags = {encoding: self.etag if encoding is None else self.etag[:-1] + "-" + encoding + '"'
+                      for encoding in self.variants}
+        self.headers = {encoding: self._build_headers(encoding) for encoding in self.variants}
+
+    def _build_headers(self, encoding):
+        headers = [(b"content-length", str(len(self.variants[encoding])).encode("latin-1")),
+                   (b"content-type", b"text/html; charset=utf-8"),
+                   (b"etag", self.etags[encoding].encode("latin-1")),
+                   (b"cache-control", CACHE_CONTROL),
+                   (b"vary", b"Accept-Encoding")]
+        if encoding is not None:
+            headers.append((b"content-encoding", encoding.encode("latin-1")))
+        return headers
+
+    def select_encoding(self, accept_encoding: str):
+        accepted = get_accepted_encodings(accept_encoding)
+        for encoding in ("br", "gzip"):
+            if encoding in self.variants and (encoding in accepted or "*" in accepted):
+                return encoding
+        return None
+
+    def is_not_modified(self, if_none_match: str):
+        if not if_none_match:
+            return False
+        if if_none_match.strip() == "*":
+            return True
+        tags = {tag.strip().removeprefix("W/") for tag in if_none_match.split(",")}
+        return any(etag in tags for etag in self.etags.values())
+
+    # (status, header list, body) for a request with these header values
+    def respond(self, status: int, accept_encoding: str, if_none_match: str):
+        encoding = self.select_encoding(accept_encoding)
+        # Conditional GET only applies to successful responses, not to error pages
+        if status == 200 and self.is_not_modified(if_none_match):
+            headers = [(name, value) for name, value in self.headers[encoding]
+                       if name in (b"etag", b"cache-control", b"vary")]
+            return 304, headers, b""
+        return status, self.headers[encoding], self.variants[encoding]
+
+
+# Starlette response with prebuilt raw headers and body
+class PageResponse(Response):
+    def __init__(self, status_code: int, raw_headers: list, body: bytes):
+        self.status_code = status_code
+        self.body = body
+        self.background = None
+        self.raw_headers = list(raw_headers)
+
+
+# Registered pages: name -> (template name, context function), rendered on first use
+_registry = {}
+_pages = {}
+_pages_lock = threading.Lock()
+_templates_mtime = None
+_templates_checked = 0.0
+
+
+def register_page(name: str, template_name: str, get_context):
+    logger.debug("register_page() called.")
+
+    _registry[name] = (template_name, get_context)
+    _pages.pop(name, None)
+
+
+def _render(name):
+    logger.info("pages :: Rendering page: %s", name)
+    if isinstance(name, tuple):
+        # Error page: ("error", error_code, error_message)
+        _, error_code, error_message = name
+        template_name, context = "error.html", {
+            "SITE_NAME": os.getenv("SITE_NAME"),
+            "error_code": error_code,
+            "error_message": error_message,
+        }
+    else:
+        template_name, get_context = _registry[name]
+        context = get_context()
+    with stage_timer("template_render"):
+        html = templates.get_template(template_name).render(context)
+    return RenderedPage(html)
+
+
+def _get_templates_mtime():
+    mtime = 0.0
+    for entry in os.scandir(TEMPLATES_DIRECTORY):
+        mtime = max(mtime, entry.stat().st_mtime)
+    return mtime
+
+
+def _check_templates():
+    global _templates_mtime, _templates_checked
+
+    now = time.monotonic()
+    if now - _templates_checked < TEMPLATE_CHECK_INTERVAL:
+        return
+    _templates_checked = now
+    mtime = _get_templates_mtime()
+    if _templates_mtime is not None and mtime != _templates_mtime:
+        logger.info("pages :: Template change detected, reloading pages.")
+        reload_pages()
+    _templates_mtime = mtime
+
+
+def get_page(name) -> RenderedPage:
+    if PAGES_AUTO_RELOAD:
+        _check_templates()
+
+    page = _pages.get(name)
+    if page is None:
+        with _pages_lock:
+            page = _pages.get(name)
+            if page is None:
+                page = _render(name)
+                _pages[name] = page
+    return page
+
+
+def get_error_page(error_code: int, error_message: str) -> RenderedPage:
+    return get_page(("error", error_code, error_message))
+
+
+# Drop all rendered pages, they are rendered again on next use - call after templates or their context changed
+def reload_pages():
+    logger.debug("reload_pages() called.")
+
+    with _pages_lock:
+        _pages.clear()
+        if templates.env.cache is not None:
+            templates.env.cache.clear()
+
+
+# Render the registered pages up front, so no request pays for it
+def prerender_pages():
+    logger.debug("prerender_pages() called.")
+
+    for name in list(_registry):
+        get_page(name)
+
+
+def page_response(request, page: RenderedPage, status_code: int = 200):
+    status, headers, body = page.respond(status_code, request.headers.get("accept-encoding", ""),
+                                         request.headers.get("if-none-match", ""))
+    return PageResponse(status, headers, body)
@@ -0,0 +1,317 @@
+import os
+from dotenv import load_dotenv
+from collections import OrderedDict
+import ipaddress
+import json
+import math
+import threading
+import time
+
+# Import helper functions
+from helpers.common import initialize_logging
+from helpers.concurrency import run_blocking
+from helpers.cache import slug_cache, NOT_FOUND
+from helpers.api_auth import get_api_key_name
+from helpers.fast_redirect import FAST_REDIRECT_PATH_PATTERN
+
+# Load environment variables
+load_dotenv()
+
+# Initialize logging
+logger = initialize_logging("rate_limit.py")
+
+# Rate limit settings - token buckets: RATE is tokens per second, BURST the bucket size
+# - RATE_LIMIT_ENABLED: shed abusive traffic with 429 before any DB or external call
+# - RATE_LIMIT_BACKEND: empty for in-process buckets (per worker), or "redis" to share them across workers and nodes
+# - RATE_LIMIT_REDIS_URL: Redis URL of the shared backend, defaults to SHARED_CACHE_URL
+# - RATE_LIMIT_TRUSTED_PROXIES: addresses / networks whose X-Forwarded-For header is honored (nginx)
+# - RATE_LIMIT_IP_RATE / RATE_LIMIT_IP_BURST: all requests of a client IP (except /assets)
+# - RATE_LIMIT_FORM_RATE / RATE_LIMIT_FORM_BURST: form POSTs of a client IP (reCAPTCHA + Safe Browsing calls)
+# - RATE_LIMIT_NOT_FOUND_RATE / RATE_LIMIT_NOT_FOUND_BURST: 404s of slug lookups per client IP - once spent, slugs
+#   that are not in the slug cache are refused without a DB lookup (slug enumeration)
+# - RATE_LIMIT_API_KEY_RATE / RATE_LIMIT_API_KEY_BURST: requests per API key
+# - RATE_LIMIT_API_KEY_QUOTAS: per key overrides as "name:rate:burst" pairs, e.g. partner:50:200,campaigns:1:10
+# - RATE_LIMIT_MAX_KEYS: max in-process buckets, least recently used ones are dropped
+RATE_LIMIT_ENABLED = os.getenv("RATE_LIMIT_ENABLED", "false").lower() == "true"
+RATE_LIMIT_BACKEND = os.getenv("RATE_LIMIT_BACKEND", "").lower()
+RATE_LIMIT_REDIS_URL = os.getenv("RATE_LIMIT_REDIS_URL", os.getenv("SHARED_CACHE_URL", "redis://localhost:6379/0"))
+RATE_LIMIT_KEY_PREFIX = os.getenv("RATE_LIMIT_KEY_PREFIX", "zaplink:rl:")
+RATE_LIMIT_TRUSTED_PROXIES = os.getenv("RATE_LIMIT_TRUSTED_PROXIES", "127.0.0.1,::1")
+RATE_LIMIT_IP_RATE = float(os.getenv("RATE_LIMIT_IP_RATE", "20"))
+RATE_LIMIT_IP_BURST = float(os.getenv("RATE_LIMIT_IP_BURST", "100"))
+RATE_LIMIT_FORM_RATE = float(os.getenv("RATE_LIMIT_FORM_RATE", "0.2"))
+RATE_LIMIT_FORM_BURST = float(os.getenv("RATE_LIMIT_FORM_BURST", "10"))
+RATE_LIMIT_NOT_FOUND_RATE = float(os.getenv("RATE_LIMIT_NOT_FOUND_RATE", "0.5"))
+RATE_LIMIT_NOT_FOUND_BURST = float(os.getenv("RATE_LIMIT_NOT_FOUND_BURST", "20"))
+RATE_LIMIT_API_KEY_RATE = float(os.getenv("RATE_LIMIT_API_KEY_RATE", "10"))
+RATE_LIMIT_API_KEY_BURST = float(os.getenv("RATE_LIMIT_API_KEY_BURST", "50"))
+RATE_LIMIT_API_KEY_QUOTAS = os.getenv("RATE_LIMIT_API_KEY_QUOTAS", "")
+RATE_LIMIT_MAX_KEYS = int(os.getenv("RATE_LIMIT_MAX_KEYS", "100000"))
+
+# Form POST paths, each costs a reCAPTCHA and possibly a Safe Browsing call
+FORM_PATHS = ("/", "/get-original-url")
+API_PATH_PREFIX = "/api/"
+EXEMPT_PATH_PREFIXES = ("/assets/",)
+
+_stats = {"allowed": 0, "limited_ip": 0, "limited_form": 0, "limited_not_found": 0, "limited_api_key": 0,
+          "backend_errors": 0}
+_stats_lock = threading.Lock()
+
+
+def _count(name):
+    with _stats_lock:
+        _stats[name] += 1
+
+
+def parse_trusted_proxies(value: str):
+    networks = []
+    for item in value.split(","):
+        item = item.strip()
+        if item:
+            networks.append(ipaddress.ip_network(item, strict=False))
+    return networks
+
+
+def parse_api_key_quotas(value: str):
+    # API key name -> (rate, burst)
+    quotas = {}
+    for item in value.split(","):
+        parts = item.strip().split(":")
+        if len(parts) != 3:
+            continue
+        try:
+            quotas[parts[0]] = (float(parts[1]), float(parts[2]))
+        except ValueError:
+            raise ValueError(f"Invalid RATE_LIMIT_API_KEY_QUOTAS entry: '{item}'")
+    return quotas
+
+
+trusted_proxies = parse_trusted_proxies(RATE_LIMIT_TRUSTED_PROXIES)
+api_key_quotas = parse_api_key_quotas(RATE_LIMIT_API_KEY_QUOTAS)
+
+
+# -- Buckets --
+
+# Backend interface - take() removes cost tokens from the bucket if at least max(cost, 1) are left, cost 0 only checks.
+# Returns (allowed, seconds until a token is available)
+class RateLimitBackend:
+    def take(self, key, rate, burst, cost):
+        raise NotImplementedError
+
+
+class MemoryRateLimitBackend(RateLimitBackend):
+    def __init__(self, max_keys):
+        self.max_keys = max_keys
+        # key -> [tokens, updated_at], least recently used first
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def take(self, key, rate, burst, cost):
+        now = time.monotonic()
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                bucket = [burst, now]
+                self._buckets[key] = bucket
+                if len(self._buckets) > self.max_keys:
+                    self._buckets.popitem(last=False)
+            else:
+                self._buckets.move_to_end(key)
+                bucket[0] = min(burst, bucket[0] + (now - bucket[1]) * rate)
+                bucket[1] = now
+            if bucket[0] >= max(cost, 1):
+                bucket[0] -= cost
+                return True, 0.0
+            return False, (max(cost, 1) - bucket[0]) / rate if rate > 0 else 60.0
+
+
+class RedisRateLimitBackend(RateLimitBackend):
+    # Refill and take in one atomic step, using the Redis server clock so that all nodes agree
+    TAKE_SCRIPT = """
+    local rate, burst, cost = tonumber(ARGV[1]), tonumber(ARGV[2]), tonumber(ARGV[3])
+    local clock = redis.call("time")
+    local now = tonumber(clock[1]) + tonumber(clock[2]) / 1000000
+    local bucket = redis.call("hmget", KEYS[1], "tokens", "updated_at")
+    local tokens = tonumber(bucket[1]) or burst
+    local updated_at = tonumber(bucket[2]) or now
+    tokens = math.min(burst, tokens + math.max(0, now - updated_at) * rate)
+    local allowed = 0
+    if tokens >= math.max(cost, 1) then
+        tokens = tokens - cost
+        allowed = 1
+    end
+    redis.call("hset", KEYS[1], "tokens", tostring(tokens), "updated_at", tostring(now))
+    redis.call("expire", KEYS[1], ARGV[4])
+    return {allowed, tostring(tokens)}
+    """
+
+    def __init__(self, url):
+        try:
+            import redis
+        except ImportError:
+            raise ValueError("Rate limit backend 'redis' requires the redis package (pip install redis)")
+
+        self._client = redis.Redis.from_url(url, decode_responses=True, socket_timeout=0.5,
+                                            socket_connect_timeout=0.5, health_check_interval=30)
+        self._take = self._client.register_script(self.TAKE_SCRIPT)
+
+    def take(self, key, rate, burst, cost):
+        # Buckets expire once they would be full again
+        expire = max(1, math.ceil(burst / rate)) if rate > 0 else 3600
+        allowed, tokens = self._take(keys=[RATE_LIMIT_KEY_PREFIX + key], args=[rate, burst, cost, expire])
+        if allowed:
+            return True, 0.0
+        return False, (max(cost, 1) - float(tokens)) / rate if rate > 0 else 60.0
+
+
+def create_backend(name):
+    logger.debug("rate_limit.create_backend() called.")
+
+    if not name or name == "memory":
+        return MemoryRateLimitBackend(RATE_LIMIT_MAX_KEYS)
+    if name == "redis":
+        return RedisRateLimitBackend(RATE_LIMIT_REDIS_URL)
+    raise ValueError(f"Unknown rate limit backend: '{name}'")
+
+
+backend = create_backend(RATE_LIMIT_BACKEND) if RATE_LIMIT_ENABLED else None
+
+
+def set_backend(new_backend):
+    global backend
+    backend = new_backend
+
+
+async def take(key: str, rate: float, burst: float, cost: float = 1):
+    # In-process buckets are taken inline, the shared backend does network I/O
+    if isinstance(backend, MemoryRateLimitBackend):
+        return backend.take(key, rate, burst, cost)
+    try:
+        return await run_blocking(backend.take, key, rate, burst, cost)
+    except Exception as e:
+        # Rate limiting must not take the site down with the backend - fail open
+        _count("backend_errors")
+        logger.info("rate_limit :: Backend error, request allowed: %s", e)
+        return True, 0.0
+
+
+# -- Requests --
+
+def _get_header(scope, name: bytes):
+    for key, value in scope["headers"]:
+        if key == name:
+            return value.decode("latin-1")
+    return ""
+
+
+def _is_trusted_proxy(address: str):
+    try:
+        ip = ipaddress.ip_address(address)
+    except ValueError:
+        return False
+    return any(ip in network for network in trusted_proxies)
+
+
+def get_client_ip(scope):
+    # X-Forwarded-For is only honored when set by a trusted proxy - the client is the last untrusted address
+    client_ip = (scope.get("client") or ("",))[0]
+    if not _is_trusted_proxy(client_ip):
+        return client_ip
+    forwarded_for = _get_header(scope, b"x-forwarded-for")
+    for address in reversed([address.strip() for address in forwarded_for.split(",") if address.strip()]):
+        client_ip = address
+        if not _is_trusted_proxy(address):
+            break
+    return client_ip
+
+
+# ASGI middleware applying the per-IP, form, 404 and API key buckets before any other work is done
+class RateLimitMiddleware:
+    def __init__(self, app):
+        self.app = app
+        self.reserved_paths = None
+
+    def _is_slug_path(self, scope, path):
+        if scope["method"] != "GET" or FAST_REDIRECT_PATH_PATTERN.match(path) is None:
+            return False
+        if self.reserved_paths is None:
+            self.reserved_paths = {route.path for route in scope["app"].router.routes
+                                   if "{" not in getattr(route, "path", "{")}
+        return path not in self.reserved_paths
+
+    async def _reject(self, scope, send, reason, retry_after):
+        _count("limited_" + reason)
+        logger.info("rate_limit :: Request limited (%s): %s %s", reason, scope["method"], scope["path"])
+        headers = [(b"retry-after", str(max(1, math.ceil(retry_after))).encode("latin-1"))]
+        if scope["path"].startswith(API_PATH_PREFIX):
+            body = json.dumps({"detail": "Too many requests"}).encode("utf-8")
+            headers += [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode("latin-1"))]
+            status = 429
+        else:
+            # Imported here, pages imports the templates which are not needed for API-only use
+            from helpers.pages import get_error_page
+            status, page_headers, body = get_error_page(429, "Too many requests").respond(
+                429, _get_header(scope, b"accept-encoding"), "")
+            headers += page_headers
+        await send({"type": "http.response.start", "status": status, "headers": headers})
+        await send({"type": "http.response.body", "body": body})
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"].startswith(EXEMPT_PATH_PREFIXES):
+            await self.app(scope, receive, send)
+            return
+
+        path = scope["path"]
+        client_ip = get_client_ip(scope)
+
+        allowed, retry_after = await take("ip:" + client_ip, RATE_LIMIT_IP_RATE, RATE_LIMIT_IP_BURST)
+        if not allowed:
+            await self._reject(scope, send, "ip", retry_after)
+            return
+
+        if scope["method"] == "POST" and path in FORM_PATHS:
+            allowed, retry_after = await take("form:" + client_ip, RATE_LIMIT_FORM_RATE, RATE_LIMIT_FORM_BURST)
+            if not allowed:
+                await self._reject(scope, send, "form", retry_after)
+                return
+
+        if path.startswith(API_PATH_PREFIX):
+            api_key_name = get_api_key_name(_get_header(scope, b"x-api-key"))
+            if api_key_name is not None:
+                rate, burst = api_key_quotas.get(api_key_name, (RATE_LIMIT_API_KEY_RATE, RATE_LIMIT_API_KEY_BURST))
+                allowed, retry_after = await take("key:" + api_key_name, rate, burst)
+                if not allowed:
+                    await self._reject(scope, send, "api_key", retry_after)
+                    return
+
+        if not self._is_slug_path(scope, path):
+            _count("allowed")
+            await self.app(scope, receive, send)
+            return
+
+        # Slug lookups: known slugs are served from the cache, unknown ones need what is left of the 404 budget
+        cached_url = slug_cache.peek(path[1:])
+        if cached_url is None or cached_url is NOT_FOUND:
+            allowed, retry_after = await take("404:" + client_ip, RATE_LIMIT_NOT_FOUND_RATE,
+                                              RATE_LIMIT_NOT_FOUND_BURST, cost=0)
+            if not allowed:
+                await self._reject(scope, send, "not_found", retry_after)
+                return
+        _count("allowed")
+
+        status = None
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        await self.app(scope, receive, send_wrapper)
+        if status == 404:
+            await take("404:" + client_ip, RATE_LIMIT_NOT_FOUND_RATE, RATE_LIMIT_NOT_FOUND_BURST)
+
+
+def get_rate_limit_stats():
+    with _stats_lock:
+        return dict(_stats)
@@ -0,0 +1,97 @@
+import os
+from dotenv import load_dotenv
+from email.utils import formatdate
+import json
+import time
+import httpx
+
+# Import helper functions
+from helpers.common import initialize_logging
+
+# Load environment variables
+load_dotenv()
+
+# Initialize logging
+logger = initialize_logging("redirects.py")
+
+# Redirect settings (defaults for links without their own policy, see python manage_link.py)
+# - REDIRECT_STATUS: HTTP status of redirects - 301, 302, 307 or 308
+# - REDIRECT_CACHE_TTL: seconds browsers and the nginx proxy_cache may keep a redirect (0 = not cached, "no-store")
+# - REDIRECT_CACHE_PURGE_URLS: comma-separated purge URLs of the nginx caches, "{slug}" is replaced with the slug -
+#   requested with the PURGE method when a link is flagged unsafe or its policy changes (empty = no purge)
+# - REDIRECT_CACHE_PURGE_TIMEOUT: seconds a purge request may take
+REDIRECT_STATUS = int(os.getenv("REDIRECT_STATUS", "307"))
+REDIRECT_CACHE_TTL = int(os.getenv("REDIRECT_CACHE_TTL", "0"))
+REDIRECT_CACHE_PURGE_URLS = [url.strip() for url in os.getenv("REDIRECT_CACHE_PURGE_URLS", "").split(",")
+                             if url.strip()]
+REDIRECT_CACHE_PURGE_TIMEOUT = float(os.getenv("REDIRECT_CACHE_PURGE_TIMEOUT", "2"))
+
+REDIRECT_STATUSES = (301, 302, 307, 308)
+
+_stats = {"purges": 0, "purge_errors": 0}
+
+
+def validate_redirect_status(status):
+    if status is not None and status not in REDIRECT_STATUSES:
+        raise ValueError(f"Invalid redirect status: {status}, must be one of {REDIRECT_STATUSES}")
+    return status
+
+
+def validate_cache_ttl(cache_ttl):
+    if cache_ttl is not None and cache_ttl < 0:
+        raise ValueError(f"Invalid cache TTL: {cache_ttl}, must be 0 or more seconds")
+    return cache_ttl
+
+
+validate_redirect_status(REDIRECT_STATUS)
+validate_cache_ttl(REDIRECT_CACHE_TTL)
+
+
+# A redirect is the (original_url, redirect_status, cache_ttl) tuple of storage.find_redirect() - None = default
+
+def get_redirect_status(redirect):
+    return redirect[1] or REDIRECT_STATUS
+
+
+def get_cache_ttl(redirect):
+    return REDIRECT_CACHE_TTL if redirect[2] is None else redirect[2]
+
+
+# Cache-Control / Expires headers of a redirect response, as (name, value) byte pairs
+def get_cache_headers(redirect):
+    cache_ttl = get_cache_ttl(redirect)
+    if cache_ttl <= 0:
+        # Every click reaches the app, so it is counted - also keeps browsers from storing 301 / 308 for good
+        return [(b"cache-control", b"no-store")]
+    return [(b"cache-control", b"public, max-age=%d" % cache_ttl),
+            (b"expires", formatdate(time.time() + cache_ttl, usegmt=True).encode("latin-1"))]
+
+
+# Shared cache values are strings
+def encode_redirect(redirect):
+    return None if redirect is None else json.dumps(list(redirect))
+
+
+def decode_redirect(value):
+    return None if value is None else tuple(json.loads(value))
+
+
+# Drop a cached redirect from the nginx caches - runs in a blocking thread (or background job), never raises
+def purge(slug: str):
+    logger.debug("purge() called.")
+
+    for template in REDIRECT_CACHE_PURGE_URLS:
+        url = template.replace("{slug}", slug)
+        try:
+            response = httpx.request("PURGE", url, timeout=REDIRECT_CACHE_PURGE_TIMEOUT)
+            # 404 = the redirect was not cached
+            if response.status_code not in (200, 404):
+                raise ValueError(f"HTTP {response.status_code}")
+            _stats["purges"] += 1
+        except (httpx.HTTPError, ValueError) as e:
+            _stats["purge_errors"] += 1
+            logger.info("purge() :: Purging %s failed: %s", url, e)
+
+
+def get_redirect_stats():
+    return dict(_stats)
@@ -0,0 +1,460 @@
+import os
+from dotenv import load_dotenv
+from urllib.parse import urlsplit, unquote_to_bytes
+import asyncio
+import base64
+import fcntl
+import hashlib
+import json
+import re
+import socket
+import time
+
+# Import helper functions
+from helpers.common import initialize_logging
+from helpers.concurrency import run_blocking
+from helpers.http_client import get_http_client
+from helpers.metrics import stage_timer
+
+# Load environment variables
+load_dotenv()
+
+# Initialize logging
+logger = initialize_logging("safe_browsing_local.py")
+
+# Local Safe Browsing database settings (SAFE_BROWSING_MODE=local)
+# - SAFE_BROWSING_LOCAL_DB_PATH: file the hash-prefix database is stored in, shared by all workers of a node
+# - SAFE_BROWSING_LOCAL_UPDATE_INTERVAL: min seconds between update fetches (the API's minimumWaitDuration wins if longer)
+# - SAFE_BROWSING_LOCAL_CHECK_INTERVAL: seconds between checks for a due update or a database file written by another worker
+SAFE_BROWSING_API_URL = os.getenv("SAFE_BROWSING_API_URL", "https://safebrowsing.googleapis.com/v4")
+SAFE_BROWSING_LOCAL_DB_PATH = os.getenv("SAFE_BROWSING_LOCAL_DB_PATH", "safe_browsing.db.json")
+SAFE_BROWSING_LOCAL_UPDATE_INTERVAL = float(os.getenv("SAFE_BROWSING_LOCAL_UPDATE_INTERVAL", "1800"))
+SAFE_BROWSING_LOCAL_CHECK_INTERVAL = float(os.getenv("SAFE_BROWSING_LOCAL_CHECK_INTERVAL", "60"))
+
+CLIENT_INFO = {
+    "clientId": "yourcompanyname",
+    "clientVersion": "1.0"
+}
+
+# Threat lists kept locally: (threatType, platformType, threatEntryType)
+THREAT_LISTS = [
+    ("MALWARE", "ANY_PLATFORM", "URL"),
+    ("SOCIAL_ENGINEERING", "ANY_PLATFORM", "URL"),
+]
+
+
+# -- URL canonicalization and expressions (https://developers.google.com/safe-browsing/v4/urls-hashing) --
+
+def _unescape_fully(value: bytes) -> bytes:
+    # Repeatedly percent-unescape until the value does not change any more
+    while True:
+        unescaped = unquote_to_bytes(value)
+        if unescaped == value:
+            return value
+        value = unescaped
+
+
+def _escape(value: bytes) -> str:
+    # Percent-escape control characters, spaces, non-ASCII, "#" and "%"
+    return "".join("%{:02X}".format(byte) if byte <= 0x20 or byte >= 0x7f or byte in (0x23, 0x25) else chr(byte)
+                   for byte in value)
+
+
+def _canonicalize_host(host: bytes) -> str:
+    host = _unescape_fully(host).decode("latin-1").lower()
+    host = re.sub(r"\.+", ".", host.strip("."))
+
+    # Normalize IP addresses written in decimal, octal or hex to dotted-decimal
+    if re.fullmatch(r"(0x[0-9a-f]+|[0-9]+)(\.(0x[0-9a-f]+|[0-9]+)){0,3}", host):
+        try:
+            host = socket.inet_ntoa(socket.inet_aton(host))
+        except OSError:
+            pass
+    return _escape(host.encode("latin-1"))
+
+
+def _canonicalize_path(path: bytes) -> str:
+    path = _unescape_fully(path) or b"/"
+    segments = []
+    for segment in path.split(b"/")[1:]:
+        if segment == b".":
+            continue
+        if segment == b"..":
+            if segments:
+                segments.pop()
+            continue
+        segments.append(segment)
+    # Collapse consecutive slashes, keep a trailing slash
+    canonical = b"/" + b"/".join(segment for segment in segments if segment)
+    if path.endswith(b"/") and not canonical.endswith(b"/"):
+        canonical += b"/"
+    return _escape(canonical)
+
+
+# Returns (host, path, query) of the canonical URL, query is None when the URL has none
+def canonicalize_url(url: str):
+    url = re.sub(r"[\t\r\n]", "", url.strip())
+    url = url.split("#", 1)[0]
+    if "://" not in url:
+        url = "http://" + url
+
+    parts = urlsplit(url)
+    netloc = parts.netloc.rsplit("@", 1)[-1]
+    host = netloc.split(":", 1)[0] if not netloc.startswith("[") else netloc
+    query = _escape(_unescape_fully(parts.query.encode("utf-8"))) if "?" in url else None
+    return (_canonicalize_host(host.encode("utf-8")), _canonicalize_path(parts.path.encode("utf-8")), query)
+
+
+def get_url_expressions(url: str):
+    host, path, query = canonicalize_url(url)
+
+    # Exact host, plus up to 4 host suffixes built from the last 5 components (not for IP addresses)
+    hosts = [host]
+    if not re.fullmatch(r"[0-9.]+", host):
+        components = host.split(".")
+        for i in range(max(1, len(components) - 5), len(components) - 1):
+            hosts.append(".".join(components[i:]))
+
+    # Exact path with and without query, plus up to 4 path prefixes starting at the root
+    paths = []
+    if query is not None:
+        paths.append(path + "?" + query)
+    paths.append(path)
+    prefix = "/"
+    paths.append(prefix)
+    for segment in path.split("/")[1:-1][:3]:
+        prefix += segment + "/"
+        paths.append(prefix)
+
+    expressions = []
+    for expression_host in hosts:
+        for expression_path in paths:
+            expression = expression_host + expression_path
+            if expression not in expressions:
+                expressions.append(expression)
+    return expressions
+
+
+# -- Hash-prefix database --
+
+def _list_key(threat_list):
+    return "/".join(threat_list)
+
+
+def _contains_prefix(blob: bytes, size: int, target: bytes) -> bool:
+    # Binary search over a sorted blob of fixed-size prefixes
+    low, high = 0, len(blob) // size
+    while low < high:
+        middle = (low + high) // 2
+        value = blob[middle * size:(middle + 1) * size]
+        if value < target:
+            low = middle + 1
+        elif value > target:
+            high = middle
+        else:
+            return True
+    return False
+
+
+# Updates, saves and loads run in the blocking thread pool while checks read the database on the event loop - they
+# never modify self.lists in place but replace it, so a check always sees a complete set of lists
+class HashPrefixDatabase:
+    def __init__(self):
+        # list key -> {"state": client state, "prefixes": {prefix size: sorted concatenated prefixes}}
+        self.lists = {}
+        self.next_update_after = 0.0
+        self.loaded_mtime = None
+
+    def is_ready(self):
+        return bool(self.lists) and all(entry["state"] for entry in self.lists.values())
+
+    def find_prefixes(self, full_hash: bytes):
+        hits = []
+        for key, entry in self.lists.items():
+            for size, blob in entry["prefixes"].items():
+                if _contains_prefix(blob, size, full_hash[:size]):
+                    hits.append((key, full_hash[:size]))
+        return hits
+
+    def apply_update(self, key, update):
+        entry = self.lists.get(key, {"state": "", "prefixes": {}})
+
+        # Removal indices refer to the lexicographically sorted list of all current prefixes
+        if update.get("responseType") == "FULL_UPDATE":
+            prefixes = []
+        else:
+            prefixes = sorted(prefix for size, blob in entry["prefixes"].items()
+                              for prefix in (blob[i:i + size] for i in range(0, len(blob), size)))
+        removed = set()
+        for removal in update.get("removals", []):
+            removed.update(removal.get("rawIndices", {}).get("indices", []))
+        if removed:
+            prefixes = [prefix for index, prefix in enumerate(prefixes) if index not in removed]
+
+        for addition in update.get("additions", []):
+            raw_hashes = addition.get("rawHashes", {})
+            size = raw_hashes.get("prefixSize", 4)
+            data = base64.b64decode(raw_hashes.get("rawHashes", ""))
+            prefixes.extend(data[i:i + size] for i in range(0, len(data), size))
+        prefixes.sort()
+
+        expected_checksum = base64.b64decode(update.get("checksum", {}).get("sha256", ""))
+        if hashlib.sha256(b"".join(prefixes)).digest() != expected_checksum:
+            raise ValueError(f"Safe Browsing list '{key}' checksum mismatch")
+
+        by_size = {}
+        for prefix in prefixes:
+            by_size.setdefault(len(prefix), []).append(prefix)
+        self._replace_list(key, {
+            "state": update.get("newClientState", ""),
+            "prefixes": {size: b"".join(sized) for size, sized in by_size.items()}
+        })
+
+    def reset_list(self, key):
+        self._replace_list(key, {"state": "", "prefixes": {}})
+
+    def _replace_list(self, key, entry):
+        lists = dict(self.lists)
+        lists[key] = entry
+        self.lists = lists
+
+    def save(self, path):
+        data = {
+            "next_update_after": self.next_update_after,
+            "lists": {key: {"state": entry["state"],
+                            "prefixes": {str(size): base64.b64encode(blob).decode("ascii")
+                                         for size, blob in entry["prefixes"].items()}}
+                      for key, entry in self.lists.items()}
+        }
+        temp_path = path + ".tmp"
+        with open(temp_path, "w", encoding="utf-8") as f:
+            json.dump(data, f)
+        os.replace(temp_path, path)
+        self.loaded_mtime = os.path.getmtime(path)
+
+    def load(self, path):
+        with open(path, encoding="utf-8") as f:
+            data = json.load(f)
+        self.lists = {key: {"state": entry["state"],
+                            "prefixes": {int(size): base64.b64decode(blob)
+                                         for size, blob in entry["prefixes"].items()}}
+                      for key, entry in data.get("lists", {}).items()}
+        self.next_update_after = data.get("next_update_after", 0.0)
+        self.loaded_mtime = os.path.getmtime(path)
+
+    def stats(self):
+        prefix_count = 0
+        memory_bytes = 0
+        for entry in self.lists.values():
+            for size, blob in entry["prefixes"].items():
+                prefix_count += len(blob) // size
+                memory_bytes += len(blob)
+        return {"ready": self.is_ready(), "lists": len(self.lists), "prefixes": prefix_count,
+                "memory_bytes": memory_bytes, "next_update_after": self.next_update_after}
+
+
+database = HashPrefixDatabase()
+
+# Full-hash cache: full hash -> (matches, expires_at) and negative cache: prefix -> expires_at
+FULL_HASH_CACHE_MAX_SIZE = 10000
+_full_hash_cache = {}
+_negative_prefix_cache = {}
+
+# Stats
+_stats = {"checks": 0, "prefix_hits": 0, "full_hash_requests": 0, "unsafe": 0, "updates": 0, "update_errors": 0}
+
+_sync_task = None
+
+
+def _parse_duration(duration, default=300.0):
+    try:
+        return float(str(duration).rstrip("s"))
+    except ValueError:
+        return default
+
+
+def _reload_if_changed():
+    try:
+        mtime = os.path.getmtime(SAFE_BROWSING_LOCAL_DB_PATH)
+    except OSError:
+        return
+    if database.loaded_mtime is None or mtime > database.loaded_mtime:
+        logger.info("safe_browsing_local :: Loading hash-prefix database from %s", SAFE_BROWSING_LOCAL_DB_PATH)
+        database.load(SAFE_BROWSING_LOCAL_DB_PATH)
+
+
+async def fetch_updates():
+    logger.debug("safe_browsing_local.fetch_updates() called.")
+
+    gsb_api_key = os.getenv('GOOGLE_SAFE_BROWSING_API_KEY')
+    if not gsb_api_key:
+        raise ValueError("Google Safe Browsing API key not set")
+
+    payload = {
+        "client": CLIENT_INFO,
+        "listUpdateRequests": [{
+            "threatType": threat_type,
+            "platformType": platform_type,
+            "threatEntryType": threat_entry_type,
+            "state": database.lists.get(_list_key((threat_type, platform_type, threat_entry_type)), {}).get("state", ""),
+            "constraints": {"supportedCompressions": ["RAW"]}
+        } for threat_type, platform_type, threat_entry_type in THREAT_LISTS]
+    }
+    response = await get_http_client().post(SAFE_BROWSING_API_URL + "/threatListUpdates:fetch", json=payload,
+                                            params={'key': gsb_api_key})
+    response.raise_for_status()
+    result = response.json()
+
+    for update in result.get("listUpdateResponses", []):
+        key = _list_key((update.get("threatType"), update.get("platformType"), update.get("threatEntryType")))
+        try:
+            # Sorting and checksumming a full list takes a while - not on the event loop
+            await run_blocking(database.apply_update, key, update)
+        except ValueError as e:
+            # A corrupt list is dropped, the next fetch then asks for a full update
+            logger.info("safe_browsing_local :: %s, list reset.", e)
+            database.reset_list(key)
+            _stats["update_errors"] += 1
+
+    wait = max(_parse_duration(result.get("minimumWaitDuration"), 0.0), SAFE_BROWSING_LOCAL_UPDATE_INTERVAL)
+    database.next_update_after = time.time() + wait
+    _stats["updates"] += 1
+
+
+async def sync_once():
+    logger.debug("safe_browsing_local.sync_once() called.")
+
+    await run_blocking(_reload_if_changed)
+    if database.is_ready() and time.time() < database.next_update_after:
+        return
+
+    # Only one worker per node fetches updates, the others pick up the written file
+    with open(SAFE_BROWSING_LOCAL_DB_PATH + ".lock", "w") as lock_file:
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            return
+        try:
+            await run_blocking(_reload_if_changed)
+            if database.is_ready() and time.time() < database.next_update_after:
+                return
+            await fetch_updates()
+            await run_blocking(database.save, SAFE_BROWSING_LOCAL_DB_PATH)
+            logger.info("safe_browsing_local :: Database updated: %s", database.stats())
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+async def _run_sync_loop():
+    while True:
+        try:
+            await sync_once()
+        except Exception as e:
+            _stats["update_errors"] += 1
+            logger.info("safe_browsing_local :: Sync failed: %s", e)
+        await asyncio.sleep(SAFE_BROWSING_LOCAL_CHECK_INTERVAL)
+
+
+def start():
+    global _sync_task
+    logger.debug("safe_browsing_local.start() called.")
+
+    if _sync_task is None:
+        _sync_task = asyncio.create_task(_run_sync_loop())
+
+
+async def stop():
+    global _sync_task
+    logger.debug("safe_browsing_local.stop() called.")
+
+    if _sync_task is not None:
+        _sync_task.cancel()
+        try:
+            await _sync_task
+        except asyncio.CancelledError:
+            pass
+        _sync_task = None
+
+
+async def find_full_hashes(prefixes: list):
+    logger.debug("safe_browsing_local.find_full_hashes() called.")
+
+    gsb_api_key = os.getenv('GOOGLE_SAFE_BROWSING_API_KEY')
+    payload = {
+        "client": CLIENT_INFO,
+        "clientStates": [entry["state"] for entry in database.lists.values()],
+        "threatInfo": {
+            "threatTypes": sorted({threat_list[0] for threat_list in THREAT_LISTS}),
+            "platformTypes": ["ANY_PLATFORM"],
+            "threatEntryTypes": ["URL"],
+            "threatEntries": [{"hash": base64.b64encode(prefix).decode("ascii")} for prefix in prefixes]
+        }
+    }
+    with stage_timer("safe_browsing_full_hashes"):
+        response = await get_http_client().post(SAFE_BROWSING_API_URL + "/fullHashes:find", json=payload,
+                                                params={'key': gsb_api_key})
+    response.raise_for_status()
+    _stats["full_hash_requests"] += 1
+    result = response.json()
+
+    now = time.monotonic()
+    if len(_full_hash_cache) + len(_negative_prefix_cache) > FULL_HASH_CACHE_MAX_SIZE:
+        for cache in (_full_hash_cache, _negative_prefix_cache):
+            for key in [key for key, value in cache.items() if (value[1] if isinstance(value, tuple) else value) <= now]:
+                del cache[key]
+
+    negative_expires_at = now + _parse_duration(result.get("negativeCacheDuration"))
+    for prefix in prefixes:
+        _negative_prefix_cache[prefix] = negative_expires_at
+    matches_by_hash = {}
+    for match in result.get("matches", []):
+        full_hash = base64.b64decode(match.get("threat", {}).get("hash", ""))
+        matches_by_hash.setdefault(full_hash, []).append(match)
+    for full_hash, matches in matches_by_hash.items():
+        ttl = min(_parse_duration(match.get("cacheDuration")) for match in matches)
+        _full_hash_cache[full_hash] = (matches, now + ttl)
+
+
+# Returns a url_safety_check_result dict, or None if the local database is not ready yet
+async def check_url(url: str):
+    logger.debug("safe_browsing_local.check_url() called.")
+
+    if not database.is_ready():
+        return None
+    _stats["checks"] += 1
+
+    full_hashes = [hashlib.sha256(expression.encode("utf-8")).digest() for expression in get_url_expressions(url)]
+    hits = {(full_hash, prefix) for full_hash in full_hashes for _, prefix in database.find_prefixes(full_hash)}
+    if not hits:
+        return {"is_safe": True}
+    _stats["prefix_hits"] += 1
+
+    # Only confirm prefixes whose full-hash result is not cached
+    now = time.monotonic()
+    unknown_prefixes = []
+    for full_hash, prefix in hits:
+        cached = _full_hash_cache.get(full_hash)
+        if (cached is None or cached[1] <= now) and _negative_prefix_cache.get(prefix, 0) <= now:
+            if prefix not in unknown_prefixes:
+                unknown_prefixes.append(prefix)
+    if unknown_prefixes:
+        await find_full_hashes(unknown_prefixes)
+
+    now = time.monotonic()
+    matches = []
+    for full_hash in {full_hash for full_hash, _ in hits}:
+        cached = _full_hash_cache.get(full_hash)
+        if cached is not None and cached[1] > now:
+            matches.extend(cached[0])
+    if matches:
+        _stats["unsafe"] += 1
+        return {"is_safe": False, "details": {"matches": matches}}
+    return {"is_safe": True}
+
+
+def get_safe_browsing_local_stats():
+    logger.debug("get_safe_browsing_local_stats() called.")
+
+    stats = dict(_stats)
+    stats.update(database.stats())
+    return stats
@@ -0,0 +1,293 @@
+import os
+from dotenv import load_dotenv
+import threading
+import time
+import uuid
+
+# Import helper functions
+from helpers.common import initialize_logging
+
+# Load environment variables
+load_dotenv()
+
+# Initialize logging
+logger = initialize_logging("shared_cache.py")
+
+# Shared cache settings (shared by all gunicorn workers and app nodes)
+# - SHARED_CACHE_BACKEND: "redis", "memory" (single process, for dev/tests) or empty to disable
+# - SHARED_CACHE_URL: Redis URL, e.g. redis://localhost:6379/0
+# - SHARED_CACHE_TTL / SHARED_CACHE_NEGATIVE_TTL: seconds a found / not-found lookup is cached
+# - SHARED_CACHE_LOCK_TTL: max seconds a single-flight lock is held, other callers wait at most this long
+# - SHARED_CACHE_WAIT_TIMEOUT: max seconds a caller waits for another thread of this process loading the same key,
+#   it then runs the loader itself (e.g. when the other load hangs on a stuck DB or Redis call)
+SHARED_CACHE_BACKEND = os.getenv("SHARED_CACHE_BACKEND", "").lower()
+SHARED_CACHE_URL = os.getenv("SHARED_CACHE_URL", "redis://localhost:6379/0")
+SHARED_CACHE_KEY_PREFIX = os.getenv("SHARED_CACHE_KEY_PREFIX", "zaplink:")
+SHARED_CACHE_TTL = int(os.getenv("SHARED_CACHE_TTL", "3600"))
+SHARED_CACHE_NEGATIVE_TTL = int(os.getenv("SHARED_CACHE_NEGATIVE_TTL", "30"))
+SHARED_CACHE_LOCK_TTL = float(os.getenv("SHARED_CACHE_LOCK_TTL", "2"))
+SHARED_CACHE_WAIT_TIMEOUT = float(os.getenv("SHARED_CACHE_WAIT_TIMEOUT", "5"))
+
+# Stored value for a cached "not found" result
+NOT_FOUND_VALUE = ""
+
+# Polling interval while waiting for another process to fill the cache
+LOCK_POLL_INTERVAL = 0.02
+
+
+# Backend interface - values are strings, ttl is in seconds
+class SharedCacheBackend:
+    def get(self, key):
+        raise NotImplementedError
+
+    def set(self, key, value, ttl):
+        raise NotImplementedError
+
+    def delete(self, *keys):
+        raise NotImplementedError
+
+    # Returns a lock token if the lock was acquired, None otherwise
+    def acquire_lock(self, key, ttl):
+        raise NotImplementedError
+
+    def release_lock(self, key, token):
+        raise NotImplementedError
+
+
+class MemoryCacheBackend(SharedCacheBackend):
+    def __init__(self):
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def _get_live(self, key):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        value, expires_at = entry
+        if expires_at <= time.monotonic():
+            del self._entries[key]
+            return None
+        return value
+
+    def get(self, key):
+        with self._lock:
+            return self._get_live(key)
+
+    def set(self, key, value, ttl):
+        with self._lock:
+            self._entries[key] = (value, time.monotonic() + ttl)
+
+    def delete(self, *keys):
+        with self._lock:
+            for key in keys:
+                self._entries.pop(key, None)
+
+    def acquire_lock(self, key, ttl):
+        with self._lock:
+            if self._get_live(key) is not None:
+                return None
+            token = uuid.uuid4().hex
+            self._entries[key] = (token, time.monotonic() + ttl)
+            return token
+
+    def release_lock(self, key, token):
+        with self._lock:
+            if self._get_live(key) == token:
+                del self._entries[key]
+
+
+class RedisCacheBackend(SharedCacheBackend):
+    # Only delete the lock if it is still ours (it may have expired and been taken by another process)
+    RELEASE_LOCK_SCRIPT = """
+    if redis.call("get", KEYS[1]) == ARGV[1] then
+        return redis.call("del", KEYS[1])
+    end
+    return 0
+    """
+
+    # client: an already created client with decode_responses=True (e.g. fakeredis in tests), instead of url
+    def __init__(self, url, client=None):
+        if client is None:
+            try:
+                import redis
+            except ImportError:
+                raise ValueError("Shared cache backend 'redis' requires the redis package (pip install redis)")
+
+            client = redis.Redis.from_url(url, decode_responses=True, socket_timeout=1,
+                                          socket_connect_timeout=1, health_check_interval=30)
+        self._client = client
+        self._release_lock = self._client.register_script(self.RELEASE_LOCK_SCRIPT)
+
+    def get(self, key):
+        return self._client.get(key)
+
+    def set(self, key, value, ttl):
+        self._client.set(key, value, ex=ttl)
+
+    def delete(self, *keys):
+        self._client.delete(*keys)
+
+    def acquire_lock(self, key, ttl):
+        token = uuid.uuid4().hex
+        if self._client.set(key, token, nx=True, px=int(ttl * 1000)):
+            return token
+        return None
+
+    def release_lock(self, key, token):
+        self._release_lock(keys=[key], args=[token])
+
+
+def create_backend(name):
+    logger.debug("create_backend() called.")
+
+    if not name:
+        return None
+    if name == "memory":
+        return MemoryCacheBackend()
+    if name == "redis":
+        return RedisCacheBackend(SHARED_CACHE_URL)
+    raise ValueError(f"Unknown shared cache backend: '{name}'")
+
+
+# Configured backend, None when the shared cache is disabled
+backend = create_backend(SHARED_CACHE_BACKEND)
+
+# In-flight loads in this process: key -> {"done": Event, "value": ...}
+_inflight = {}
+_inflight_lock = threading.Lock()
+
+# Stats
+_stats = {"hits": 0, "misses": 0, "loads": 0, "coalesced": 0, "wait_timeouts": 0, "errors": 0}
+_stats_lock = threading.Lock()
+
+
+def set_backend(new_backend):
+    global backend
+    backend = new_backend
+
+
+def _count(name):
+    with _stats_lock:
+        _stats[name] += 1
+
+
+# Run a backend call - the shared cache is an optimization, so errors are logged and treated as a miss
+def _call_backend(method, *args):
+    try:
+        return getattr(backend, method)(*args)
+    except Exception as e:
+        _count("errors")
+        logger.info("shared_cache :: Backend error on %s(): %s", method, e)
+        return None
+
+
+def _make_key(key):
+    return SHARED_CACHE_KEY_PREFIX + key
+
+
+def _load_through_backend(cache_key, loader):
+    # Another process may be loading the same key - wait for it instead of querying the DB as well
+    lock_key = cache_key + ":lock"
+    token = _call_backend("acquire_lock", lock_key, SHARED_CACHE_LOCK_TTL)
+    if token is None:
+        deadline = time.monotonic() + SHARED_CACHE_LOCK_TTL
+        while time.monotonic() < deadline:
+            time.sleep(LOCK_POLL_INTERVAL)
+            value = _call_backend("get", cache_key)
+            if value is not None:
+                _count("coalesced")
+                return None if value == NOT_FOUND_VALUE else value
+
+    try:
+        _count("loads")
+        value = loader()
+        ttl = SHARED_CACHE_NEGATIVE_TTL if value is None else SHARED_CACHE_TTL
+        if ttl > 0:
+            _call_backend("set", cache_key, NOT_FOUND_VALUE if value is None else value, ttl)
+        return value
+    finally:
+        if token is not None:
+            _call_backend("release_lock", lock_key, token)
+
+
+# Get a value from the shared cache, or load it with loader() - only one caller per key runs the loader
+def load(key, loader):
+    logger.debug("shared_cache.load() called.")
+
+    cache_key = _make_key(key)
+
+    if backend is not None:
+        value = _call_backend("get", cache_key)
+        if value is not None:
+            _count("hits")
+            return None if value == NOT_FOUND_VALUE else value
+        _count("misses")
+
+    # Single-flight within this process
+    with _inflight_lock:
+        flight = _inflight.get(cache_key)
+        is_leader = flight is None
+        if is_leader:
+            flight = {"done": threading.Event(), "value": None, "error": None}
+            _inflight[cache_key] = flight
+
+    if not is_leader:
+        if flight["done"].wait(SHARED_CACHE_WAIT_TIMEOUT):
+            _count("coalesced")
+            if flight["error"] is not None:
+                raise flight["error"]
+            return flight["value"]
+        # The leader is stuck - load without it instead of holding this thread any longer
+        _count("wait_timeouts")
+        logger.info("shared_cache :: Load of %s still running after %ss, loading again.", key,
+                    SHARED_CACHE_WAIT_TIMEOUT)
+        _count("loads")
+        return loader()
+
+    try:
+        if backend is not None:
+            flight["value"] = _load_through_backend(cache_key, loader)
+        else:
+            _count("loads")
+            flight["value"] = loader()
+        return flight["value"]
+    except Exception as e:
+        flight["error"] = e
+        raise
+    finally:
+        with _inflight_lock:
+            del _inflight[cache_key]
+        flight["done"].set()
+
+
+# Plain get / set of a key, without a loader - None when missing or when the shared cache is disabled
+def get_value(key):
+    logger.debug("shared_cache.get_value() called.")
+
+    if backend is None:
+        return None
+    return _call_backend("get", _make_key(key))
+
+
+def set_value(key, value, ttl=None):
+    logger.debug("shared_cache.set_value() called.")
+
+    if backend is not None:
+        _call_backend("set", _make_key(key), value, SHARED_CACHE_TTL if ttl is None else ttl)
+
+
+def invalidate(*keys):
+    logger.debug("shared_cache.invalidate() called.")
+
+    if backend is not None:
+        _call_backend("delete", *[_make_key(key) for key in keys])
+
+
+def get_shared_cache_stats():
+    logger.debug("get_shared_cache_stats() called.")
+
+    with _stats_lock:
+        stats = dict(_stats)
+    stats["backend"] = type(backend).__name__ if backend is not None else "disabled"
+    stats["inflight"] = len(_inflight)
+    return stats
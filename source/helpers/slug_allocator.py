@@ -0,0 +1,169 @@
+import os
+from dotenv import load_dotenv
+import shortuuid
+import string
+import threading
+import time
+
+# Import helper functions
+from helpers.common import initialize_logging
+from helpers.storage import require_mysql
+
+# Load environment variables
+load_dotenv()
+
+# Initialize logging
+logger = initialize_logging("slug_allocator.py")
+
+# Slug allocation settings
+# - SLUG_ALLOCATOR: "random" (random shortuuid slugs), "block" (base62 ids from per-worker id blocks)
+#   or "snowflake" (base62 of time + node + sequence ids)
+# - SLUG_LENGTH: length of random slugs
+# - SLUG_BLOCK_SIZE: ids reserved per DB round trip by the block allocator
+# - SLUG_SNOWFLAKE_NODE_ID: unique id (0-31) of this app node for the snowflake allocator
+# - SLUG_MAX_ATTEMPTS: inserts tried before giving up on duplicate slugs
+SLUG_ALLOCATOR = os.getenv("SLUG_ALLOCATOR", "random").lower()
+SLUG_LENGTH = int(os.getenv("SLUG_LENGTH", "8"))
+SLUG_BLOCK_SIZE = int(os.getenv("SLUG_BLOCK_SIZE", "1000"))
+SLUG_SNOWFLAKE_NODE_ID = int(os.getenv("SLUG_SNOWFLAKE_NODE_ID", "0"))
+SLUG_MAX_ATTEMPTS = int(os.getenv("SLUG_MAX_ATTEMPTS", "5"))
+
+BASE62_ALPHABET = string.digits + string.ascii_uppercase + string.ascii_lowercase
+
+# Snowflake layout: 41 bits milliseconds since SNOWFLAKE_EPOCH_MS, 5 bits node, 5 bits worker, 12 bits sequence
+SNOWFLAKE_EPOCH_MS = 1704067200000  # 2024-01-01 UTC
+SNOWFLAKE_SEQUENCE_BITS = 12
+SNOWFLAKE_WORKER_BITS = 5
+SNOWFLAKE_NODE_BITS = 5
+
+# Stats
+_stats = {"allocated": 0, "collisions": 0, "retries": 0, "failures": 0, "block_fetches": 0}
+_stats_lock = threading.Lock()
+
+
+def _count(name, value=1):
+    with _stats_lock:
+        _stats[name] += value
+
+
+def encode_base62(number: int) -> str:
+    if number == 0:
+        return BASE62_ALPHABET[0]
+    chars = []
+    while number:
+        number, remainder = divmod(number, 62)
+        chars.append(BASE62_ALPHABET[remainder])
+    return "".join(reversed(chars))
+
+
+class RandomSlugAllocator:
+    def allocate(self, db):
+        return shortuuid.ShortUUID().random(length=SLUG_LENGTH)
+
+
+# Hi/lo allocator: reserves SLUG_BLOCK_SIZE ids with one UPDATE and hands them out from memory
+class BlockSlugAllocator:
+    def __init__(self, block_size):
+        self.block_size = block_size
+        self._next_id = 0
+        self._end_id = 0
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def _fetch_block(self, db):
+        logger.debug("BlockSlugAllocator._fetch_block() called.")
+
+        cursor = db.cursor()
+        cursor.execute("UPDATE slug_sequences SET next_id = LAST_INSERT_ID(next_id + %s) WHERE name = 'urls'",
+                       (self.block_size,))
+        cursor.execute("SELECT LAST_INSERT_ID()")
+        end_id = cursor.fetchone()[0]
+        db.commit()
+        cursor.close()
+        _count("block_fetches")
+        return end_id - self.block_size, end_id
+
+    def allocate(self, db):
+        with self._lock:
+            # Blocks are never shared between forked gunicorn workers
+            if self._next_id >= self._end_id or self._pid != os.getpid():
+                self._next_id, self._end_id = self._fetch_block(db)
+                self._pid = os.getpid()
+            slug_id = self._next_id
+            self._next_id += 1
+        return encode_base62(slug_id)
+
+
+class SnowflakeSlugAllocator:
+    def __init__(self, node_id):
+        self.node_id = node_id & ((1 << SNOWFLAKE_NODE_BITS) - 1)
+        self._last_ms = -1
+        self._sequence = 0
+        self._lock = threading.Lock()
+
+    def allocate(self, db):
+        # Workers of one node are told apart by pid; a rare clash is caught by the duplicate-key retry
+        worker_id = os.getpid() & ((1 << SNOWFLAKE_WORKER_BITS) - 1)
+        with self._lock:
+            now_ms = max(int(time.time() * 1000), self._last_ms)
+            if now_ms == self._last_ms:
+                self._sequence = (self._sequence + 1) & ((1 << SNOWFLAKE_SEQUENCE_BITS) - 1)
+                if self._sequence == 0:
+                    # Sequence exhausted for this millisecond - move on to the next one
+                    now_ms += 1
+            else:
+                self._sequence = 0
+            self._last_ms = now_ms
+            sequence = self._sequence
+
+        snowflake_id = (((now_ms - SNOWFLAKE_EPOCH_MS) << (SNOWFLAKE_NODE_BITS + SNOWFLAKE_WORKER_BITS +
+                                                            SNOWFLAKE_SEQUENCE_BITS))
+                        | (self.node_id << (SNOWFLAKE_WORKER_BITS + SNOWFLAKE_SEQUENCE_BITS))
+                        | (worker_id << SNOWFLAKE_SEQUENCE_BITS)
+                        | sequence)
+        return encode_base62(snowflake_id)
+
+
+def create_allocator(name):
+    logger.debug("create_allocator() called.")
+
+    if name == "random":
+        return RandomSlugAllocator()
+    if name == "block":
+        # The id blocks come from the slug_sequences table (LAST_INSERT_ID)
+        require_mysql("SLUG_ALLOCATOR=block")
+        return BlockSlugAllocator(SLUG_BLOCK_SIZE)
+    if name == "snowflake":
+        return SnowflakeSlugAllocator(SLUG_SNOWFLAKE_NODE_ID)
+    raise ValueError(f"Unknown slug allocator: '{name}'")
+
+
+# Configured allocator
+allocator = create_allocator(SLUG_ALLOCATOR)
+
+
+def allocate_slug(db):
+    logger.debug("allocate_slug() called.")
+
+    slug = allocator.allocate(db)
+    _count("allocated")
+    return slug
+
+
+def record_collision(will_retry: bool):
+    _count("collisions")
+    if will_retry:
+        _count("retries")
+
+
+def record_failure():
+    _count("failures")
+
+
+def get_slug_allocator_stats():
+    logger.debug("get_slug_allocator_stats() called.")
+
+    with _stats_lock:
+        stats = dict(_stats)
+    stats["allocator"] = SLUG_ALLOCATOR
+    return stats
@@ -0,0 +1,316 @@
+import os
+from dotenv import load_dotenv
+import hashlib
+import math
+import mmap
+import struct
+import threading
+import time
+
+# Import helper functions
+from helpers.common import initialize_logging
+from helpers.db_connection import pooled_connection
+from helpers.storage import get_storage
+from helpers import shared_cache
+
+# Load environment variables
+load_dotenv()
+
+# Initialize logging
+logger = initialize_logging("slug_filter.py")
+
+# Slug filter settings (per gunicorn worker process)
+# - SLUG_FILTER_ENABLED: answer lookups of slugs that are definitely not in the urls table without a DB query
+# - SLUG_FILTER_FP_RATE: target false positive rate, the share of unknown slugs that still reach the DB
+# - SLUG_FILTER_CAPACITY: slugs the filter is sized for at least - it is sized for twice the current count otherwise
+# - SLUG_FILTER_SYNC_INTERVAL: seconds between reads of slugs created by other workers / nodes
+# - SLUG_FILTER_SYNC_OVERLAP: ids re-read below the highest id seen, for rows of transactions committed out of order
+# - SLUG_FILTER_REBUILD_INTERVAL: seconds between rebuilds from the DB (0 = never), e.g. to drop slugs made unsafe
+# - SLUG_FILTER_SNAPSHOT_PATH: filter file written by python build_slug_filter.py - workers map it instead of
+#   building their own filter, so they share its memory pages (empty = each worker builds its own)
+SLUG_FILTER_ENABLED = os.getenv("SLUG_FILTER_ENABLED", "false").lower() == "true"
+SLUG_FILTER_FP_RATE = float(os.getenv("SLUG_FILTER_FP_RATE", "0.001"))
+SLUG_FILTER_CAPACITY = int(os.getenv("SLUG_FILTER_CAPACITY", "100000"))
+SLUG_FILTER_SYNC_INTERVAL = float(os.getenv("SLUG_FILTER_SYNC_INTERVAL", "2"))
+SLUG_FILTER_SYNC_OVERLAP = int(os.getenv("SLUG_FILTER_SYNC_OVERLAP", "1000"))
+SLUG_FILTER_REBUILD_INTERVAL = float(os.getenv("SLUG_FILTER_REBUILD_INTERVAL", "3600"))
+SLUG_FILTER_SNAPSHOT_PATH = os.getenv("SLUG_FILTER_SNAPSHOT_PATH", "")
+
+# Rows read per query when building or syncing
+SCAN_PAGE_SIZE = 10000
+
+# Shared cache key announcing a slug created since the last sync, to the workers whose filter does not have it yet
+NEW_SLUG_KEY_PREFIX = "new-slug:"
+
+# Snapshot file: magic, format version, bit count, hash count, slug count, highest urlx_id - then the bit array
+SNAPSHOT_MAGIC = b"ZLBF"
+SNAPSHOT_HEADER = struct.Struct("<4sIQIQQ")
+SNAPSHOT_VERSION = 1
+
+
+class BloomFilter:
+    def __init__(self, bit_count, hash_count, bits=None, item_count=0, max_id=0):
+        self.bit_count = bit_count
+        self.hash_count = hash_count
+        # bytearray while building, a read-only mmap of a snapshot file once loaded
+        self.bits = bits if bits is not None else bytearray((bit_count + 7) // 8)
+        self.item_count = item_count
+        self.max_id = max_id
+
+    @classmethod
+    def for_capacity(cls, capacity, fp_rate):
+        capacity = max(capacity, 1)
+        bit_count = max(64, int(math.ceil(-capacity * math.log(fp_rate) / (math.log(2) ** 2))))
+        hash_count = max(1, int(round(bit_count / capacity * math.log(2))))
+        return cls(bit_count, hash_count)
+
+    def _positions(self, slug):
+        # Double hashing: k positions from the two halves of one 128-bit digest
+        digest = hashlib.blake2b(slug.encode("utf-8"), digest_size=16).digest()
+        first, second = int.from_bytes(digest[:8], "little"), int.from_bytes(digest[8:], "little") | 1
+        return [(first + index * second) % self.bit_count for index in range(self.hash_count)]
+
+    def add(self, slug):
+        for position in self._positions(slug):
+            self.bits[position >> 3] |= 1 << (position & 7)
+        self.item_count += 1
+
+    def __contains__(self, slug):
+        bits = self.bits
+        for position in self._positions(slug):
+            if not bits[position >> 3] & (1 << (position & 7)):
+                return False
+        return True
+
+    # Expected false positive rate for the slugs added so far
+    def estimated_fp_rate(self):
+        return (1 - math.exp(-self.hash_count * self.item_count / self.bit_count)) ** self.hash_count
+
+    def write(self, path):
+        # Written next to the target and renamed, so that workers never map a half-written file
+        temp_path = path + ".tmp"
+        with open(temp_path, "wb") as f:
+            f.write(SNAPSHOT_HEADER.pack(SNAPSHOT_MAGIC, SNAPSHOT_VERSION, self.bit_count, self.hash_count,
+                                         self.item_count, self.max_id))
+            f.write(self.bits)
+        os.replace(temp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        with open(path, "rb") as f:
+            header = f.read(SNAPSHOT_HEADER.size)
+            if len(header) != SNAPSHOT_HEADER.size:
+                raise ValueError(f"Slug filter snapshot '{path}' is truncated")
+            magic, version, bit_count, hash_count, item_count, max_id = SNAPSHOT_HEADER.unpack(header)
+            if magic != SNAPSHOT_MAGIC or version != SNAPSHOT_VERSION:
+                raise ValueError(f"Slug filter snapshot '{path}' has an unknown format")
+            mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if len(mapped) != SNAPSHOT_HEADER.size + (bit_count + 7) // 8:
+            mapped.close()
+            raise ValueError(f"Slug filter snapshot '{path}' is truncated")
+        bits = memoryview(mapped)[SNAPSHOT_HEADER.size:]
+        return cls(bit_count, hash_count, bits, item_count, max_id)
+
+
+# Stream all safe slugs of the urls table into a new filter
+def build_filter(db):
+    logger.debug("build_filter() called.")
+
+    storage = get_storage()
+    count = storage.count_safe_urls(db)
+    bloom = BloomFilter.for_capacity(max(SLUG_FILTER_CAPACITY, count * 2), SLUG_FILTER_FP_RATE)
+    after_id = 0
+    while True:
+        page = storage.find_safe_slugs(db, after_id, SCAN_PAGE_SIZE)
+        if not page:
+            break
+        for _, slug in page:
+            bloom.add(slug)
+        after_id = page[-1][0]
+    bloom.max_id = after_id
+    return bloom
+
+
+# Filter in use by this worker: the built / mapped filter plus the slugs added since it was built
+_bloom = None
+_recent = set()
+_source = None
+_built_at = None
+_watermark = 0
+_snapshot_mtime = None
+_lock = threading.Lock()
+
+_stats = {"checks": 0, "definite_misses": 0, "false_positives": 0, "new_slug_hits": 0, "builds": 0,
+          "snapshot_loads": 0, "syncs": 0, "errors": 0}
+
+# Background sync thread
+_stopping = threading.Event()
+_syncer = None
+_syncer_pid = None
+
+
+# False only if the slug is definitely not a safe slug in the urls table - True until the filter is ready
+def might_contain(slug: str):
+    bloom = _bloom
+    if bloom is None:
+        return True
+    _stats["checks"] += 1
+    if slug in _recent or slug in bloom:
+        return True
+    if _is_new_slug(slug):
+        _stats["new_slug_hits"] += 1
+        return True
+    _stats["definite_misses"] += 1
+    return False
+
+
+# Slugs created by another worker / node since the last sync are not in this filter yet - they are announced in the
+# shared cache. Without one, a miss is answered from the filter alone and such a slug gets a 404 until the next sync.
+def _is_new_slug(slug: str):
+    if shared_cache.backend is None:
+        return False
+    return shared_cache.get_value(NEW_SLUG_KEY_PREFIX + slug) is not None
+
+
+# Record a new safe slug - called after its row was committed. Announced to the other workers / nodes as well.
+def add_slug(slug: str):
+    if _bloom is not None:
+        _recent.add(slug)
+    if SLUG_FILTER_ENABLED:
+        shared_cache.set_value(NEW_SLUG_KEY_PREFIX + slug, "1")
+
+
+# A slug the filter let through was not found in the DB
+def record_false_positive():
+    if _bloom is not None:
+        _stats["false_positives"] += 1
+
+
+def _install(bloom, source, recent_before):
+    global _bloom, _recent, _source, _built_at, _watermark
+
+    with _lock:
+        # Slugs added locally while the filter was built may not be in it yet - keep them
+        _recent = set(_recent - recent_before) if _bloom is not None else set()
+        _bloom = bloom
+        _source = source
+        _built_at = time.time()
+        _watermark = bloom.max_id
+
+
+def rebuild():
+    logger.debug("slug_filter.rebuild() called.")
+
+    recent_before = set(_recent)
+    started = time.monotonic()
+    with pooled_connection() as db:
+        bloom = build_filter(db)
+    _install(bloom, "db", recent_before)
+    _stats["builds"] += 1
+    logger.info("slug_filter :: Built filter of %d slugs in %.2fs, %d KB.", bloom.item_count,
+                time.monotonic() - started, len(bloom.bits) // 1024)
+
+
+# Map the snapshot file if it changed - returns True if a snapshot is in use
+def load_snapshot():
+    global _snapshot_mtime
+    logger.debug("slug_filter.load_snapshot() called.")
+
+    try:
+        mtime = os.stat(SLUG_FILTER_SNAPSHOT_PATH).st_mtime
+    except OSError:
+        return False
+    if mtime == _snapshot_mtime:
+        return True
+
+    recent_before = set(_recent)
+    bloom = BloomFilter.load(SLUG_FILTER_SNAPSHOT_PATH)
+    _install(bloom, "snapshot", recent_before)
+    _snapshot_mtime = mtime
+    _stats["snapshot_loads"] += 1
+    logger.info("slug_filter :: Loaded snapshot of %d slugs (up to id %d).", bloom.item_count, bloom.max_id)
+    return True
+
+
+# Add slugs committed since the last sync, by this or any other worker / node
+def sync():
+    global _watermark
+    logger.debug("slug_filter.sync() called.")
+
+    storage = get_storage()
+    after_id = max(0, _watermark - SLUG_FILTER_SYNC_OVERLAP)
+    with pooled_connection() as db:
+        while True:
+            page = storage.find_safe_slugs(db, after_id, SCAN_PAGE_SIZE)
+            for _, slug in page:
+                if slug not in _bloom:
+                    _recent.add(slug)
+            if page:
+                after_id = page[-1][0]
+            if len(page) < SCAN_PAGE_SIZE:
+                break
+    with _lock:
+        _watermark = max(_watermark, after_id)
+    _stats["syncs"] += 1
+
+
+def _refresh():
+    # A snapshot wins over building in the worker - without one, fall back to building from the DB
+    if SLUG_FILTER_SNAPSHOT_PATH and load_snapshot():
+        return
+    if _bloom is None or _source == "snapshot" or (
+            SLUG_FILTER_REBUILD_INTERVAL > 0 and time.time() - _built_at >= SLUG_FILTER_REBUILD_INTERVAL):
+        rebuild()
+
+
+def _run_syncer():
+    while not _stopping.is_set():
+        try:
+            _refresh()
+            sync()
+        except Exception as e:
+            _stats["errors"] += 1
+            logger.info("slug_filter :: Refresh failed, keeping the current filter: %s", e)
+        _stopping.wait(SLUG_FILTER_SYNC_INTERVAL)
+
+
+def start():
+    global _syncer, _syncer_pid
+    logger.debug("slug_filter.start() called.")
+
+    if SLUG_FILTER_ENABLED and (_syncer is None or _syncer_pid != os.getpid()):
+        _stopping.clear()
+        _syncer = threading.Thread(target=_run_syncer, name="slug-filter-sync", daemon=True)
+        _syncer.start()
+        _syncer_pid = os.getpid()
+
+
+def stop():
+    global _syncer
+    logger.debug("slug_filter.stop() called.")
+
+    if _syncer is not None and _syncer_pid == os.getpid():
+        _stopping.set()
+        _syncer.join(timeout=5)
+        _syncer = None
+
+
+def get_slug_filter_stats():
+    bloom = _bloom
+    stats = dict(_stats)
+    unknown = stats["false_positives"] + stats["definite_misses"]
+    stats.update({
+        "ready": bloom is not None,
+        "source": _source,
+        "slugs": bloom.item_count if bloom is not None else 0,
+        "recent_slugs": len(_recent),
+        "bits": bloom.bit_count if bloom is not None else 0,
+        "hash_count": bloom.hash_count if bloom is not None else 0,
+        "memory_bytes": len(bloom.bits) if bloom is not None else 0,
+        "target_fp_rate": SLUG_FILTER_FP_RATE,
+        "estimated_fp_rate": bloom.estimated_fp_rate() if bloom is not None else 0.0,
+        # Share of unknown slugs the filter let through to the DB
+        "observed_fp_rate": stats["false_positives"] / unknown if unknown else 0.0,
+        "watermark": _watermark,
+    })
+    return stats
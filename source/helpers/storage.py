@@ -0,0 +1,303 @@
+import os
+from dotenv import load_dotenv
+import abc
+import sqlite3
+from mysql.connector import IntegrityError, errorcode
+
+# Import helper functions
+from helpers.common import initialize_logging
+from helpers.db_connection import create_connection
+
+# Load environment variables
+load_dotenv()
+
+# Initialize logging
+logger = initialize_logging("storage.py")
+
+# Storage backend settings
+# - STORAGE_BACKEND: "mysql" (DATABASE_* settings), or "sqlite" - an embedded database file for single-node deployments
+# - SQLITE_PATH: database file of the sqlite backend, created with the schema in db/zaplink.sqlite.sql if missing
+# - SQLITE_MMAP_SIZE: bytes of the database file memory-mapped per connection, so lookups read from the page cache
+# - SQLITE_BUSY_TIMEOUT: milliseconds a write waits for another process's write to finish
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "mysql").lower()
+SQLITE_PATH = os.getenv("SQLITE_PATH", "zaplink.sqlite3")
+SQLITE_MMAP_SIZE = int(os.getenv("SQLITE_MMAP_SIZE", str(256 * 1024 * 1024)))
+SQLITE_BUSY_TIMEOUT = int(os.getenv("SQLITE_BUSY_TIMEOUT", "5000"))
+
+SQLITE_SCHEMA_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))), "db",
+                                  "zaplink.sqlite.sql")
+
+
+# Raised by insert_urls() when a row's slug or URL hash already exists - key is "slug" or "hash"
+class DuplicateKeyError(ValueError):
+    def __init__(self, key, message):
+        super().__init__(message)
+        self.key = key
+
+
+# Operations on the urls table used by the app. Every method takes a connection from the pool (see connect()).
+# All backends have to pass the checks in tests/test_storage.py.
+class Storage(abc.ABC):
+    name = None
+
+    @abc.abstractmethod
+    def connect(self):
+        raise NotImplementedError
+
+    # (original URL, redirect status, cache TTL) of a safe slug, or None - the policy columns are None for defaults
+    @abc.abstractmethod
+    def find_redirect(self, db, slug):
+        raise NotImplementedError
+
+    # Original URL of a safe slug, or None
+    def find_original_url(self, db, slug):
+        redirect = self.find_redirect(db, slug)
+        return redirect[0] if redirect is not None else None
+
+    # Slug of the URL with this hash in hash_column (urlx_hash / urlx_hash_bin), or None
+    @abc.abstractmethod
+    def find_slug_by_hash(self, db, hash_column, url_hash):
+        raise NotImplementedError
+
+    # url_hash -> {"slug": ..., "is_safe": ...} for the hashes that exist
+    @abc.abstractmethod
+    def find_urls_by_hashes(self, db, hash_column, url_hashes):
+        raise NotImplementedError
+
+    # Insert rows (tuples in the order of columns) in one transaction - raises DuplicateKeyError, nothing is inserted
+    @abc.abstractmethod
+    def insert_urls(self, db, columns, rows):
+        raise NotImplementedError
+
+    # Add slug -> count to the visit counts of safe URLs, in one transaction
+    @abc.abstractmethod
+    def increment_visits(self, db, slug_counts):
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def update_is_safe(self, db, slug, is_safe, unsafe_details):
+        raise NotImplementedError
+
+    # Set the redirect status / cache TTL of a slug, None = the defaults
+    @abc.abstractmethod
+    def update_redirect_policy(self, db, slug, redirect_status, cache_ttl):
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def get_visit_count(self, db, slug):
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def count_safe_urls(self, db):
+        raise NotImplementedError
+
+    # Up to limit (urlx_id, slug) pairs of safe URLs with an id above after_id, in id order
+    @abc.abstractmethod
+    def find_safe_slugs(self, db, after_id, limit):
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def delete_urls(self, db, slugs):
+        raise NotImplementedError
+
+
+# Shared implementation for SQL databases - subclasses set the placeholder, batch size and duplicate key detection
+class SQLStorage(Storage):
+    placeholder = "%s"
+    batch_size = 500
+
+    def _placeholders(self, count):
+        return ", ".join([self.placeholder] * count)
+
+    def _batches(self, items):
+        for start in range(0, len(items), self.batch_size):
+            yield items[start:start + self.batch_size]
+
+    # "slug" / "hash" if the error is a duplicate key on that index, otherwise None
+    @abc.abstractmethod
+    def _duplicate_key(self, error):
+        raise NotImplementedError
+
+    def find_redirect(self, db, slug):
+        cursor = db.cursor()
+        cursor.execute("SELECT urlx_original_url, urlx_redirect_status, urlx_cache_ttl FROM urls "
+                       "WHERE urlx_is_safe = 1 AND urlx_slug = " + self.placeholder, (slug,))
+        row = cursor.fetchone()
+        cursor.close()
+        return tuple(row) if row else None
+
+    def find_slug_by_hash(self, db, hash_column, url_hash):
+        cursor = db.cursor()
+        cursor.execute("SELECT urlx_slug FROM urls WHERE " + hash_column + " = " + self.placeholder + " LIMIT 1",
+                       (url_hash,))
+        row = cursor.fetchone()
+        cursor.close()
+        return row[0] if row else None
+
+    def find_urls_by_hashes(self, db, hash_column, url_hashes):
+        existing = {}
+        cursor = db.cursor()
+        for batch in self._batches(list(url_hashes)):
+            cursor.execute("SELECT " + hash_column + ", urlx_slug, urlx_is_safe FROM urls WHERE " + hash_column +
+                           " IN (" + self._placeholders(len(batch)) + ")", batch)
+            for url_hash, slug, is_safe in cursor.fetchall():
+                # BINARY columns come back as bytearray from mysql-connector
+                existing[bytes(url_hash) if isinstance(url_hash, bytearray) else url_hash] = {
+                    "slug": slug, "is_safe": bool(is_safe)}
+        cursor.close()
+        return existing
+
+    def insert_urls(self, db, columns, rows):
+        query = ("INSERT INTO urls (" + ", ".join(columns) + ") VALUES (" + self._placeholders(len(columns)) + ")")
+        cursor = db.cursor()
+        try:
+            for batch in self._batches(list(rows)):
+                cursor.executemany(query, batch)
+            db.commit()
+        except Exception as e:
+            db.rollback()
+            key = self._duplicate_key(e)
+            if key is None:
+                raise
+            raise DuplicateKeyError(key, str(e))
+        finally:
+            cursor.close()
+
+    def increment_visits(self, db, slug_counts):
+        # One multi-row UPDATE per batch of slugs, committed once
+        cursor = db.cursor()
+        for batch in self._batches(list(slug_counts.items())):
+            case_sql = " ".join(["WHEN " + self.placeholder + " THEN " + self.placeholder] * len(batch))
+            query = ("UPDATE urls SET urlx_visit_count = urlx_visit_count + CASE urlx_slug " + case_sql +
+                     " ELSE 0 END WHERE urlx_is_safe = 1 AND urlx_slug IN (" + self._placeholders(len(batch)) + ")")
+            params = [value for item in batch for value in item] + [slug for slug, _ in batch]
+            cursor.execute(query, params)
+        db.commit()
+        cursor.close()
+
+    def update_is_safe(self, db, slug, is_safe, unsafe_details):
+        cursor = db.cursor()
+        cursor.execute("UPDATE urls SET urlx_is_safe = " + self.placeholder + ", urlx_unsafe_details = " +
+                       self.placeholder + " WHERE urlx_slug = " + self.placeholder,
+                       (is_safe, unsafe_details, slug))
+        db.commit()
+        cursor.close()
+
+    def update_redirect_policy(self, db, slug, redirect_status, cache_ttl):
+        cursor = db.cursor()
+        cursor.execute("UPDATE urls SET urlx_redirect_status = " + self.placeholder + ", urlx_cache_ttl = " +
+                       self.placeholder + " WHERE urlx_slug = " + self.placeholder,
+                       (redirect_status, cache_ttl, slug))
+        db.commit()
+        cursor.close()
+
+    def get_visit_count(self, db, slug):
+        cursor = db.cursor()
+        cursor.execute("SELECT urlx_visit_count FROM urls WHERE urlx_slug = " + self.placeholder, (slug,))
+        row = cursor.fetchone()
+        cursor.close()
+        return row[0] if row else None
+
+    def count_safe_urls(self, db):
+        cursor = db.cursor()
+        cursor.execute("SELECT COUNT(*) FROM urls WHERE urlx_is_safe = 1")
+        count = cursor.fetchone()[0]
+        cursor.close()
+        return count
+
+    def find_safe_slugs(self, db, after_id, limit):
+        cursor = db.cursor()
+        cursor.execute("SELECT urlx_id, urlx_slug FROM urls WHERE urlx_id > " + self.placeholder +
+                       " AND urlx_is_safe = 1 ORDER BY urlx_id LIMIT " + self.placeholder, (after_id, limit))
+        rows = cursor.fetchall()
+        cursor.close()
+        return [(url_id, slug) for url_id, slug in rows]
+
+    def delete_urls(self, db, slugs):
+        cursor = db.cursor()
+        for batch in self._batches(list(slugs)):
+            cursor.execute("DELETE FROM urls WHERE urlx_slug IN (" + self._placeholders(len(batch)) + ")", batch)
+        db.commit()
+        cursor.close()
+
+
+class MySQLStorage(SQLStorage):
+    name = "mysql"
+
+    def connect(self):
+        return create_connection()
+
+    def _duplicate_key(self, error):
+        if not isinstance(error, IntegrityError) or error.errno != errorcode.ER_DUP_ENTRY:
+            return None
+        # idx_urls_hash / idx_urls_hash_bin, otherwise idx_urls_slug
+        return "hash" if "idx_urls_hash" in str(error) else "slug"
+
+
+# sqlite3 connection usable by the pool: shared between threads (one at a time) and with a no-op ping()
+class SQLiteConnection(sqlite3.Connection):
+    def ping(self, reconnect=True, attempts=1, delay=0):
+        pass
+
+
+class SQLiteStorage(SQLStorage):
+    name = "sqlite"
+    placeholder = "?"
+    # SQLite before 3.32 allows at most 999 parameters per statement
+    batch_size = 300
+
+    def __init__(self, path):
+        self.path = path
+        self._schema_checked = False
+
+    def connect(self):
+        logger.debug("SQLiteStorage.connect() called.")
+
+        try:
+            connection = sqlite3.connect(self.path, timeout=SQLITE_BUSY_TIMEOUT / 1000, check_same_thread=False,
+                                         factory=SQLiteConnection)
+            # WAL: lookups never wait for a write, and a write does not wait for lookups
+            connection.execute("PRAGMA journal_mode = WAL")
+            connection.execute("PRAGMA synchronous = NORMAL")
+            connection.execute("PRAGMA mmap_size = %d" % SQLITE_MMAP_SIZE)
+            if not self._schema_checked:
+                with open(SQLITE_SCHEMA_PATH, encoding="utf-8") as f:
+                    connection.executescript(f.read())
+                self._schema_checked = True
+        except (sqlite3.Error, OSError) as e:
+            raise ValueError(f"SQLite connection error: '{e}' occurred")
+        return connection
+
+    def _duplicate_key(self, error):
+        if not isinstance(error, sqlite3.IntegrityError) or "UNIQUE" not in str(error):
+            return None
+        # "UNIQUE constraint failed: urls.urlx_hash" / urls.urlx_hash_bin / urls.urlx_slug
+        return "hash" if "urls.urlx_hash" in str(error) else "slug"
+
+
+def create_storage(name):
+    logger.debug("create_storage() called.")
+
+    if name == "mysql":
+        return MySQLStorage()
+    if name == "sqlite":
+        return SQLiteStorage(SQLITE_PATH)
+    raise ValueError(f"Unknown storage backend: '{name}'")
+
+
+storage = create_storage(STORAGE_BACKEND)
+
+
+def get_storage():
+    return storage
+
+
+def set_storage(new_storage):
+    global storage
+    storage = new_storage
+
+
+# Features that run MySQL SQL on the primary (slug_sequences, replication status) refuse to start on other backends
+def require_mysql(feature: str):
+    if get_storage().name != "mysql":
+        raise ValueError(f"{feature} needs STORAGE_BACKEND=mysql, not '{get_storage().name}'")
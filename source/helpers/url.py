@@ -1,12 +1,17 @@
 import os
 from dotenv import load_dotenv
-from urllib.parse import urlparse
-import requests
-import json
+from urllib.parse import urlparse, urlsplit, urlunsplit, quote
+from functools import lru_cache
 import hashlib
+import asyncio
+import re
 
 # Import helper functions
 from helpers.common import initialize_logging
+from helpers.http_client import get_http_client
+from helpers.cache import LRUCache
+from helpers.metrics import stage_timer
+from helpers import safe_browsing_local
 
 # Load environment variables
 load_dotenv()
@@ -25,40 +30,192 @@ def validate_url(url: str) -> bool:
         return False
 
 
-def check_is_url_safe(url: str):
-    logger.debug("check_is_url_safe() called.")
+# URL canonicalization settings (applied before hashing for dedup, see canonicalize_url())
+# - URL_CANONICAL_STRIP_TRAILING_SLASH: treat /path/ and /path as the same URL (the root path is always "/")
+# - URL_CANONICAL_STRIP_TRACKING_PARAMS: ignore utm_* and click id query parameters (fbclid, gclid, ...)
+URL_CANONICAL_STRIP_TRAILING_SLASH = os.getenv("URL_CANONICAL_STRIP_TRAILING_SLASH", "false").lower() == "true"
+URL_CANONICAL_STRIP_TRACKING_PARAMS = os.getenv("URL_CANONICAL_STRIP_TRACKING_PARAMS", "false").lower() == "true"
+
+DEFAULT_PORTS = {"http": 80, "https": 443}
+TRACKING_PARAM_PREFIXES = ("utm_",)
+TRACKING_PARAMS = {"fbclid", "gclid", "dclid", "gbraid", "wbraid", "msclkid", "yclid", "igshid", "mc_cid", "mc_eid",
+                   "_ga", "_gl"}
+
+# Characters left as they are in paths / queries, everything else is percent-encoded
+PATH_SAFE_CHARS = "/:@!$&'()*+,;=-._~%"
+QUERY_SAFE_CHARS = "/?:@!$&'()*+,;=-._~%"
+UNRESERVED_CHARS = set("ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789-._~")
+PERCENT_ESCAPE_PATTERN = re.compile(r"%([0-9A-Fa-f]{2})")
+
+
+# Safe Browsing settings
+# - SAFE_BROWSING_MODE: "lookup" (one threatMatches:find call per URL / batch) or "local" (local hash-prefix database
+#   kept in sync via the Update API, see helpers/safe_browsing_local.py - falls back to "lookup" until it is ready)
+# - SAFE_BROWSING_API_URL: API base URL (can point to a local stub server)
+# - SAFE_BROWSING_CACHE_MAX_SIZE / SAFE_BROWSING_NEGATIVE_CACHE_TTL: verdict cache size and seconds a "safe" verdict
+#   is cached ("unsafe" verdicts are cached for the cacheDuration returned by the API)
+# - SAFE_BROWSING_BATCH_WINDOW_MS: concurrent checks within this window are sent as one request (0 = no batching)
+# - SAFE_BROWSING_BATCH_MAX_URLS: max URLs per request (the API allows 500)
+SAFE_BROWSING_MODE = os.getenv("SAFE_BROWSING_MODE", "lookup").lower()
+SAFE_BROWSING_API_URL = os.getenv("SAFE_BROWSING_API_URL", "https://safebrowsing.googleapis.com/v4")
+SAFE_BROWSING_CACHE_MAX_SIZE = int(os.getenv("SAFE_BROWSING_CACHE_MAX_SIZE", "10000"))
+SAFE_BROWSING_NEGATIVE_CACHE_TTL = float(os.getenv("SAFE_BROWSING_NEGATIVE_CACHE_TTL", "300"))
+SAFE_BROWSING_BATCH_WINDOW_MS = float(os.getenv("SAFE_BROWSING_BATCH_WINDOW_MS", "0"))
+SAFE_BROWSING_BATCH_MAX_URLS = int(os.getenv("SAFE_BROWSING_BATCH_MAX_URLS", "500"))
+
+# Verdict cache, keyed by the hash of the canonical URL
+verdict_cache = LRUCache(SAFE_BROWSING_CACHE_MAX_SIZE, SAFE_BROWSING_NEGATIVE_CACHE_TTL)
+
+# URLs waiting for the next batched request: url -> list of futures
+_batch_pending = {}
+_batch_task = None
+
+# Stats
+_safe_browsing_stats = {"api_calls": 0, "urls_checked": 0, "batched_calls": 0, "api_errors": 0}
+
+
+def _parse_cache_duration(duration: str):
+    # The API returns durations like "300s" or "300.5s"
+    try:
+        return float(duration.rstrip("s"))
+    except (AttributeError, ValueError):
+        return SAFE_BROWSING_NEGATIVE_CACHE_TTL
+
+
+async def check_urls_safety(urls: list):
+    logger.debug("check_urls_safety() called.")
 
     gsb_api_key = os.getenv('GOOGLE_SAFE_BROWSING_API_KEY')
     if not gsb_api_key:
         raise ValueError("Google Safe Browsing API key not set")
 
-    endpoint = "https://safebrowsing.googleapis.com/v4/threatMatches:find"
-    payload = {
-        "client": {
-            "clientId": "yourcompanyname",
-            "clientVersion": "1.0"
-        },
-        "threatInfo": {
-            "threatTypes": ["MALWARE", "SOCIAL_ENGINEERING"],
-            "platformTypes": ["ANY_PLATFORM"],
-            "threatEntryTypes": ["URL"],
-            "threatEntries": [
-                {"url": url}
-            ]
-        }
-    }
+    results = {}
+
+    # Cached verdicts first - URLs with the same canonical form are checked once
+    uncached_urls = []
+    first_url_by_key = {}
+    same_as = {}
+    for url in urls:
+        url_key = generate_url_key(url)
+        cached_result = verdict_cache.get(url_key)
+        if cached_result is not None:
+            results[url] = cached_result
+        elif url_key in first_url_by_key:
+            same_as[url] = first_url_by_key[url_key]
+        else:
+            first_url_by_key[url_key] = url
+            uncached_urls.append(url)
+
+    # Local hash-prefix database, only URLs with a confirmed prefix hit cost a remote call
+    if SAFE_BROWSING_MODE == "local":
+        remote_urls = []
+        for url in uncached_urls:
+            url_safety_check_result = await safe_browsing_local.check_url(url)
+            if url_safety_check_result is None:
+                remote_urls.append(url)
+                continue
+            verdict_cache.set(generate_url_key(url), url_safety_check_result)
+            results[url] = url_safety_check_result
+        uncached_urls = remote_urls
+
+    # One threatMatches:find request per SAFE_BROWSING_BATCH_MAX_URLS uncached URLs
+    endpoint = SAFE_BROWSING_API_URL + "/threatMatches:find"
     params = {'key': gsb_api_key}
-    response = requests.post(endpoint, json=payload, params=params)
-    result = response.json()
+    for start in range(0, len(uncached_urls), SAFE_BROWSING_BATCH_MAX_URLS):
+        batch = uncached_urls[start:start + SAFE_BROWSING_BATCH_MAX_URLS]
+        payload = {
+            "client": {
+                "clientId": "yourcompanyname",
+                "clientVersion": "1.0"
+            },
+            "threatInfo": {
+                "threatTypes": ["MALWARE", "SOCIAL_ENGINEERING"],
+                "platformTypes": ["ANY_PLATFORM"],
+                "threatEntryTypes": ["URL"],
+                "threatEntries": [{"url": url} for url in batch]
+            }
+        }
+        with stage_timer("safe_browsing"):
+            response = await get_http_client().post(endpoint, json=payload, params=params)
+        _safe_browsing_stats["api_calls"] += 1
+        # An error reply (invalid key, quota, 5xx) has no "matches" - it must not be taken as "safe", nor cached
+        if response.status_code != 200:
+            _safe_browsing_stats["api_errors"] += 1
+        response.raise_for_status()
+        result = response.json()
+        _safe_browsing_stats["urls_checked"] += len(batch)
+
+        # Group the matches by URL
+        matches_by_url = {}
+        for match in result.get("matches", []):
+            matches_by_url.setdefault(match.get("threat", {}).get("url"), []).append(match)
+
+        for url in batch:
+            matches = matches_by_url.get(url)
+            if matches:
+                url_safety_check_result = {"is_safe": False, "details": {"matches": matches}}
+                ttl = min(_parse_cache_duration(match.get("cacheDuration")) for match in matches)
+            else:
+                url_safety_check_result = {"is_safe": True}
+                ttl = SAFE_BROWSING_NEGATIVE_CACHE_TTL
+            verdict_cache.set(generate_url_key(url), url_safety_check_result, ttl)
+            results[url] = url_safety_check_result
+            logger.info("url_safety_check_result: %s", url_safety_check_result)
 
-    if "matches" in result:
-        url_safety_check_result = {"is_safe": False, "details": result}
-        logger.info("url_safety_check_result: " + json.dumps(url_safety_check_result))
-        return url_safety_check_result
-    else:
-        url_safety_check_result = {"is_safe": True}
-        logger.info("url_safety_check_result: " + json.dumps(url_safety_check_result))
-        return url_safety_check_result
+    for url, checked_url in same_as.items():
+        results[url] = results[checked_url]
+    return results
+
+
+async def _flush_batch():
+    global _batch_pending, _batch_task
+
+    await asyncio.sleep(SAFE_BROWSING_BATCH_WINDOW_MS / 1000)
+    pending = _batch_pending
+    _batch_pending = {}
+    _batch_task = None
+
+    _safe_browsing_stats["batched_calls"] += 1
+    try:
+        results = await check_urls_safety(list(pending.keys()))
+        for url, futures in pending.items():
+            for future in futures:
+                if not future.done():
+                    future.set_result(results[url])
+    except Exception as e:
+        for futures in pending.values():
+            for future in futures:
+                if not future.done():
+                    future.set_exception(e)
+
+
+async def check_is_url_safe(url: str):
+    logger.debug("check_is_url_safe() called.")
+
+    global _batch_task
+
+    cached_result = verdict_cache.get(generate_url_key(url))
+    if cached_result is not None:
+        return cached_result
+
+    if SAFE_BROWSING_BATCH_WINDOW_MS <= 0:
+        results = await check_urls_safety([url])
+        return results[url]
+
+    # Coalesce concurrent checks into one request
+    future = asyncio.get_running_loop().create_future()
+    _batch_pending.setdefault(url, []).append(future)
+    if _batch_task is None:
+        _batch_task = asyncio.create_task(_flush_batch())
+    return await future
+
+
+def get_safe_browsing_stats():
+    logger.debug("get_safe_browsing_stats() called.")
+
+    stats = dict(_safe_browsing_stats)
+    stats["verdict_cache"] = verdict_cache.stats()
+    return stats
 
 
 def generate_url_hash(url):
@@ -77,3 +234,65 @@ def generate_url_hash(url):
     hash_hex = sha256_hash.hexdigest()
 
     return hash_hex
+
+
+def _normalize_percent_encoding(component: str, safe: str):
+    # Escapes of unreserved characters are decoded, the others upper-cased, characters that need one get escaped
+    def normalize_escape(match):
+        char = chr(int(match.group(1), 16))
+        return char if char in UNRESERVED_CHARS else "%" + match.group(1).upper()
+    return quote(PERCENT_ESCAPE_PATTERN.sub(normalize_escape, component), safe=safe)
+
+
+def _remove_dot_segments(path: str):
+    output = []
+    for segment in path.split("/"):
+        if segment == "..":
+            if len(output) > 1:
+                output.pop()
+        elif segment != ".":
+            output.append(segment)
+    result = "/".join(output)
+    if path.endswith(("/.", "/..")):
+        result += "/"
+    return result or "/"
+
+
+def _is_tracking_param(param: str):
+    name = param.partition("=")[0].lower()
+    return name in TRACKING_PARAMS or name.startswith(TRACKING_PARAM_PREFIXES)
+
+
+# Canonical form of a URL, so that e.g. https://Example.com:443 and https://example.com/ are stored once
+@lru_cache(maxsize=4096)
+def canonicalize_url(url: str):
+    parts = urlsplit(url.strip())
+    scheme = parts.scheme.lower()
+
+    # Host: lower case, no trailing dot, no default port
+    netloc = parts.netloc.rpartition("@")
+    userinfo = netloc[0] + "@" if netloc[1] else ""
+    host = (parts.hostname or "").rstrip(".")
+    if ":" in host:
+        host = "[" + host + "]"
+    try:
+        port = parts.port
+    except ValueError:
+        port = None
+    if port is not None and port != DEFAULT_PORTS.get(scheme):
+        host += ":" + str(port)
+
+    path = _remove_dot_segments(_normalize_percent_encoding(parts.path, PATH_SAFE_CHARS) or "/")
+    if URL_CANONICAL_STRIP_TRAILING_SLASH and path != "/":
+        path = path.rstrip("/") or "/"
+
+    params = [_normalize_percent_encoding(param, QUERY_SAFE_CHARS) for param in parts.query.split("&") if param]
+    if URL_CANONICAL_STRIP_TRACKING_PARAMS:
+        params = [param for param in params if not _is_tracking_param(param)]
+
+    return urlunsplit((scheme, userinfo + host, path, "&".join(params), parts.fragment))
+
+
+# Fixed-width dedup key of a URL: the 32-byte SHA-256 of its canonical form (urlx_hash_bin)
+def generate_url_key(url):
+    return hashlib.sha256(canonicalize_url(url).encode("utf-8")).digest()
@@ -0,0 +1,122 @@
+import os
+from dotenv import load_dotenv
+import threading
+
+# Import helper functions
+from helpers.common import initialize_logging
+from helpers.db_connection import pooled_connection
+
+# Load environment variables
+load_dotenv()
+
+# Initialize logging
+logger = initialize_logging("visit_counter.py")
+
+# Visit count buffering (per gunicorn worker process)
+# - VISIT_COUNT_FLUSH_INTERVAL: max seconds visits are held in memory before being written (0 = write every visit)
+# - VISIT_COUNT_FLUSH_THRESHOLD: pending visits that trigger an early flush
+# Visits still in memory when a worker crashes are lost, so both values bound the loss window.
+VISIT_COUNT_FLUSH_INTERVAL = float(os.getenv("VISIT_COUNT_FLUSH_INTERVAL", "5"))
+VISIT_COUNT_FLUSH_THRESHOLD = int(os.getenv("VISIT_COUNT_FLUSH_THRESHOLD", "1000"))
+
+# Pending visits: slug -> count
+_pending = {}
+_pending_total = 0
+_lock = threading.Lock()
+
+# Background flusher
+_flush_requested = threading.Event()
+_stopping = threading.Event()
+_flusher = None
+_flusher_pid = None
+_flusher_lock = threading.Lock()
+
+
+def is_buffered():
+    return VISIT_COUNT_FLUSH_INTERVAL > 0
+
+
+def add_visit(slug: str, count: int = 1):
+    global _pending_total
+
+    _ensure_started()
+    with _lock:
+        _pending[slug] = _pending.get(slug, 0) + count
+        _pending_total += count
+        threshold_reached = _pending_total >= VISIT_COUNT_FLUSH_THRESHOLD
+    if threshold_reached:
+        _flush_requested.set()
+
+
+def flush():
+    global _pending, _pending_total
+    logger.debug("visit_counter.flush() called.")
+
+    # Imported here to avoid a circular import (helpers.app uses this module)
+    from helpers.app import update_url_visit_counts
+
+    with _lock:
+        counts = _pending
+        _pending = {}
+        _pending_total = 0
+    if not counts:
+        return
+
+    try:
+        with pooled_connection() as db:
+            update_url_visit_counts(db, counts)
+        logger.debug("visit_counter.flush() :: Flushed visits for %d slugs.", len(counts))
+    except Exception as e:
+        # Put the counts back so that they are retried on the next flush
+        logger.info("visit_counter.flush() :: Flush failed, will retry: %s", e)
+        with _lock:
+            for slug, count in counts.items():
+                _pending[slug] = _pending.get(slug, 0) + count
+                _pending_total += count
+
+
+def _run_flusher():
+    while not _stopping.is_set():
+        _flush_requested.wait(VISIT_COUNT_FLUSH_INTERVAL)
+        _flush_requested.clear()
+        flush()
+
+
+def _ensure_started():
+    global _flusher, _flusher_pid
+
+    # Each gunicorn worker needs its own flusher thread (threads do not survive a fork)
+    pid = os.getpid()
+    if _flusher is not None and _flusher_pid == pid:
+        return
+    with _flusher_lock:
+        if _flusher is None or _flusher_pid != pid:
+            _stopping.clear()
+            _flusher = threading.Thread(target=_run_flusher, name="visit-counter-flusher", daemon=True)
+            _flusher.start()
+            _flusher_pid = pid
+
+
+def start():
+    logger.debug("visit_counter.start() called.")
+
+    if is_buffered():
+        _ensure_started()
+
+
+# Stop the flusher and write all pending visits - called on graceful shutdown
+def stop():
+    global _flusher
+    logger.debug("visit_counter.stop() called.")
+
+    if _flusher is not None and _flusher_pid == os.getpid():
+        _stopping.set()
+        _flush_requested.set()
+        _flusher.join(timeout=VISIT_COUNT_FLUSH_INTERVAL + 5)
+        _flusher = None
+    flush()
+
+
+def get_visit_counter_stats():
+    with _lock:
+        return {"pending_slugs": len(_pending), "pending_visits": _pending_total}
@@ -0,0 +1,269 @@
+import os
+from dotenv import load_dotenv
+from functools import lru_cache
+from urllib.parse import urlsplit
+import re
+import socket
+import threading
+import time
+
+# Import helper functions
+from helpers.common import initialize_logging
+
+# Load environment variables
+load_dotenv()
+
+# Initialize logging
+logger = initialize_logging("visit_events.py")
+
+# Visit event log settings (per gunicorn worker process)
+# - VISIT_EVENTS_ENABLED: record one event per redirect (slug, time, referrer, user agent class, country)
+# - VISIT_EVENTS_DIR: local directory of the append-only event log segments, shared by all workers of a node
+# - VISIT_EVENTS_FLUSH_INTERVAL: seconds events are buffered in memory before being appended to the log
+# - VISIT_EVENTS_MAX_BUFFER: max events buffered in memory, further events are dropped
+# - VISIT_EVENTS_SEGMENT_MAX_BYTES / VISIT_EVENTS_SEGMENT_MAX_AGE: size / seconds after which a segment is closed
+# - VISIT_EVENTS_GEOIP_DB: local GeoIP2 / GeoLite2 country database (.mmdb), requires: pip install geoip2
+VISIT_EVENTS_ENABLED = os.getenv("VISIT_EVENTS_ENABLED", "false").lower() == "true"
+VISIT_EVENTS_DIR = os.getenv("VISIT_EVENTS_DIR", "visit_events")
+VISIT_EVENTS_FLUSH_INTERVAL = float(os.getenv("VISIT_EVENTS_FLUSH_INTERVAL", "1"))
+VISIT_EVENTS_MAX_BUFFER = int(os.getenv("VISIT_EVENTS_MAX_BUFFER", "200000"))
+VISIT_EVENTS_SEGMENT_MAX_BYTES = int(os.getenv("VISIT_EVENTS_SEGMENT_MAX_BYTES", str(64 * 1024 * 1024)))
+VISIT_EVENTS_SEGMENT_MAX_AGE = float(os.getenv("VISIT_EVENTS_SEGMENT_MAX_AGE", "300"))
+VISIT_EVENTS_GEOIP_DB = os.getenv("VISIT_EVENTS_GEOIP_DB", "")
+
+# Segment files: visits-<host>-<pid>-<start ms>.log while written, renamed to .closed once complete
+SEGMENT_PREFIX = "visits-"
+OPEN_SUFFIX = ".log"
+CLOSED_SUFFIX = ".closed"
+
+# Max length of a stored referrer host
+MAX_REFERRER_LENGTH = 255
+
+# User agent classes, first match wins
+USER_AGENT_CLASSES = [
+    ("bot", re.compile(r"bot|crawl|spider|slurp|preview|curl|wget|python|java/|go-http|okhttp|http-client|headless",
+                       re.I)),
+    ("tablet", re.compile(r"ipad|tablet|kindle|silk|playbook", re.I)),
+    ("mobile", re.compile(r"mobi|iphone|ipod|android|blackberry|opera mini|windows phone", re.I)),
+]
+
+# Raw events waiting to be written: (unix time, slug, referrer, user agent, client ip)
+_events = []
+_lock = threading.Lock()
+
+_stats = {"recorded": 0, "dropped": 0, "written": 0, "segments_closed": 0, "write_errors": 0}
+_stats_lock = threading.Lock()
+
+# Background writer
+_flush_requested = threading.Event()
+_stopping = threading.Event()
+_writer = None
+_writer_pid = None
+_writer_lock = threading.Lock()
+
+# Segment currently written by this worker: {"path", "file", "size", "opened"}
+_segment = None
+
+_geoip_reader = None
+_geoip_loaded = False
+
+
+def _count(name, value=1):
+    with _stats_lock:
+        _stats[name] += value
+
+
+def is_enabled():
+    return VISIT_EVENTS_ENABLED
+
+
+# Called on the redirect path - only appends the raw values, all parsing happens in the writer thread.
+# visited_at is the unix time of visits read from elsewhere (nginx access log), default now.
+def record_visit(slug: str, referrer: str, user_agent: str, client_ip: str, visited_at: float = None):
+    _ensure_started()
+    with _lock:
+        if len(_events) >= VISIT_EVENTS_MAX_BUFFER:
+            dropped = True
+        else:
+            _events.append((time.time() if visited_at is None else visited_at, slug, referrer, user_agent,
+                            client_ip))
+            dropped = False
+    _count("dropped" if dropped else "recorded")
+
+
+# -- Enrichment (writer thread) --
+
+@lru_cache(maxsize=4096)
+def classify_user_agent(user_agent: str):
+    if not user_agent:
+        return "unknown"
+    for name, pattern in USER_AGENT_CLASSES:
+        if pattern.search(user_agent):
+            return name
+    return "desktop"
+
+
+@lru_cache(maxsize=4096)
+def get_referrer_host(referrer: str):
+    if not referrer:
+        return ""
+    try:
+        host = urlsplit(referrer).hostname or ""
+    except ValueError:
+        return ""
+    return host[:MAX_REFERRER_LENGTH]
+
+
+def _get_geoip_reader():
+    global _geoip_reader, _geoip_loaded
+
+    if not _geoip_loaded:
+        _geoip_loaded = True
+        if VISIT_EVENTS_GEOIP_DB:
+            try:
+                import geoip2.database
+                _geoip_reader = geoip2.database.Reader(VISIT_EVENTS_GEOIP_DB)
+            except ImportError:
+                logger.info("visit_events :: VISIT_EVENTS_GEOIP_DB requires the geoip2 package (pip install geoip2).")
+            except (OSError, ValueError) as e:
+                logger.info("visit_events :: GeoIP database could not be opened: %s", e)
+    return _geoip_reader
+
+
+@lru_cache(maxsize=65536)
+def get_country(client_ip: str):
+    reader = _get_geoip_reader()
+    if reader is None or not client_ip:
+        return ""
+    try:
+        return reader.country(client_ip).country.iso_code or ""
+    except Exception:
+        # Unknown or invalid address
+        return ""
+
+
+def _clean(value: str):
+    # Tabs and newlines separate fields and events in the log
+    return value.replace("\t", " ").replace("\n", " ").replace("\r", " ")
+
+
+def format_event(event):
+    timestamp, slug, referrer, user_agent, client_ip = event
+    return (str(int(timestamp)) + "\t" + slug + "\t" + _clean(get_referrer_host(referrer)) + "\t" +
+            classify_user_agent(user_agent) + "\t" + get_country(client_ip) + "\n")
+
+
+# Parse a line written by format_event(): (unix time, slug, referrer host, user agent class, country)
+def parse_event(line: str):
+    fields = line.rstrip("\n").split("\t")
+    if len(fields) != 5:
+        return None
+    try:
+        return int(fields[0]), fields[1], fields[2], fields[3], fields[4]
+    except ValueError:
+        return None
+
+
+# -- Segments --
+
+def _open_segment():
+    global _segment
+
+    os.makedirs(VISIT_EVENTS_DIR, exist_ok=True)
+    name = (SEGMENT_PREFIX + socket.gethostname().replace("-", "_") + "-" + str(os.getpid()) + "-" +
+            str(int(time.time() * 1000)) + OPEN_SUFFIX)
+    path = os.path.join(VISIT_EVENTS_DIR, name)
+    _segment = {"path": path, "file": open(path, "a", encoding="utf-8"), "size": 0, "opened": time.monotonic()}
+
+
+def close_segment():
+    global _segment
+
+    if _segment is None:
+        return
+    _segment["file"].close()
+    if _segment["size"] > 0:
+        os.replace(_segment["path"], _segment["path"][:-len(OPEN_SUFFIX)] + CLOSED_SUFFIX)
+        _count("segments_closed")
+    else:
+        os.remove(_segment["path"])
+    _segment = None
+
+
+def flush():
+    global _events
+    logger.debug("visit_events.flush() called.")
+
+    with _lock:
+        events = _events
+        _events = []
+
+    try:
+        if events:
+            if _segment is None:
+                _open_segment()
+            data = "".join(format_event(event) for event in events)
+            _segment["file"].write(data)
+            _segment["file"].flush()
+            _segment["size"] += len(data)
+            _count("written", len(events))
+
+        # Closed segments are picked up by the compactor
+        if _segment is not None and (_segment["size"] >= VISIT_EVENTS_SEGMENT_MAX_BYTES or
+                                     time.monotonic() - _segment["opened"] >= VISIT_EVENTS_SEGMENT_MAX_AGE):
+            close_segment()
+    except OSError as e:
+        _count("write_errors")
+        logger.info("visit_events.flush() :: Writing events failed, %d events lost: %s", len(events), e)
+
+
+def _run_writer():
+    while not _stopping.is_set():
+        _flush_requested.wait(VISIT_EVENTS_FLUSH_INTERVAL)
+        _flush_requested.clear()
+        flush()
+
+
+def _ensure_started():
+    global _writer, _writer_pid, _segment
+
+    # Each gunicorn worker needs its own writer thread and segment (threads do not survive a fork)
+    pid = os.getpid()
+    if _writer is not None and _writer_pid == pid:
+        return
+    with _writer_lock:
+        if _writer is None or _writer_pid != pid:
+            _segment = None
+            _stopping.clear()
+            _writer = threading.Thread(target=_run_writer, name="visit-events-writer", daemon=True)
+            _writer.start()
+            _writer_pid = pid
+
+
+def start():
+    logger.debug("visit_events.start() called.")
+
+    if VISIT_EVENTS_ENABLED:
+        _ensure_started()
+
+
+# Stop the writer, append all buffered events and close the segment - called on graceful shutdown
+def stop():
+    global _writer
+    logger.debug("visit_events.stop() called.")
+
+    if _writer is not None and _writer_pid == os.getpid():
+        _stopping.set()
+        _flush_requested.set()
+        _writer.join(timeout=VISIT_EVENTS_FLUSH_INTERVAL + 5)
+        _writer = None
+        flush()
+        close_segment()
+
+
+def get_visit_events_stats():
+    with _stats_lock:
+        stats = dict(_stats)
+    with _lock:
+        stats["buffered"] = len(_events)
+    return stats
@@ -0,0 +1,254 @@
+import os
+from dotenv import load_dotenv
+from datetime import datetime, timedelta, timezone
+import fcntl
+import threading
+
+# Import helper functions
+from helpers.common import initialize_logging
+from helpers.db_connection import pooled_connection
+from helpers.storage import get_storage
+from helpers.visit_events import (VISIT_EVENTS_DIR, VISIT_EVENTS_SEGMENT_MAX_AGE, SEGMENT_PREFIX, OPEN_SUFFIX,
+                                  CLOSED_SUFFIX, parse_event)
+
+# Load environment variables
+load_dotenv()
+
+# Initialize logging
+logger = initialize_logging("visit_rollups.py")
+
+# Visit rollup settings
+# - VISIT_ROLLUP_INTERVAL: seconds between compactor runs, one worker per node compacts at a time
+# - VISIT_ROLLUP_MAX_RANGE_DAYS: max time range of one analytics query
+VISIT_ROLLUP_INTERVAL = float(os.getenv("VISIT_ROLLUP_INTERVAL", "60"))
+VISIT_ROLLUP_MAX_RANGE_DAYS = int(os.getenv("VISIT_ROLLUP_MAX_RANGE_DAYS", "400"))
+
+# Rows per multi-row upsert
+ROLLUP_BATCH_SIZE = 1000
+
+# Breakdown dimensions: event field index -> name stored in visit_rollups_daily_dims
+DIMENSIONS = {2: "referrer", 3: "ua_class", 4: "country"}
+
+GRANULARITY_TABLES = {"hour": "visit_rollups_hourly", "day": "visit_rollups_daily"}
+
+# The rollup tables and their upserts are MySQL only - on other storage backends there is no compactor and no
+# visits API, the event log segments are kept for ingestion elsewhere
+VISIT_ROLLUPS_SUPPORTED = get_storage().name == "mysql"
+
+_stats = {"runs": 0, "segments": 0, "events": 0, "invalid_lines": 0, "errors": 0}
+_stats_lock = threading.Lock()
+
+_stopping = threading.Event()
+_compactor = None
+_compactor_pid = None
+
+
+def _count(name, value=1):
+    with _stats_lock:
+        _stats[name] += value
+
+
+# -- Compactor --
+
+def aggregate_segment(path: str):
+    logger.debug("aggregate_segment() called.")
+
+    hourly = {}
+    daily = {}
+    dims = {}
+    events = 0
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            event = parse_event(line)
+            if event is None:
+                _count("invalid_lines")
+                continue
+            events += 1
+            timestamp, slug = event[0], event[1]
+            hour = datetime.fromtimestamp(timestamp - timestamp % 3600, timezone.utc).replace(tzinfo=None)
+            day = hour.date()
+            hourly[(slug, hour)] = hourly.get((slug, hour), 0) + 1
+            daily[(slug, day)] = daily.get((slug, day), 0) + 1
+            for index, dimension in DIMENSIONS.items():
+                key = (slug, day, dimension, event[index])
+                dims[key] = dims.get(key, 0) + 1
+    return hourly, daily, dims, events
+
+
+def _upsert(cursor, table: str, columns: list, counts: dict):
+    rows = [key + (visits,) for key, visits in counts.items()]
+    placeholders = "(" + ", ".join(["%s"] * (len(columns) + 1)) + ")"
+    for start in range(0, len(rows), ROLLUP_BATCH_SIZE):
+        batch = rows[start:start + ROLLUP_BATCH_SIZE]
+        query = ("INSERT INTO " + table + " (" + ", ".join(columns) + ", visits) VALUES " +
+                 ", ".join([placeholders] * len(batch)) + " ON DUPLICATE KEY UPDATE visits = visits + VALUES(visits)")
+        cursor.execute(query, [value for row in batch for value in row])
+
+
+# Roll one closed segment up into the aggregate tables - exactly once, the segment name is recorded in the same transaction
+def compact_segment(db, path: str):
+    logger.debug("compact_segment() called.")
+
+    name = os.path.basename(path)
+    hourly, daily, dims, events = aggregate_segment(path)
+    cursor = db.cursor()
+    try:
+        cursor.execute("INSERT IGNORE INTO visit_rollup_segments (name, events) VALUES (%s, %s)", (name, events))
+        if cursor.rowcount == 0:
+            logger.info("compact_segment() :: Segment already compacted: %s", name)
+        else:
+            _upsert(cursor, "visit_rollups_hourly", ["slug", "bucket_start"], hourly)
+            _upsert(cursor, "visit_rollups_daily", ["slug", "bucket_start"], daily)
+            _upsert(cursor, "visit_rollups_daily_dims", ["slug", "bucket_start", "dimension", "value"], dims)
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        cursor.close()
+    os.remove(path)
+    _count("segments")
+    _count("events", events)
+
+
+def _is_process_alive(pid: int):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def _close_abandoned_segments(filenames: list):
+    # Open segments of workers that died without closing them
+    for filename in filenames:
+        if not filename.endswith(OPEN_SUFFIX):
+            continue
+        path = os.path.join(VISIT_EVENTS_DIR, filename)
+        try:
+            pid = int(filename[len(SEGMENT_PREFIX):].split("-")[1])
+            age = datetime.now().timestamp() - os.path.getmtime(path)
+        except (ValueError, IndexError, OSError):
+            continue
+        if not _is_process_alive(pid) or age > 2 * VISIT_EVENTS_SEGMENT_MAX_AGE:
+            logger.info("visit_rollups :: Closing abandoned segment: %s", filename)
+            os.replace(path, path[:-len(OPEN_SUFFIX)] + CLOSED_SUFFIX)
+
+
+def compact_once():
+    logger.debug("visit_rollups.compact_once() called.")
+
+    if not os.path.isdir(VISIT_EVENTS_DIR):
+        return 0
+
+    # Only one worker of the node compacts at a time
+    with open(os.path.join(VISIT_EVENTS_DIR, ".compactor.lock"), "w") as lock_file:
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            return 0
+        try:
+            _close_abandoned_segments(os.listdir(VISIT_EVENTS_DIR))
+            segments = sorted(filename for filename in os.listdir(VISIT_EVENTS_DIR)
+                              if filename.startswith(SEGMENT_PREFIX) and filename.endswith(CLOSED_SUFFIX))
+            if segments:
+                with pooled_connection() as db:
+                    for filename in segments:
+                        compact_segment(db, os.path.join(VISIT_EVENTS_DIR, filename))
+            _count("runs")
+            return len(segments)
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def _run_compactor():
+    while not _stopping.wait(VISIT_ROLLUP_INTERVAL):
+        try:
+            compact_once()
+        except Exception as e:
+            _count("errors")
+            logger.info("visit_rollups :: Compaction failed, will retry: %s", e)
+
+
+def start():
+    global _compactor, _compactor_pid
+    logger.debug("visit_rollups.start() called.")
+
+    if not VISIT_ROLLUPS_SUPPORTED:
+        logger.info("visit_rollups.start() :: Visit rollups need STORAGE_BACKEND=mysql, compactor not started.")
+        return
+    if _compactor is None or _compactor_pid != os.getpid():
+        _stopping.clear()
+        _compactor = threading.Thread(target=_run_compactor, name="visit-rollups-compactor", daemon=True)
+        _compactor.start()
+        _compactor_pid = os.getpid()
+
+
+def stop():
+    global _compactor
+    logger.debug("visit_rollups.stop() called.")
+
+    if _compactor is not None and _compactor_pid == os.getpid():
+        _stopping.set()
+        _compactor.join(timeout=30)
+        _compactor = None
+
+
+def get_visit_rollups_stats():
+    with _stats_lock:
+        return dict(_stats)
+
+
+# -- Queries --
+
+def parse_time_range(start: str, end: str):
+    logger.debug("parse_time_range() called.")
+
+    # ISO 8601 dates / datetimes in UTC, default: the last 7 days
+    try:
+        end_time = datetime.fromisoformat(end) if end else datetime.now(timezone.utc).replace(tzinfo=None)
+        start_time = datetime.fromisoformat(start) if start else end_time - timedelta(days=7)
+    except ValueError:
+        raise ValueError("start and end must be ISO 8601 dates or datetimes")
+    if start_time.tzinfo is not None:
+        start_time = start_time.astimezone(timezone.utc).replace(tzinfo=None)
+    if end_time.tzinfo is not None:
+        end_time = end_time.astimezone(timezone.utc).replace(tzinfo=None)
+    if start_time > end_time:
+        raise ValueError("start must not be after end")
+    if end_time - start_time > timedelta(days=VISIT_ROLLUP_MAX_RANGE_DAYS):
+        raise ValueError(f"Time range too large, max {VISIT_ROLLUP_MAX_RANGE_DAYS} days")
+    return start_time, end_time
+
+
+def get_visit_series(db, slug: str, granularity: str, start_time: datetime, end_time: datetime):
+    logger.debug("get_visit_series() called.")
+
+    if granularity not in GRANULARITY_TABLES:
+        raise ValueError("granularity must be one of: " + ", ".join(GRANULARITY_TABLES))
+    if granularity == "day":
+        start_time, end_time = start_time.date(), end_time.date()
+    cursor = db.cursor()
+    query = ("SELECT bucket_start, visits FROM " + GRANULARITY_TABLES[granularity] +
+             " WHERE slug = %s AND bucket_start BETWEEN %s AND %s ORDER BY bucket_start")
+    cursor.execute(query, (slug, start_time, end_time))
+    series = [{"time": bucket_start.isoformat(), "visits": visits} for bucket_start, visits in cursor.fetchall()]
+    cursor.close()
+    return series
+
+
+def get_visit_breakdown(db, slug: str, dimension: str, start_time: datetime, end_time: datetime, limit: int = 20):
+    logger.debug("get_visit_breakdown() called.")
+
+    if dimension not in DIMENSIONS.values():
+        raise ValueError("breakdown must be one of: " + ", ".join(DIMENSIONS.values()))
+    cursor = db.cursor()
+    query = ("SELECT value, SUM(visits) AS total FROM visit_rollups_daily_dims "
+             "WHERE slug = %s AND dimension = %s AND bucket_start BETWEEN %s AND %s "
+             "GROUP BY value ORDER BY total DESC LIMIT %s")
+    cursor.execute(query, (slug, dimension, start_time.date(), end_time.date(), limit))
+    breakdown = [{"value": value, "visits": int(total)} for value, total in cursor.fetchall()]
+    cursor.close()
+    return breakdown
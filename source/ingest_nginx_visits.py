@@ -0,0 +1,154 @@
+import os
+import sys
+import argparse
+import json
+import re
+
+# Add the source directory to the Python path, so that helpers are found when run from any directory
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+# Import helper functions
+from helpers.common import initialize_logging
+from helpers.db_connection import pooled_connection
+from helpers.redirects import REDIRECT_STATUSES
+from helpers import visit_events
+from helpers.app import update_url_visit_counts
+
+# Initialize logging
+logger = initialize_logging("ingest_nginx_visits.py")
+
+# Counts the visits of redirects nginx served from its proxy_cache - these never reach the app, so they are read from
+# the zaplink_visits access log (config/nginx/zaplink_python_fastapi). Run it periodically, e.g. from cron.
+# Only cache hits are counted, every other request reached the app and was counted there. The read position is kept
+# in a state file, a rotated log (<log>.1) is read to its end first. A crash between a commit and saving the state
+# counts that batch twice.
+
+# log_format zaplink_visits '$msec $status $upstream_cache_status $uri "$http_referer" "$http_user_agent" $remote_addr'
+LOG_LINE_PATTERN = re.compile(r'^(\S+) (\d{3}) (\S+) /(\S+) "((?:[^"\\]|\\.)*)" "((?:[^"\\]|\\.)*)" (\S+)$')
+ESCAPE_PATTERN = re.compile(r"\\x([0-9A-Fa-f]{2})")
+
+# Cache statuses of responses nginx served without asking the app. With proxy_cache_background_update on, nginx
+# logs STALE for a response whose update request reached the app and was counted there - keep it off.
+CACHED_STATUSES = {"HIT", "STALE", "UPDATING"}
+
+
+# nginx escapes ", \ and non-printable bytes in log variables as \xXX, and logs empty values as "-"
+def _unescape(value: str):
+    if value == "-":
+        return ""
+    return ESCAPE_PATTERN.sub(lambda match: chr(int(match.group(1), 16)), value)
+
+
+# (unix time, slug, referrer, user agent, client ip) of a cached redirect, None for any other line
+def parse_line(line: str):
+    match = LOG_LINE_PATTERN.match(line)
+    if match is None:
+        return None
+    msec, status, cache_status, slug, referrer, user_agent, client_ip = match.groups()
+    if int(status) not in REDIRECT_STATUSES or cache_status not in CACHED_STATUSES:
+        return None
+    return float(msec), slug, _unescape(referrer), _unescape(user_agent), client_ip
+
+
+def load_state(state_path: str):
+    logger.debug("load_state() called.")
+
+    try:
+        with open(state_path, encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {"inode": None, "offset": 0}
+
+
+def save_state(state_path: str, state: dict):
+    logger.debug("save_state() called.")
+
+    temp_path = state_path + ".tmp"
+    with open(temp_path, "w", encoding="utf-8") as f:
+        json.dump(state, f)
+    os.replace(temp_path, state_path)
+
+
+# Read complete lines from offset on, one batch of up to batch_size lines at a time - yields (lines, next offset)
+def read_batches(path: str, offset: int, batch_size: int):
+    with open(path, "rb") as f:
+        f.seek(offset)
+        lines = []
+        for raw_line in f:
+            if not raw_line.endswith(b"\n"):
+                break  # Still being written
+            offset += len(raw_line)
+            lines.append(raw_line.decode("utf-8", errors="replace").rstrip("\n"))
+            if len(lines) >= batch_size:
+                yield lines, offset
+                lines = []
+        if lines:
+            yield lines, offset
+
+
+def ingest_file(db, path: str, offset: int, args, totals: dict, on_batch):
+    logger.debug("ingest_file() called.")
+
+    for lines, next_offset in read_batches(path, offset, args.batch_size):
+        slug_counts = {}
+        for line in lines:
+            totals["lines"] += 1
+            visit = parse_line(line)
+            if visit is None:
+                continue
+            slug_counts[visit[1]] = slug_counts.get(visit[1], 0) + 1
+            if visit_events.VISIT_EVENTS_ENABLED and not args.dry_run:
+                visit_events.record_visit(visit[1], visit[2], visit[3], visit[4], visited_at=visit[0])
+        if slug_counts and not args.dry_run:
+            update_url_visit_counts(db, slug_counts)
+        totals["visits"] += sum(slug_counts.values())
+        totals["slugs"].update(slug_counts)
+        on_batch(next_offset)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Count the visits of redirects served from the nginx cache.")
+    parser.add_argument("log", help="nginx access log written with the zaplink_visits log_format")
+    parser.add_argument("--state", help="file keeping the read position (default: <log>.offset)")
+    parser.add_argument("--batch-size", type=int, default=10000, help="log lines per DB update (default: 10000)")
+    parser.add_argument("--dry-run", action="store_true", help="count the visits without writing or saving the state")
+    args = parser.parse_args()
+    state_path = args.state or args.log + ".offset"
+
+    state = load_state(state_path)
+    totals = {"lines": 0, "visits": 0, "slugs": set()}
+
+    def on_batch(next_offset):
+        state["offset"] = next_offset
+        if not args.dry_run:
+            save_state(state_path, state)
+
+    try:
+        inode = os.stat(args.log).st_ino
+    except FileNotFoundError:
+        print(f"{args.log}: not found")
+        sys.exit(1)
+
+    with pooled_connection() as db:
+        try:
+            if state["inode"] is not None and state["inode"] != inode:
+                # The log was rotated since the last run - finish the old file if it is still there
+                rotated_path = args.log + ".1"
+                if os.path.exists(rotated_path) and os.stat(rotated_path).st_ino == state["inode"]:
+                    ingest_file(db, rotated_path, state["offset"], args, totals, on_batch)
+                state["offset"] = 0
+            elif os.stat(args.log).st_size < state["offset"]:
+                state["offset"] = 0  # Truncated (copytruncate rotation)
+            state["inode"] = inode
+            on_batch(state["offset"])
+            ingest_file(db, args.log, state["offset"], args, totals, on_batch)
+        finally:
+            if visit_events.VISIT_EVENTS_ENABLED and not args.dry_run:
+                visit_events.stop()
+
+    print(("dry run: " if args.dry_run else "") + f"{totals['lines']} lines read, {totals['visits']} cached visits "
+          f"of {len(totals['slugs'])} slugs counted")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,7 +1,7 @@
-from fastapi import FastAPI, Form, Request, Depends
-from fastapi.responses import HTMLResponse, RedirectResponse
-from fastapi.templating import Jinja2Templates
-from fastapi.staticfiles import StaticFiles
+from fastapi import FastAPI, Form, Request, Depends, HTTPException
+from fastapi.responses import HTMLResponse, RedirectResponse, JSONResponse, StreamingResponse, Response
+from contextlib import asynccontextmanager
+import asyncio
 import os
 from dotenv import load_dotenv
 import traceback
@@ -15,12 +15,35 @@ sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 
 
 # Import helper functions
-from helpers.common import initialize_logging, error_page, extract_filename_with_relative_path
-from helpers.db_connection import get_db_connection
-from helpers.email import send_email
+from helpers.common import initialize_logging, error_page, extract_filename_with_relative_path, templates
+from helpers import pages
+from helpers import assets
+from helpers.assets import AssetStaticFiles
+from helpers.pages import page_response
+from helpers.db_connection import get_db_connection, async_pooled_connection, close_pool, start_replica_checks
+from helpers import visit_counter
+from helpers import visit_events
+from helpers import visit_rollups
+from helpers import slug_filter
+from helpers import cache
+from helpers.concurrency import run_blocking
+from helpers.http_client import close_http_client
+from helpers import safe_browsing_local
+from helpers.url import SAFE_BROWSING_MODE
+from helpers.api_auth import require_api_key
+from helpers.visit_rollups import parse_time_range, get_visit_series, get_visit_breakdown
+from helpers.bulk import parse_bulk_request, shorten_urls_bulk, stream_ndjson, BULK_API_STREAM_THRESHOLD
+from helpers import alerts
+from helpers import metrics
+from helpers.metrics import MetricsMiddleware, stage_timer
+from helpers.logs import RequestIdMiddleware, is_sampled
+from helpers.rate_limit import RateLimitMiddleware, RATE_LIMIT_ENABLED
+from helpers.fast_redirect import FastRedirectMiddleware, FAST_REDIRECT_ENABLED
+from helpers.alerts import send_alert
 from helpers.url import validate_url
 from helpers.captcha import verify_recaptcha
-from helpers.app import (get_shortened_url, get_url_by_slug,
+from helpers.redirects import get_redirect_status, get_cache_headers
+from helpers.app import (get_shortened_url, get_url_by_slug, get_redirect,
                          get_current_domain, update_url_visit_count, extract_slug)
 
 
@@ -30,14 +53,68 @@ load_dotenv()
 # Initialize logging
 logger = initialize_logging("main.py")
 
+# App startup / shutdown
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    logger.info("lifespan() :: App startup.")
+    if ASYNC_DEBUG:
+        loop = asyncio.get_running_loop()
+        loop.set_debug(True)
+        loop.slow_callback_duration = ASYNC_DEBUG_SLOW_CALLBACK
+    if assets.ASSETS_BUILD_ON_STARTUP:
+        await run_blocking(assets.build_assets)
+    else:
+        await run_blocking(assets.load_manifest)
+    await run_blocking(pages.prerender_pages)
+    visit_counter.start()
+    alerts.start()
+    if visit_events.VISIT_EVENTS_ENABLED:
+        visit_events.start()
+        visit_rollups.start()
+    if SAFE_BROWSING_MODE == "local":
+        safe_browsing_local.start()
+    slug_filter.start()
+    cache.start()
+    start_replica_checks()
+    metrics.start()
+    yield
+    logger.info("lifespan() :: App shutdown.")
+    metrics.stop()
+    await run_blocking(slug_filter.stop)
+    await run_blocking(cache.stop)
+    await safe_browsing_local.stop()
+
+    # Write buffered visit counts and events before the DB connections are closed, send pending alerts
+    await run_blocking(visit_counter.stop)
+    await run_blocking(alerts.stop)
+    await run_blocking(visit_events.stop)
+    await run_blocking(visit_rollups.stop)
+
+    # Stop the replica checks, close pooled DB connections and HTTP keep-alive connections of this worker
+    await run_blocking(close_pool)
+    await close_http_client()
+
+
 # Initialize FastAPI app
-app = FastAPI()
+app = FastAPI(lifespan=lifespan)
+
+# Serve GET /{slug} redirects from a lean ASGI middleware, the /{short_url_slug} route stays as the fallback
+if FAST_REDIRECT_ENABLED:
+    app.add_middleware(FastRedirectMiddleware)
 
-# Initialize Jinja2 Templates
-templates = Jinja2Templates(directory="templates")
+# Token bucket rate limits - ahead of the fast path, so that abusive traffic never reaches the DB or external APIs
+if RATE_LIMIT_ENABLED:
+    app.add_middleware(RateLimitMiddleware)
 
-# Mount static assets path
-app.mount("/assets", StaticFiles(directory="assets"), name="assets")
+# Request duration histograms - outside of the fast path and rate limits, so that their responses are timed too
+if metrics.METRICS_ENABLED:
+    app.add_middleware(MetricsMiddleware)
+
+# Request ids for the logs (X-Request-ID), outermost so that every other middleware logs with the id
+app.add_middleware(RequestIdMiddleware)
+
+# Mount static assets path - fingerprinted, precompressed files of the asset build, else the source assets
+app.mount("/assets", AssetStaticFiles(), name="assets")
 
 # Env
 SITE_NAME = os.getenv("SITE_NAME")
@@ -46,6 +123,10 @@ STATCOUNTER_PROJECT = os.getenv("STATCOUNTER_PROJECT")
 STATCOUNTER_SECURITY = os.getenv("STATCOUNTER_SECURITY")
 MIXPANEL_TOKEN = os.getenv("MIXPANEL_TOKEN")
 
+# Dev aid: log any callback that blocks the event loop for longer than ASYNC_DEBUG_SLOW_CALLBACK seconds
+ASYNC_DEBUG = os.getenv("ASYNC_DEBUG", "false").lower() == "true"
+ASYNC_DEBUG_SLOW_CALLBACK = float(os.getenv("ASYNC_DEBUG_SLOW_CALLBACK", "0.05"))
+
 # Statcounter script
 statcounter_script = f"""
 <!-- Default Statcounter code for Link2aLink -->
@@ -66,6 +147,27 @@ referrerPolicy="no-referrer-when-downgrade"></a></div></noscript>
 <!-- End of Statcounter Code -->
 """
 
+# Static pages - rendered once per worker, served with ETag and gzip/brotli variants
+def get_form_page_context():
+    return {
+        "SITE_NAME": SITE_NAME,
+        "statcounter_script": statcounter_script,
+        "MIXPANEL_TOKEN": MIXPANEL_TOKEN,
+        "postback": False,
+        "RECAPTCHA_SITE_KEY": RECAPTCHA_SITE_KEY
+    }
+
+
+pages.register_page("landing", "landing.html", get_form_page_context)
+pages.register_page("get_original_url", "get_original_url.html", get_form_page_context)
+
+
+# Postback pages differ per request and are rendered on each call
+def render_template(template_name: str, context: dict):
+    with stage_timer("template_render"):
+        return templates.TemplateResponse(template_name, context)
+
+
 # Global Exception Handler
 @app.exception_handler(Exception)
 async def global_exception_handler(request: Request, exc: Exception):
@@ -84,18 +186,16 @@ async def global_exception_handler(request: Request, exc: Exception):
     # logger.error(tb_str) # Commented out: Not required for now
 
     # Log the function name and the error
-    logger.info(f"global_exception_handler() :: Exception occurred in: {exc_occurred_in}")
-    logger.info(f"global_exception_handler() :: Exception details: {str(exc)}")
+    logger.info("global_exception_handler() :: Exception occurred in: %s", exc_occurred_in)
+    logger.info("global_exception_handler() :: Exception details: %s", exc)
 
-    # Send an email alert to Site Admin - if a global exception is caught
+    # Queue an email alert to Site Admin - if a global exception is caught
     logger.info("global_exception_handler() :: Sending email alert - Global exception.")
-    env_site_admin_email = os.getenv('SITE_ADMIN_EMAIL')
     env_site_name = os.getenv('SITE_NAME')
 
     exc_filename = extract_filename_with_relative_path(exc_occurred_in)
 
-    send_email(
-        to_email=env_site_admin_email,
+    send_alert(
         subject=env_site_name + ": Global exception",
         content="Global exception occurred in: " + exc_filename + ".<br/><br/>Details: " + str(exc)
     )
@@ -125,14 +225,7 @@ def check_conflicting_routes(short_url_slug: str):
 async def form_short_url(request: Request):
     logger.info("GET Route=/ :: form_short_url() called.")
 
-    return templates.TemplateResponse("landing.html", {
-        "request": request,
-        "SITE_NAME": SITE_NAME,
-        "statcounter_script": statcounter_script,
-        "MIXPANEL_TOKEN": MIXPANEL_TOKEN,
-        "postback": False,
-        "RECAPTCHA_SITE_KEY": RECAPTCHA_SITE_KEY
-    })
+    return page_response(request, pages.get_page("landing"))
 
 
 # Route - Get Shortened URL
@@ -143,17 +236,18 @@ async def result_short_url(request: Request, original_url: str = Form(...), db=D
     # Get the CAPTCHA response from the form
     form_data = await request.form()
     g_recaptcha_response = form_data.get("g-recaptcha-response")
-    logger.debug("result_short_url() :: g_recaptcha_response: " + g_recaptcha_response)
+    # The token itself is not logged, a missing token is rejected without a remote call
+    logger.debug("result_short_url() :: g_recaptcha_response present: %s", bool(g_recaptcha_response))
 
     # Check if CAPTCHA is valid
-    if not verify_recaptcha(g_recaptcha_response):
+    if not await verify_recaptcha(g_recaptcha_response):
         logger.info("result_short_url() :: CAPTCHA validation failed.")
         return error_page(request, error_code=400, error_message="Invalid reCAPTCHA")
     logger.info("result_short_url() :: CAPTCHA validation successful.")
 
     # Check if the URL is valid before returning the response
     if validate_url(original_url):
-        short_url_slug = get_shortened_url(db, original_url)
+        short_url_slug = await get_shortened_url(db, original_url)
 
         current_domain = get_current_domain(request)
 
@@ -162,7 +256,7 @@ async def result_short_url(request: Request, original_url: str = Form(...), db=D
         else:
             short_url_val = f"{current_domain}/{short_url_slug}"
 
-        return templates.TemplateResponse("landing.html", {
+        return render_template("landing.html", {
             "request": request,
             "SITE_NAME": SITE_NAME,
             "statcounter_script": statcounter_script,
@@ -173,7 +267,7 @@ async def result_short_url(request: Request, original_url: str = Form(...), db=D
         })
     else:
         error_message = "Invalid URL provided. Please enter a valid URL."
-        return templates.TemplateResponse("landing.html", {
+        return render_template("landing.html", {
             "request": request,
             "SITE_NAME": SITE_NAME,
             "statcounter_script": statcounter_script,
@@ -189,14 +283,7 @@ async def result_short_url(request: Request, original_url: str = Form(...), db=D
 async def form_original_url(request: Request):
     logger.info("GET Route=/get-original-url :: form_original_url() called.")
 
-    return templates.TemplateResponse("get_original_url.html", {
-        "request": request,
-        "SITE_NAME": SITE_NAME,
-        "statcounter_script": statcounter_script,
-        "MIXPANEL_TOKEN": MIXPANEL_TOKEN,
-        "postback": False,
-        "RECAPTCHA_SITE_KEY": RECAPTCHA_SITE_KEY
-    })
+    return page_response(request, pages.get_page("get_original_url"))
 
 
 # Route - Get Original URL from Short URL
@@ -207,10 +294,11 @@ async def result_original_url(request: Request, short_url: str = Form(...), db=D
     # Get the CAPTCHA response from the form
     form_data = await request.form()
     g_recaptcha_response = form_data.get("g-recaptcha-response")
-    logger.debug("result_original_url() :: g_recaptcha_response: " + g_recaptcha_response)
+    # The token itself is not logged, a missing token is rejected without a remote call
+    logger.debug("result_original_url() :: g_recaptcha_response present: %s", bool(g_recaptcha_response))
 
     # Check if CAPTCHA is valid
-    if not verify_recaptcha(g_recaptcha_response):
+    if not await verify_recaptcha(g_recaptcha_response):
         logger.info("result_original_url() :: CAPTCHA validation failed.")
         return error_page(request, error_code=400, error_message="Invalid reCAPTCHA")
     logger.info("result_original_url() :: CAPTCHA validation successful.")
@@ -218,11 +306,11 @@ async def result_original_url(request: Request, short_url: str = Form(...), db=D
     # Check if the URL is valid before returning the response
     if validate_url(short_url):
         short_url_slug = extract_slug(short_url)
-        original_url = get_url_by_slug(db, short_url_slug)
+        original_url = await run_blocking(get_url_by_slug, db, short_url_slug)
 
         current_domain = get_current_domain(request)
 
-        return templates.TemplateResponse("get_original_url.html", {
+        return render_template("get_original_url.html", {
             "request": request,
             "SITE_NAME": SITE_NAME,
             "statcounter_script": statcounter_script,
@@ -233,7 +321,7 @@ async def result_original_url(request: Request, short_url: str = Form(...), db=D
         })
     else:
         error_message = "Invalid URL provided. Please enter a valid URL."
-        return templates.TemplateResponse("get_original_url.html", {
+        return render_template("get_original_url.html", {
             "request": request,
             "SITE_NAME": SITE_NAME,
             "statcounter_script": statcounter_script,
@@ -243,26 +331,96 @@ async def result_original_url(request: Request, short_url: str = Form(...), db=D
         })
 
 
+# Route - API - Shorten URLs in bulk
+@app.post("/api/v1/urls/bulk")
+async def api_bulk_short_urls(request: Request, api_key_name: str = Depends(require_api_key)):
+    logger.info("POST Route=/api/v1/urls/bulk :: api_bulk_short_urls() called - API key: %s", api_key_name)
+
+    try:
+        urls = parse_bulk_request(await request.body(), request.headers.get("content-type", ""))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    logger.info("api_bulk_short_urls() :: URLs received: %d", len(urls))
+
+    current_domain = get_current_domain(request)
+
+    # Large inputs (or clients asking for it) get results streamed as NDJSON, one line per URL
+    if len(urls) > BULK_API_STREAM_THRESHOLD or "application/x-ndjson" in request.headers.get("accept", ""):
+        return StreamingResponse(stream_ndjson(urls, current_domain), media_type="application/x-ndjson")
+
+    results = []
+    async for chunk_results in shorten_urls_bulk(urls, current_domain):
+        results.extend(chunk_results)
+    return JSONResponse({"results": results})
+
+
+# Route - API - Visit time series of a short URL, only registered when the storage backend has the rollup tables
+if visit_rollups.VISIT_ROLLUPS_SUPPORTED:
+    @app.get("/api/v1/urls/{slug}/visits")
+    async def api_url_visits(slug: str, granularity: str = "day", start: str = None, end: str = None,
+                             breakdown: str = None, api_key_name: str = Depends(require_api_key)):
+        logger.info("GET Route=/api/v1/urls/{slug}/visits :: api_url_visits() called - API key: %s", api_key_name)
+
+        try:
+            start_time, end_time = parse_time_range(start, end)
+            async with async_pooled_connection() as db:
+                result = {
+                    "slug": slug,
+                    "granularity": granularity,
+                    "start": start_time.isoformat(),
+                    "end": end_time.isoformat(),
+                    "series": await run_blocking(get_visit_series, db, slug, granularity, start_time, end_time)
+                }
+                if breakdown:
+                    result["breakdown"] = await run_blocking(get_visit_breakdown, db, slug, breakdown, start_time,
+                                                             end_time)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        return JSONResponse(result)
+
+
+# Route - Prometheus metrics, only registered when enabled (keep it internal, see the nginx config)
+if metrics.METRICS_ENABLED:
+    @app.get("/metrics", include_in_schema=False)
+    def get_metrics():
+        logger.debug("GET Route=/metrics :: get_metrics() called.")
+
+        body, content_type = metrics.generate_metrics()
+        return Response(body, media_type=content_type)
+
+
 # Route - Request to the short url
 @app.get("/{short_url_slug}", name="redirect", response_class=HTMLResponse)
 def request_short_url(request: Request, short_url_slug: str = Depends(check_conflicting_routes),
                       db=Depends(get_db_connection)):
-    logger.info("GET Route=/{short_url_slug} :: result_short_url() called.")
+    # High-volume path - info lines are only logged for the sampled share of requests (LOG_SAMPLE_RATE)
+    sampled = is_sampled()
+    if sampled:
+        logger.info("GET Route=/{short_url_slug} :: result_short_url() called.")
 
-    # Get the original url by slug
-    original_url_from_db = get_url_by_slug(db, short_url_slug)
+    # Get the original url and its redirect policy by slug
+    redirect = get_redirect(db, short_url_slug)
 
-    if original_url_from_db is None:
-        logger.info("request_short_url() :: Short URL slug not found in database: " + short_url_slug)
+    if redirect is None:
+        if sampled:
+            logger.info("request_short_url() :: Short URL slug not found in database: %s", short_url_slug)
         return error_page(request, error_code=404, error_message="URL not found")
-    logger.info("request_short_url() :: Short URL slug found in database: " + short_url_slug + ", "
-                                                                                               "original_url_from_db: " + original_url_from_db)
+    original_url_from_db = redirect[0]
+    if sampled:
+        logger.info("request_short_url() :: Short URL slug found in database: %s, original_url_from_db: %s",
+                    short_url_slug, original_url_from_db)
 
     # Update visit count
     update_url_visit_count(db, short_url_slug)
-
-    # Redirect to the original URL
-    return RedirectResponse(original_url_from_db)
+    if visit_events.VISIT_EVENTS_ENABLED:
+        visit_events.record_visit(short_url_slug, request.headers.get("referer", ""),
+                                  request.headers.get("user-agent", ""),
+                                  request.headers.get("x-real-ip") or (request.client.host if request.client else ""))
+
+    # Redirect to the original URL, with the status and cache headers of its redirect policy
+    return RedirectResponse(original_url_from_db, status_code=get_redirect_status(redirect),
+                            headers={name.decode("latin-1"): value.decode("latin-1")
+                                     for name, value in get_cache_headers(redirect)})
 
 
 if __name__ == "__main__":
@@ -0,0 +1,59 @@
+import os
+import sys
+import argparse
+import json
+
+# Add the source directory to the Python path, so that helpers are found when run from any directory
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+# Import helper functions
+from helpers.common import initialize_logging
+from helpers.db_connection import pooled_connection
+from helpers.redirects import REDIRECT_STATUSES, get_redirect_status, get_cache_ttl
+from helpers.app import get_redirect_from_db, update_redirect_policy, update_url_is_safe
+
+# Initialize logging
+logger = initialize_logging("manage_link.py")
+
+# Shows or changes the redirect policy of a short link (needs migration 0006), or flags it unsafe.
+# Changes drop the link from the shared cache and purge it from the nginx caches (REDIRECT_CACHE_PURGE_URLS);
+# app workers clear their slug cache within SLUG_CACHE_INVALIDATION_INTERVAL seconds (without a shared cache, after
+# SLUG_CACHE_TTL seconds, or SLUG_CACHE_MAX_STALE if set).
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Show or change the redirect policy of a short link.")
+    parser.add_argument("slug", help="slug of the short link")
+    parser.add_argument("--status", type=int, choices=REDIRECT_STATUSES, help="redirect status of the link")
+    parser.add_argument("--cache-ttl", type=int, help="seconds the redirect may be cached (0 = not cached)")
+    parser.add_argument("--reset", action="store_true", help="use the REDIRECT_STATUS / REDIRECT_CACHE_TTL defaults")
+    parser.add_argument("--flag-unsafe", action="store_true", help="flag the link unsafe, it stops redirecting")
+    args = parser.parse_args()
+    if args.reset and (args.status is not None or args.cache_ttl is not None):
+        parser.error("--reset cannot be combined with --status / --cache-ttl")
+
+    with pooled_connection() as db:
+        redirect = get_redirect_from_db(db, args.slug)
+        if redirect is None:
+            print(f"{args.slug}: not found, or flagged unsafe")
+            sys.exit(1)
+
+        if args.flag_unsafe:
+            update_url_is_safe(db, args.slug, False, json.dumps({"is_safe": False, "flagged_by": "manage_link.py"}))
+            print(f"{args.slug}: flagged unsafe")
+            return
+
+        if args.reset or args.status is not None or args.cache_ttl is not None:
+            # An option left out keeps the link's current setting
+            redirect_status = None if args.reset else args.status if args.status is not None else redirect[1]
+            cache_ttl = None if args.reset else args.cache_ttl if args.cache_ttl is not None else redirect[2]
+            update_redirect_policy(db, args.slug, redirect_status, cache_ttl)
+            redirect = get_redirect_from_db(db, args.slug)
+
+    print(f"{args.slug}: {redirect[0]}")
+    print(f"  status: {get_redirect_status(redirect)}" + (" (default)" if redirect[1] is None else ""))
+    print(f"  cache ttl: {get_cache_ttl(redirect)}s" + (" (default)" if redirect[2] is None else ""))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,122 @@
+import os
+import sys
+import argparse
+
+# Add the source directory to the Python path, so that helpers are found when run from any directory
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+# Import helper functions
+from helpers.common import initialize_logging
+from helpers.db_connection import create_connection
+
+# Initialize logging
+logger = initialize_logging("migrate.py")
+
+# Versioned migrations: db/migrations/<version>_<name>.sql, applied in order of the file name
+# Files ending in .optional.sql are only applied with --with-optional
+MIGRATIONS_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "db", "migrations")
+OPTIONAL_SUFFIX = ".optional.sql"
+
+
+def ensure_migrations_table(db):
+    logger.debug("ensure_migrations_table() called.")
+
+    cursor = db.cursor()
+    cursor.execute("CREATE TABLE IF NOT EXISTS schema_migrations ("
+                   "version varchar(255) NOT NULL PRIMARY KEY, "
+                   "applied_on datetime NOT NULL DEFAULT current_timestamp()"
+                   ") ENGINE=InnoDB DEFAULT CHARSET=utf8mb4")
+    db.commit()
+    cursor.close()
+
+
+def get_applied_versions(db):
+    logger.debug("get_applied_versions() called.")
+
+    cursor = db.cursor()
+    cursor.execute("SELECT version FROM schema_migrations")
+    versions = {row[0] for row in cursor.fetchall()}
+    cursor.close()
+    return versions
+
+
+def list_migrations(with_optional: bool):
+    logger.debug("list_migrations() called.")
+
+    migrations = []
+    for filename in sorted(os.listdir(MIGRATIONS_DIR)):
+        if not filename.endswith(".sql"):
+            continue
+        is_optional = filename.endswith(OPTIONAL_SUFFIX)
+        if is_optional and not with_optional:
+            continue
+        version = filename[:-len(OPTIONAL_SUFFIX)] if is_optional else filename[:-len(".sql")]
+        migrations.append((version, os.path.join(MIGRATIONS_DIR, filename), is_optional))
+    return migrations
+
+
+def split_statements(sql: str):
+    # Strip "--" comment lines and split on ";" at the end of a line
+    lines = [line for line in sql.splitlines() if not line.strip().startswith("--")]
+    statements = []
+    current = []
+    for line in lines:
+        current.append(line)
+        if line.rstrip().endswith(";"):
+            statement = "\n".join(current).strip().rstrip(";").strip()
+            if statement:
+                statements.append(statement)
+            current = []
+    statement = "\n".join(current).strip()
+    if statement:
+        statements.append(statement)
+    return statements
+
+
+def apply_migration(db, version: str, path: str):
+    logger.info("apply_migration() :: Applying migration: %s", version)
+
+    with open(path, encoding="utf-8") as f:
+        statements = split_statements(f.read())
+
+    # Note: MySQL commits DDL implicitly, so a migration is recorded only after all its statements succeeded
+    cursor = db.cursor()
+    for statement in statements:
+        cursor.execute(statement)
+    cursor.execute("INSERT INTO schema_migrations (version) VALUES (%s)", (version,))
+    db.commit()
+    cursor.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Apply pending database migrations from db/migrations.")
+    parser.add_argument("--with-optional", action="store_true", help="also apply *.optional.sql migrations")
+    parser.add_argument("--status", action="store_true", help="only list applied and pending migrations")
+    parser.add_argument("--dry-run", action="store_true", help="print pending migrations without applying them")
+    args = parser.parse_args()
+
+    db = create_connection()
+    try:
+        ensure_migrations_table(db)
+        applied = get_applied_versions(db)
+        pending = []
+        for version, path, is_optional in list_migrations(args.with_optional or args.status):
+            label = version + (" (optional)" if is_optional else "")
+            if version in applied:
+                print("applied  " + label)
+            else:
+                print("pending  " + label)
+                if not is_optional or args.with_optional:
+                    pending.append((version, path))
+
+        if args.status or args.dry_run:
+            return
+        for version, path in pending:
+            apply_migration(db, version, path)
+            print("done     " + version)
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
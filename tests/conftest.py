@@ -0,0 +1,89 @@
+import os
+import sys
+import json
+import tempfile
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+# Tests run against the app in source/ - settings are read when the helpers are imported, so they are set up here,
+# before any test module imports them. Everything runs on the embedded SQLite backend, without external services.
+SOURCE_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "source")
+sys.path.insert(0, SOURCE_DIR)
+os.chdir(SOURCE_DIR)
+
+TEST_DIR = tempfile.mkdtemp(prefix="zaplink-tests-")
+
+os.environ.update({
+    "STORAGE_BACKEND": "sqlite",
+    "SQLITE_PATH": os.path.join(TEST_DIR, "zaplink.sqlite3"),
+    "DATABASE_REPLICA_HOSTS": "",
+    "SHARED_CACHE_BACKEND": "",
+    "SLUG_FILTER_ENABLED": "false",
+    "SLUG_FILTER_SNAPSHOT_PATH": "",
+    "SLUG_ALLOCATOR": "random",
+    "SAFE_BROWSING_MODE": "lookup",
+    "SAFE_BROWSING_API_URL": "http://127.0.0.1:9/v4",
+    "GOOGLE_SAFE_BROWSING_API_KEY": "test",
+    "CAPTCHA_VERIFIER": "fake",
+    "RECAPTCHA_SECRET_KEY": "test",
+    "ALERT_TRANSPORT": "file",
+    "ALERT_FILE_PATH": os.path.join(TEST_DIR, "alerts.jsonl"),
+    "SITE_NAME": "Zaplink",
+    "SITE_ADMIN_EMAIL": "admin@example.com",
+    "API_KEYS": "tests:test-key",
+    "VISIT_COUNT_FLUSH_INTERVAL": "0",
+    "VISIT_EVENTS_ENABLED": "false",
+    "RATE_LIMIT_ENABLED": "false",
+    "METRICS_ENABLED": "false",
+    "ASSETS_BUILD_ON_STARTUP": "false",
+    "LOG_LEVEL": "WARNING",
+    "LOG_QUEUE_SIZE": "0",
+})
+
+
+# Local HTTP server standing in for Google APIs - routes: path -> function(request JSON) -> (status, response JSON)
+class StubServer:
+    def __init__(self):
+        self.routes = {}
+        self.requests = []
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                path = self.path.split("?")[0]
+                body = json.loads(self.rfile.read(int(self.headers.get("content-length", 0))) or b"{}")
+                stub.requests.append((path, body))
+                status, result = stub.routes[path](body) if path in stub.routes else (404, {})
+                data = json.dumps(result).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = "http://127.0.0.1:" + str(self.server.server_address[1])
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def requests_to(self, path):
+        return [body for request_path, body in self.requests if request_path == path]
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+@pytest.fixture
+def stub_server(monkeypatch):
+    from helpers import http_client
+
+    # Each test runs its own event loop, so it gets its own async HTTP client
+    monkeypatch.setattr(http_client, "_client", None)
+    stub = StubServer()
+    yield stub
+    stub.close()
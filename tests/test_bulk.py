@@ -0,0 +1,35 @@
+import json
+import uuid
+
+import httpx
+from fastapi.testclient import TestClient
+
+import main
+from helpers import bulk, http_client
+
+
+def test_failing_chunk_ends_the_stream_with_error_lines(monkeypatch):
+    create_urls_bulk = bulk.create_urls_bulk
+    calls = []
+
+    def failing_after_first_chunk(db, new_urls):
+        calls.append(new_urls)
+        if len(calls) > 1:
+            raise ValueError("DB connection error")
+        return create_urls_bulk(db, new_urls)
+
+    # Safe Browsing answers "no matches" from a local stub
+    monkeypatch.setattr(http_client, "_client", httpx.AsyncClient(
+        transport=httpx.MockTransport(lambda request: httpx.Response(200, json={}))))
+    monkeypatch.setattr(bulk, "BULK_API_CHUNK_SIZE", 2)
+    monkeypatch.setattr(bulk, "create_urls_bulk", failing_after_first_chunk)
+    urls = ["https://example.com/stream/%s/%d" % (uuid.uuid4().hex, index) for index in range(5)]
+    with TestClient(main.app) as client:
+        response = client.post("/api/v1/urls/bulk", json={"urls": urls},
+                               headers={"X-API-Key": "test-key", "Accept": "application/x-ndjson"})
+
+    assert response.status_code == 200
+    results = [json.loads(line) for line in response.text.splitlines()]
+    assert [result["original_url"] for result in results] == urls
+    assert [result["status"] for result in results] == ["created", "created", "error", "error", "error"]
+    assert "DB connection error" not in response.text
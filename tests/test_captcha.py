@@ -0,0 +1,13 @@
+import asyncio
+import uuid
+
+from helpers.captcha import verify_recaptcha
+
+
+def test_fake_verifier_accepts_each_prefixed_token_once():
+    tokens = ["fake-token-" + uuid.uuid4().hex for _ in range(3)]
+    assert [asyncio.run(verify_recaptcha(token)) for token in tokens] == [True, True, True]
+
+    # Replays and tokens without the prefix are rejected
+    assert asyncio.run(verify_recaptcha(tokens[0])) is False
+    assert asyncio.run(verify_recaptcha("other-" + uuid.uuid4().hex)) is False
@@ -0,0 +1,36 @@
+import uuid
+
+import pytest
+
+from helpers import app
+from helpers.app import create_url_with_new_slug, create_urls_bulk, get_url_row
+from helpers.db_connection import pooled_connection
+from helpers.storage import get_storage
+
+BASE_COLUMNS = ["urlx_original_url", "urlx_hash", "urlx_slug", "urlx_is_safe", "urlx_unsafe_details"]
+
+
+@pytest.fixture
+def hash_binary(monkeypatch):
+    # URL_HASH_BINARY=true, with a row written before the switch that the backfill has not reached yet
+    monkeypatch.setattr(app, "URL_HASH_BINARY", True)
+    monkeypatch.setattr(app, "LOOKUP_HASH_COLUMN", "urlx_hash_bin")
+    monkeypatch.setattr(app, "URL_INSERT_COLUMNS", BASE_COLUMNS + ["urlx_hash_bin"])
+    suffix = uuid.uuid4().hex[:8]
+    url, slug = "https://example.com/not-backfilled/" + suffix, "old" + suffix
+    with pooled_connection() as db:
+        get_storage().insert_urls(db, BASE_COLUMNS, [get_url_row(url, slug, True, None)[:5]])
+        yield db, url, slug
+
+
+def test_single_insert_finds_rows_without_hash_bin(hash_binary):
+    db, url, slug = hash_binary
+    assert create_url_with_new_slug(db, url, True, None) == slug
+
+
+def test_bulk_insert_finds_rows_without_hash_bin(hash_binary):
+    db, url, slug = hash_binary
+    new_url = url + "/new"
+    created = create_urls_bulk(db, [(url, True, None), (new_url, True, None)])
+    assert created[url] == slug
+    assert get_storage().find_original_url(db, created[new_url]) == new_url
@@ -0,0 +1,86 @@
+import asyncio
+import sqlite3
+
+import httpx
+import pytest
+import requests
+from fastapi.testclient import TestClient
+
+import main
+from helpers import http_client
+from helpers.storage import SQLiteConnection, get_storage
+from helpers.url import generate_url_hash
+
+# Blocking calls made on a thread that runs an event loop, as "<class>.<method>" strings
+blocking_calls = []
+
+
+def _check_off_loop(name):
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return  # A worker thread (run_blocking / sync route), not the loop
+    blocking_calls.append(name)
+
+
+def _guard(cls, method, name):
+    original = getattr(cls, method)
+
+    def guarded(self, *args, **kwargs):
+        _check_off_loop(name + "." + method)
+        return original(self, *args, **kwargs)
+    return guarded
+
+
+@pytest.fixture
+def loop_guard(monkeypatch):
+    # DB calls of the storage backend and every synchronous HTTP client the app could use
+    for method in ("cursor", "execute", "executemany", "executescript", "commit", "rollback"):
+        monkeypatch.setattr(SQLiteConnection, method, _guard(sqlite3.Connection, method, "sqlite3.Connection"))
+    monkeypatch.setattr(requests.Session, "request", _guard(requests.Session, "request", "requests.Session"))
+    monkeypatch.setattr(httpx.Client, "send", _guard(httpx.Client, "send", "httpx.Client"))
+    blocking_calls.clear()
+    yield blocking_calls
+
+
+@pytest.fixture
+def client(monkeypatch):
+    # Forms send fake-token-... tokens, accepted by the fake verifier (CAPTCHA_VERIFIER=fake) once each
+    # Safe Browsing answers "no matches" from a local stub - the app's shared async client is used as is
+    monkeypatch.setattr(http_client, "_client", httpx.AsyncClient(
+        transport=httpx.MockTransport(lambda request: httpx.Response(200, json={}))))
+    with TestClient(main.app, follow_redirects=False) as test_client:
+        yield test_client
+
+
+def test_guard_detects_a_db_call_on_the_loop(loop_guard):
+    async def blocking_handler():
+        db = get_storage().connect()
+        db.cursor().close()
+        db.close()
+
+    asyncio.run(blocking_handler())
+    assert loop_guard
+
+
+def test_no_blocking_call_runs_on_the_loop(loop_guard, client):
+    response = client.post("/", data={"original_url": "https://example.com/loop-test",
+                                      "g-recaptcha-response": "fake-token-loop-1"})
+    assert response.status_code == 200
+    db = get_storage().connect()
+    slug = get_storage().find_slug_by_hash(db, "urlx_hash", generate_url_hash("https://example.com/loop-test"))
+    db.close()
+    assert slug
+
+    response = client.post("/get-original-url", data={"short_url": "http://testserver/" + slug,
+                                                      "g-recaptcha-response": "fake-token-loop-2"})
+    assert response.status_code == 200
+    assert "https://example.com/loop-test" in response.text
+
+    response = client.post("/api/v1/urls/bulk", headers={"X-API-Key": "test-key"},
+                           json={"urls": ["https://example.com/bulk-1", "https://example.com/bulk-2",
+                                          "https://example.com/loop-test"]})
+    assert response.status_code == 200
+    assert [result["status"] for result in response.json()["results"]] == ["created", "created", "existing"]
+
+    assert loop_guard == []
@@ -0,0 +1,20 @@
+import importlib
+import os
+
+from helpers import metrics
+
+
+def test_empty_multiproc_dir_is_unset(monkeypatch):
+    # Set but empty, as an empty line in .env does - prometheus_client must not see it
+    monkeypatch.setenv("PROMETHEUS_MULTIPROC_DIR", "")
+    importlib.reload(metrics)
+    assert "PROMETHEUS_MULTIPROC_DIR" not in os.environ
+    assert metrics.PROMETHEUS_MULTIPROC_DIR == ""
+
+
+def test_multiproc_dir_is_kept(monkeypatch, tmp_path):
+    monkeypatch.setenv("PROMETHEUS_MULTIPROC_DIR", str(tmp_path))
+    importlib.reload(metrics)
+    assert os.environ["PROMETHEUS_MULTIPROC_DIR"] == str(tmp_path)
+    monkeypatch.delenv("PROMETHEUS_MULTIPROC_DIR")
+    importlib.reload(metrics)
@@ -0,0 +1,73 @@
+import time
+
+import pytest
+
+from helpers import app, cache, shared_cache
+from helpers.app import create_url, get_redirect, update_redirect_policy, update_url_is_safe
+from helpers.cache import NOT_FOUND, SLUG_CACHE_NEGATIVE_TTL, SLUG_CACHE_TTL, get_slug_cache_ttl, slug_cache
+from helpers.db_connection import pooled_connection
+from helpers.shared_cache import MemoryCacheBackend
+
+
+@pytest.fixture
+def shared(monkeypatch):
+    monkeypatch.setattr(shared_cache, "backend", MemoryCacheBackend())
+    monkeypatch.setattr(cache, "_invalidation_value", None)
+
+
+def on_other_worker(monkeypatch, func, *args):
+    # The change runs in another worker / process (python manage_link.py) - this worker's slug cache is not touched
+    with monkeypatch.context() as patch:
+        patch.setattr(app, "invalidate_slug", lambda slug: None)
+        func(*args)
+
+
+def test_flagged_link_is_dropped_by_every_worker(shared, monkeypatch):
+    with pooled_connection() as db:
+        create_url(db, "https://example.com/flag-me", "flag25a", True, "")
+        assert get_redirect(db, "flag25a")[0] == "https://example.com/flag-me"
+
+        on_other_worker(monkeypatch, update_url_is_safe, db, "flag25a", False, "{}")
+        cache.check_invalidations()
+        assert get_redirect(db, "flag25a") is None
+        assert cache.get_cache_stats()["invalidation_clears"] >= 1
+
+
+def test_watcher_thread_picks_up_policy_changes(shared, monkeypatch):
+    monkeypatch.setattr(cache, "SLUG_CACHE_INVALIDATION_INTERVAL", 0.05)
+    with pooled_connection() as db:
+        create_url(db, "https://example.com/policy", "policy25b", True, "")
+        assert get_redirect(db, "policy25b")[1] is None
+
+        cache.start()
+        try:
+            on_other_worker(monkeypatch, update_redirect_policy, db, "policy25b", 308, 60)
+            deadline = time.monotonic() + 5
+            while get_redirect(db, "policy25b")[1] != 308:
+                assert time.monotonic() < deadline
+                time.sleep(0.02)
+        finally:
+            cache.stop()
+
+
+def test_slug_cache_ttl_is_not_capped_by_default(monkeypatch):
+    redirect = ("https://example.com/", None, None)
+    monkeypatch.setattr(shared_cache, "backend", None)
+    assert get_slug_cache_ttl(redirect) == SLUG_CACHE_TTL
+    assert get_slug_cache_ttl(NOT_FOUND) == SLUG_CACHE_NEGATIVE_TTL
+
+
+def test_slug_cache_ttl_is_capped_without_a_shared_cache(monkeypatch):
+    redirect = ("https://example.com/", None, None)
+    monkeypatch.setattr(cache, "SLUG_CACHE_MAX_STALE", 10)
+    monkeypatch.setattr(shared_cache, "backend", MemoryCacheBackend())
+    assert get_slug_cache_ttl(redirect) == SLUG_CACHE_TTL
+
+    monkeypatch.setattr(shared_cache, "backend", None)
+    assert get_slug_cache_ttl(redirect) == min(SLUG_CACHE_TTL, 10)
+    assert get_slug_cache_ttl(NOT_FOUND) <= 10
+
+    with pooled_connection() as db:
+        create_url(db, "https://example.com/capped", "capped25c", True, "")
+        get_redirect(db, "capped25c")
+    assert slug_cache._entries["capped25c"][1] - time.monotonic() <= 10
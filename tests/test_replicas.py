@@ -0,0 +1,203 @@
+import time
+
+import pytest
+
+from helpers import db_connection
+from helpers.app import URL_INSERT_COLUMNS, create_url, get_url_row, get_redirect_from_db
+from helpers.db_connection import ReplicaSet, pooled_connection, read_from_replica, set_replica_set
+from helpers.storage import SQLiteStorage, get_storage
+
+
+class StandInReplica:
+    # A replica server: lookups run on its own SQLite file, SHOW REPLICA STATUS reports self.lag (None = stopped)
+    def __init__(self, path):
+        self.storage = SQLiteStorage(path)
+        self.lag = 0.0
+        self.down = False
+        self.status_queries = 0
+
+    def connect(self):
+        if self.down:
+            raise ValueError("DB connection error: 'Can't connect to MySQL server' occurred")
+        return StandInConnection(self, self.storage.connect())
+
+
+class StandInConnection:
+    def __init__(self, replica, db):
+        self.replica = replica
+        self.db = db
+
+    def cursor(self, dictionary=False):
+        return StatusCursor(self.replica) if dictionary else self.db.cursor()
+
+    def ping(self, reconnect=True, attempts=1, delay=0):
+        pass
+
+    def rollback(self):
+        self.db.rollback()
+
+    def close(self):
+        self.db.close()
+
+
+class StatusCursor:
+    def __init__(self, replica):
+        self.replica = replica
+
+    def execute(self, query):
+        assert query == "SHOW REPLICA STATUS"
+        self.replica.status_queries += 1
+
+    def fetchall(self):
+        return [{"Seconds_Behind_Source": self.replica.lag}]
+
+    def close(self):
+        pass
+
+
+def insert_url(db, url, slug):
+    get_storage().insert_urls(db, URL_INSERT_COLUMNS, [get_url_row(url, slug, True, "")])
+
+
+@pytest.fixture
+def replicas(tmp_path):
+    servers = {host: StandInReplica(str(tmp_path / (host + ".sqlite3"))) for host in ("replica1", "replica2")}
+    replica_set = ReplicaSet(list(servers), connect=lambda host: servers[host].connect())
+    set_replica_set(replica_set)
+    yield servers, replica_set
+    replica_set.close()
+    set_replica_set(None)
+
+
+def lookup(slug):
+    with pooled_connection() as db:
+        return read_from_replica(get_redirect_from_db, db, slug)
+
+
+def replicated(servers, url, slug):
+    # Rows of the primary reach the replicas
+    with pooled_connection() as db:
+        insert_url(db, url, slug)
+    for server in servers.values():
+        db = server.storage.connect()
+        insert_url(db, url, slug)
+        db.close()
+
+
+def replica_reads(replica_set):
+    return {host: stats["reads"] for host, stats in replica_set.stats()["replicas"].items()}
+
+
+def test_replicas_are_used_only_after_their_first_check(replicas):
+    servers, replica_set = replicas
+    replicated(servers, "https://example.com/replicated", "rep0001")
+
+    assert lookup("rep0001")[0] == "https://example.com/replicated"
+    assert replica_set.stats()["fallbacks"] == 1
+
+    replica_set.check()
+    for _ in range(4):
+        assert lookup("rep0001")[0] == "https://example.com/replicated"
+    assert replica_reads(replica_set) == {"replica1": 2, "replica2": 2}
+
+
+def test_lagging_and_stopped_replicas_are_skipped(replicas):
+    servers, replica_set = replicas
+    replicated(servers, "https://example.com/lagging", "lag0001")
+    servers["replica1"].lag = db_connection.DATABASE_REPLICA_MAX_LAG + 10
+    replica_set.check()
+
+    for _ in range(3):
+        assert lookup("lag0001")[0] == "https://example.com/lagging"
+    assert replica_reads(replica_set) == {"replica1": 0, "replica2": 3}
+
+    # Replication stopped on the other one too - everything goes to the primary
+    servers["replica2"].lag = None
+    replica_set.check()
+    assert lookup("lag0001")[0] == "https://example.com/lagging"
+    assert replica_set.stats()["fallbacks"] == 1
+
+    # Caught up again
+    servers["replica1"].lag = 0.0
+    replica_set.check()
+    assert lookup("lag0001")[0] == "https://example.com/lagging"
+    assert replica_reads(replica_set)["replica1"] == 1
+
+
+class NoPrimary:
+    # Stands in for the primary connection of a lookup that must be answered by the replica alone
+    def cursor(self, *args, **kwargs):
+        raise AssertionError("query on the primary")
+
+
+def test_rows_not_yet_replicated_are_read_from_the_primary(replicas):
+    servers, replica_set = replicas
+    replica_set.check()
+    with pooled_connection() as db:
+        create_url(db, "https://example.com/just-created", "new0001", True, "")
+
+    assert lookup("new0001")[0] == "https://example.com/just-created"
+    assert sum(stats["misses"] for stats in replica_set.stats()["replicas"].values()) == 1
+    assert replica_set.stats()["rereads"] == 1
+
+
+def test_misses_of_unknown_slugs_stay_on_the_replica(replicas):
+    servers, replica_set = replicas
+    replica_set.check()
+    with pooled_connection() as db:
+        # Written before this worker started, or by another one, and replicated long ago
+        insert_url(db, "https://example.com/elsewhere", "old0001")
+
+    for slug in ("missing", "old0001"):
+        assert read_from_replica(get_redirect_from_db, NoPrimary(), slug) is None
+    assert replica_set.stats()["rereads"] == 0
+
+
+def test_misses_on_a_lagging_replica_are_read_from_the_primary(replicas):
+    servers, replica_set = replicas
+    for server in servers.values():
+        server.lag = 1.0
+    replica_set.check()
+    with pooled_connection() as db:
+        insert_url(db, "https://example.com/behind", "behind01")
+
+    assert lookup("behind01")[0] == "https://example.com/behind"
+    assert replica_set.stats()["rereads"] == 1
+
+
+def test_lookups_run_no_health_checks(replicas):
+    servers, replica_set = replicas
+    replicated(servers, "https://example.com/checks", "chk0001")
+    replica_set.check()
+    queries = {host: server.status_queries for host, server in servers.items()}
+
+    # A replica going down is noticed by the lookup that fails to connect, not by a check on the request thread
+    servers["replica2"].down = True
+    replica_set.replicas[1].pool.close()
+    for _ in range(4):
+        assert lookup("chk0001")[0] == "https://example.com/checks"
+    assert {host: server.status_queries for host, server in servers.items()} == queries
+    assert replica_set.stats()["replicas"]["replica2"]["healthy"] is False
+    assert replica_reads(replica_set) == {"replica1": 4, "replica2": 0}
+
+
+def test_checker_thread_follows_replica_state(replicas, monkeypatch):
+    servers, replica_set = replicas
+    monkeypatch.setattr(db_connection, "DATABASE_REPLICA_CHECK_INTERVAL", 0.05)
+    servers["replica1"].down = True
+    replica_set.start()
+
+    def wait_for(condition):
+        deadline = time.monotonic() + 5
+        while not condition():
+            assert time.monotonic() < deadline
+            time.sleep(0.01)
+
+    wait_for(lambda: replica_set.replicas[1].healthy)
+    assert not replica_set.replicas[0].healthy
+
+    servers["replica1"].down = False
+    wait_for(lambda: replica_set.replicas[0].healthy)
+
+    replica_set.stop()
+    assert replica_set._checker is None
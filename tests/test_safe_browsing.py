@@ -0,0 +1,84 @@
+import asyncio
+
+import httpx
+import pytest
+
+from helpers import url as url_module
+from helpers.app import get_shortened_url
+from helpers.db_connection import pooled_connection
+from helpers.url import check_is_url_safe, check_urls_safety, generate_url_key, verdict_cache
+
+MATCHES_PATH = "/v4/threatMatches:find"
+
+
+def threat_matches(unsafe_urls, cache_duration="60s"):
+    def respond(body):
+        entries = [entry["url"] for entry in body["threatInfo"]["threatEntries"]]
+        return 200, {"matches": [{"threatType": "MALWARE", "platformType": "ANY_PLATFORM", "threatEntryType": "URL",
+                                  "threat": {"url": url}, "cacheDuration": cache_duration}
+                                 for url in entries if url in unsafe_urls]}
+    return respond
+
+
+@pytest.fixture
+def safe_browsing(stub_server, monkeypatch):
+    monkeypatch.setattr(url_module, "SAFE_BROWSING_API_URL", stub_server.url + "/v4")
+    monkeypatch.setattr(url_module, "SAFE_BROWSING_BATCH_WINDOW_MS", 0)
+    verdict_cache.clear()
+    yield stub_server
+    verdict_cache.clear()
+
+
+def test_matches_are_unsafe_and_verdicts_are_cached(safe_browsing):
+    safe_browsing.routes[MATCHES_PATH] = threat_matches({"https://malware.example/"})
+
+    results = asyncio.run(check_urls_safety(["https://malware.example/", "https://fine.example/"]))
+    assert results["https://malware.example/"]["is_safe"] is False
+    assert results["https://fine.example/"] == {"is_safe": True}
+    assert len(safe_browsing.requests_to(MATCHES_PATH)) == 1
+
+    # Both verdicts come from the cache now
+    results = asyncio.run(check_urls_safety(["https://malware.example/", "https://fine.example/"]))
+    assert results["https://malware.example/"]["is_safe"] is False
+    assert len(safe_browsing.requests_to(MATCHES_PATH)) == 1
+
+
+@pytest.mark.parametrize("status", [400, 429, 503])
+def test_error_replies_are_not_taken_as_safe(safe_browsing, status):
+    safe_browsing.routes[MATCHES_PATH] = lambda body: (status, {"error": {"code": status,
+                                                                         "message": "API key not valid"}})
+
+    with pytest.raises(httpx.HTTPStatusError):
+        asyncio.run(check_is_url_safe("https://unknown.example/"))
+    assert verdict_cache.get(generate_url_key("https://unknown.example/")) is None
+    assert verdict_cache.stats()["size"] == 0
+
+
+def test_concurrent_checks_are_batched(safe_browsing, monkeypatch):
+    monkeypatch.setattr(url_module, "SAFE_BROWSING_BATCH_WINDOW_MS", 50)
+    safe_browsing.routes[MATCHES_PATH] = threat_matches({"https://b.example/"})
+
+    async def check_all():
+        return await asyncio.gather(*[check_is_url_safe(url) for url in
+                                      ("https://a.example/", "https://b.example/", "https://c.example/")])
+
+    results = asyncio.run(check_all())
+    assert [result["is_safe"] for result in results] == [True, False, True]
+    requests = safe_browsing.requests_to(MATCHES_PATH)
+    assert len(requests) == 1
+    assert len(requests[0]["threatInfo"]["threatEntries"]) == 3
+
+
+def test_existing_urls_skip_the_remote_check(safe_browsing):
+    safe_browsing.routes[MATCHES_PATH] = threat_matches(set())
+
+    async def shorten_twice():
+        with pooled_connection() as db:
+            first = await get_shortened_url(db, "https://example.com/shorten-twice")
+            verdict_cache.clear()
+            second = await get_shortened_url(db, "https://example.com/shorten-twice")
+        return first, second
+
+    first, second = asyncio.run(shorten_twice())
+    assert first == second
+    assert len(safe_browsing.requests_to(MATCHES_PATH)) == 1
@@ -0,0 +1,158 @@
+import asyncio
+import base64
+import hashlib
+
+import pytest
+
+from helpers import safe_browsing_local
+from helpers.safe_browsing_local import HashPrefixDatabase, THREAT_LISTS, get_url_expressions
+
+UPDATE_PATH = "/v4/threatListUpdates:fetch"
+FULL_HASHES_PATH = "/v4/fullHashes:find"
+
+UNSAFE_EXPRESSION = "evil.example/"
+OTHER_PREFIXES = [bytes([index, 1, 2, 3]) for index in range(0, 250, 10)]
+
+
+def full_hash(expression):
+    return hashlib.sha256(expression.encode("utf-8")).digest()
+
+
+def list_update(threat_type, prefixes, state, response_type="FULL_UPDATE", removals=None, checksum_of=None):
+    checksum_of = sorted(prefixes) if checksum_of is None else checksum_of
+    update = {
+        "threatType": threat_type, "platformType": "ANY_PLATFORM", "threatEntryType": "URL",
+        "responseType": response_type, "newClientState": state,
+        "additions": [{"compressionType": "RAW", "rawHashes": {
+            "prefixSize": 4, "rawHashes": base64.b64encode(b"".join(prefixes)).decode("ascii")}}] if prefixes else [],
+        "checksum": {"sha256": base64.b64encode(hashlib.sha256(b"".join(checksum_of)).digest()).decode("ascii")},
+    }
+    if removals:
+        update["removals"] = [{"compressionType": "RAW", "rawIndices": {"indices": removals}}]
+    return update
+
+
+class FakeUpdateServer:
+    # Serves one queued threatListUpdates:fetch response per request, and full hashes of UNSAFE_EXPRESSION
+    def __init__(self, stub):
+        self.responses = []
+        stub.routes[UPDATE_PATH] = lambda body: (200, self.responses.pop(0))
+        stub.routes[FULL_HASHES_PATH] = self.full_hashes
+
+    def full_hashes(self, body):
+        matches = [{"threatType": "MALWARE", "platformType": "ANY_PLATFORM", "threatEntryType": "URL",
+                    "threat": {"hash": base64.b64encode(full_hash(UNSAFE_EXPRESSION)).decode("ascii")},
+                    "cacheDuration": "300s"}]
+        return 200, {"matches": matches, "negativeCacheDuration": "300s"}
+
+
+@pytest.fixture
+def local_db(stub_server, monkeypatch, tmp_path):
+    monkeypatch.setattr(safe_browsing_local, "SAFE_BROWSING_API_URL", stub_server.url + "/v4")
+    monkeypatch.setattr(safe_browsing_local, "SAFE_BROWSING_LOCAL_DB_PATH", str(tmp_path / "safe_browsing.db.json"))
+    monkeypatch.setattr(safe_browsing_local, "database", HashPrefixDatabase())
+    monkeypatch.setattr(safe_browsing_local, "_full_hash_cache", {})
+    monkeypatch.setattr(safe_browsing_local, "_negative_prefix_cache", {})
+    return FakeUpdateServer(stub_server)
+
+
+@pytest.fixture
+def calls_on_loop(monkeypatch):
+    # HashPrefixDatabase methods that ran on the event loop thread
+    on_loop = []
+    for method in ("apply_update", "save", "load"):
+        original = getattr(HashPrefixDatabase, method)
+
+        def wrapped(self, *args, _original=original, _method=method):
+            try:
+                asyncio.get_running_loop()
+                on_loop.append(_method)
+            except RuntimeError:
+                pass
+            return _original(self, *args)
+        monkeypatch.setattr(HashPrefixDatabase, method, wrapped)
+    return on_loop
+
+
+def full_updates(state):
+    return {"listUpdateResponses": [
+        list_update("MALWARE", [full_hash(UNSAFE_EXPRESSION)[:4]] + OTHER_PREFIXES, state),
+        list_update("SOCIAL_ENGINEERING", OTHER_PREFIXES[:5], state),
+    ], "minimumWaitDuration": "0s"}
+
+
+def test_expressions():
+    assert get_url_expressions("http://a.b.c/1/2.html?param=1") == [
+        "a.b.c/1/2.html?param=1", "a.b.c/1/2.html", "a.b.c/", "a.b.c/1/",
+        "b.c/1/2.html?param=1", "b.c/1/2.html", "b.c/", "b.c/1/"]
+
+
+def test_sync_builds_the_database_off_the_event_loop(local_db, stub_server, calls_on_loop):
+    local_db.responses.append(full_updates("state-1"))
+    asyncio.run(safe_browsing_local.sync_once())
+
+    database = safe_browsing_local.database
+    assert database.is_ready()
+    assert database.stats()["prefixes"] == len(OTHER_PREFIXES) + 1 + 5
+    assert [request["state"] for request in stub_server.requests_to(UPDATE_PATH)[0]["listUpdateRequests"]] == \
+        [""] * len(THREAT_LISTS)
+    assert calls_on_loop == []
+
+    # Another worker picks up the written file
+    other = HashPrefixDatabase()
+    other.load(safe_browsing_local.SAFE_BROWSING_LOCAL_DB_PATH)
+    assert other.lists == database.lists
+
+
+def test_prefix_hits_are_confirmed_with_full_hashes(local_db, stub_server):
+    local_db.responses.append(full_updates("state-1"))
+    asyncio.run(safe_browsing_local.sync_once())
+
+    result = asyncio.run(safe_browsing_local.check_url("http://evil.example/some/page"))
+    assert result["is_safe"] is False
+    assert len(stub_server.requests_to(FULL_HASHES_PATH)) == 1
+
+    # No prefix hit - answered locally
+    assert asyncio.run(safe_browsing_local.check_url("http://fine.example/")) == {"is_safe": True}
+    assert len(stub_server.requests_to(FULL_HASHES_PATH)) == 1
+
+    # Confirmed full hash is cached
+    assert asyncio.run(safe_browsing_local.check_url("http://evil.example/"))["is_safe"] is False
+    assert len(stub_server.requests_to(FULL_HASHES_PATH)) == 1
+
+
+def test_partial_updates_apply_removals(local_db, stub_server):
+    local_db.responses.append(full_updates("state-1"))
+    asyncio.run(safe_browsing_local.sync_once())
+
+    # Remove the unsafe prefix (its index in the sorted list) and add a new one
+    database = safe_browsing_local.database
+    current = sorted(database.lists["MALWARE/ANY_PLATFORM/URL"]["prefixes"][4][i:i + 4]
+                     for i in range(0, len(database.lists["MALWARE/ANY_PLATFORM/URL"]["prefixes"][4]), 4))
+    removed_index = current.index(full_hash(UNSAFE_EXPRESSION)[:4])
+    new_prefix = b"\xff\xfe\xfd\xfc"
+    remaining = [prefix for prefix in current if prefix != full_hash(UNSAFE_EXPRESSION)[:4]] + [new_prefix]
+    local_db.responses.append({"listUpdateResponses": [
+        list_update("MALWARE", [new_prefix], "state-2", "PARTIAL_UPDATE", [removed_index], sorted(remaining)),
+    ], "minimumWaitDuration": "0s"})
+    database.next_update_after = 0
+    asyncio.run(safe_browsing_local.sync_once())
+
+    assert stub_server.requests_to(UPDATE_PATH)[1]["listUpdateRequests"][0]["state"] == "state-1"
+    assert database.lists["MALWARE/ANY_PLATFORM/URL"]["state"] == "state-2"
+    assert asyncio.run(safe_browsing_local.check_url("http://evil.example/")) == {"is_safe": True}
+
+
+def test_checksum_mismatch_resets_the_list(local_db):
+    response = full_updates("state-1")
+    response["listUpdateResponses"][0]["checksum"]["sha256"] = base64.b64encode(b"\0" * 32).decode("ascii")
+    local_db.responses.append(response)
+    errors = safe_browsing_local.get_safe_browsing_local_stats()["update_errors"]
+    asyncio.run(safe_browsing_local.sync_once())
+
+    database = safe_browsing_local.database
+    assert database.lists["MALWARE/ANY_PLATFORM/URL"] == {"state": "", "prefixes": {}}
+    assert not database.is_ready()
+    assert safe_browsing_local.get_safe_browsing_local_stats()["update_errors"] == errors + 1
+    # Not ready - checks fall back to the lookup API
+    assert asyncio.run(safe_browsing_local.check_url("http://evil.example/")) is None
@@ -0,0 +1,105 @@
+import threading
+import time
+
+import pytest
+
+from helpers import shared_cache
+from helpers.shared_cache import MemoryCacheBackend, RedisCacheBackend
+
+
+def make_fakeredis_backend():
+    fakeredis = pytest.importorskip("fakeredis")
+    pytest.importorskip("lupa")  # Lock release runs a Lua script
+    return RedisCacheBackend(None, client=fakeredis.FakeRedis(decode_responses=True))
+
+
+@pytest.fixture(params=["memory", "fakeredis"])
+def backend(request, monkeypatch):
+    new_backend = MemoryCacheBackend() if request.param == "memory" else make_fakeredis_backend()
+    monkeypatch.setattr(shared_cache, "backend", new_backend)
+    return new_backend
+
+
+def test_load_caches_values_and_misses(backend):
+    calls = []
+
+    def loader():
+        calls.append(1)
+        return "https://example.com/"
+
+    assert shared_cache.load("redirect:abc", loader) == "https://example.com/"
+    assert shared_cache.load("redirect:abc", loader) == "https://example.com/"
+    assert len(calls) == 1
+
+    assert shared_cache.load("redirect:missing", lambda: None) is None
+    assert shared_cache.load("redirect:missing", lambda: "not called") is None
+
+
+def test_invalidate_drops_the_cached_value(backend):
+    shared_cache.load("redirect:abc", lambda: "https://example.com/old")
+    shared_cache.invalidate("redirect:abc")
+    assert shared_cache.load("redirect:abc", lambda: "https://example.com/new") == "https://example.com/new"
+
+
+def test_concurrent_misses_run_the_loader_once(backend):
+    calls = []
+    results = []
+
+    def loader():
+        calls.append(1)
+        time.sleep(0.2)
+        return "https://example.com/viral"
+
+    def lookup():
+        results.append(shared_cache.load("redirect:viral", loader))
+
+    threads = [threading.Thread(target=lookup) for _ in range(20)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(calls) == 1
+    assert results == ["https://example.com/viral"] * 20
+
+
+def test_lock_holder_in_another_process_is_waited_for(backend):
+    # Another process holds the single-flight lock and fills the cache while this one waits
+    cache_key = shared_cache._make_key("redirect:shared")
+    token = backend.acquire_lock(cache_key + ":lock", 5)
+    assert token is not None
+    threading.Timer(0.1, backend.set, (cache_key, "https://example.com/shared", 60)).start()
+
+    assert shared_cache.load("redirect:shared", lambda: "loaded here") == "https://example.com/shared"
+    backend.release_lock(cache_key + ":lock", token)
+
+
+def test_follower_stops_waiting_for_a_hung_leader(monkeypatch):
+    monkeypatch.setattr(shared_cache, "backend", None)
+    monkeypatch.setattr(shared_cache, "SHARED_CACHE_WAIT_TIMEOUT", 0.2)
+    release = threading.Event()
+
+    def hung_loader():
+        release.wait(5)
+        return "from the leader"
+
+    leader = threading.Thread(target=shared_cache.load, args=("redirect:hung", hung_loader))
+    leader.start()
+    time.sleep(0.05)
+
+    started = time.monotonic()
+    assert shared_cache.load("redirect:hung", lambda: "from the follower") == "from the follower"
+    assert time.monotonic() - started < 2
+    assert shared_cache.get_shared_cache_stats()["wait_timeouts"] >= 1
+
+    release.set()
+    leader.join()
+
+
+def test_backend_errors_are_treated_as_misses(monkeypatch):
+    class BrokenBackend(MemoryCacheBackend):
+        def get(self, key):
+            raise ConnectionError("down")
+
+    monkeypatch.setattr(shared_cache, "backend", BrokenBackend())
+    assert shared_cache.load("redirect:abc", lambda: "https://example.com/") == "https://example.com/"
@@ -0,0 +1,74 @@
+import pytest
+
+from helpers import shared_cache, slug_filter
+from helpers.app import URL_INSERT_COLUMNS, create_url, get_redirect, get_url_row
+from helpers.db_connection import pooled_connection
+from helpers.shared_cache import MemoryCacheBackend
+from helpers.storage import get_storage
+
+
+@pytest.fixture
+def bloom(monkeypatch):
+    # A filter of this worker, built from the DB before the other worker creates its slugs
+    monkeypatch.setattr(slug_filter, "SLUG_FILTER_ENABLED", True)
+    for name, value in (("_bloom", None), ("_recent", set()), ("_watermark", 0), ("_stats", dict(slug_filter._stats))):
+        monkeypatch.setattr(slug_filter, name, value)
+    slug_filter.rebuild()
+    slug_filter.sync()
+
+
+def create_on_other_worker(db, url, slug):
+    # The other worker runs the same create_url(), with a filter of its own
+    recent = slug_filter._recent
+    slug_filter._recent = set()
+    try:
+        create_url(db, url, slug, True, "")
+    finally:
+        slug_filter._recent = recent
+
+
+def test_misses_are_answered_without_the_db(bloom, monkeypatch):
+    # Without a shared cache a burst of unknown slugs costs no query - not even a sync
+    monkeypatch.setattr(shared_cache, "backend", None)
+    before = slug_filter.get_slug_filter_stats()
+    with pooled_connection() as db:
+        for index in range(20):
+            assert get_redirect(db, "garbage%d" % index) is None
+    stats = slug_filter.get_slug_filter_stats()
+    assert stats["definite_misses"] == before["definite_misses"] + 20
+    assert stats["syncs"] == before["syncs"]
+
+
+def test_slug_created_on_another_worker_is_found_after_the_next_sync(bloom, monkeypatch):
+    monkeypatch.setattr(shared_cache, "backend", None)
+    with pooled_connection() as db:
+        create_on_other_worker(db, "https://example.com/other-worker", "worker2a")
+        assert get_redirect(db, "worker2a") is None
+
+        slug_filter.sync()
+        assert get_redirect(db, "worker2a")[0] == "https://example.com/other-worker"
+
+
+def test_slug_created_on_another_worker_is_announced_in_the_shared_cache(bloom, monkeypatch):
+    monkeypatch.setattr(shared_cache, "backend", MemoryCacheBackend())
+    with pooled_connection() as db:
+        create_on_other_worker(db, "https://example.com/announced", "worker2b")
+        syncs = slug_filter.get_slug_filter_stats()["syncs"]
+
+        assert get_redirect(db, "worker2b")[0] == "https://example.com/announced"
+        assert get_redirect(db, "unknown2b") is None
+        stats = slug_filter.get_slug_filter_stats()
+        assert stats["new_slug_hits"] == 1
+        assert stats["definite_misses"] == 1
+        # Misses are confirmed in the shared cache, not in the DB
+        assert stats["syncs"] == syncs
+
+
+def test_rows_inserted_elsewhere_are_picked_up_by_the_sync(bloom, monkeypatch):
+    # A row written without going through this app, e.g. by an import job, reaches the filter with the next sync
+    monkeypatch.setattr(shared_cache, "backend", None)
+    with pooled_connection() as db:
+        get_storage().insert_urls(db, URL_INSERT_COLUMNS, [get_url_row("https://example.com/imported", "import2c",
+                                                                      True, "")])
+    slug_filter.sync()
+    assert slug_filter.might_contain("import2c")
@@ -0,0 +1,192 @@
+import os
+
+import pytest
+from fastapi.testclient import TestClient
+
+import main
+from helpers.slug_allocator import create_allocator
+from helpers.storage import DuplicateKeyError, MySQLStorage, SQLiteStorage, Storage
+from helpers.url import generate_url_hash, generate_url_key
+
+# Conformance tests every storage backend in helpers/storage.py has to pass. Rows are written with random slugs and
+# deleted again, so MySQL can be a development database (DATABASE_* settings, all migrations applied with
+# python migrate.py) - the MySQL run is skipped when it cannot connect.
+
+COLUMNS = ["urlx_original_url", "urlx_hash", "urlx_slug", "urlx_is_safe", "urlx_unsafe_details", "urlx_hash_bin"]
+
+
+class Rows:
+    def __init__(self):
+        self.prefix = os.urandom(4).hex()
+        self.count = 0
+        self.slugs = []
+
+    # A new (original_url, urlx_hash, urlx_slug, urlx_is_safe, urlx_unsafe_details, urlx_hash_bin) row
+    def new(self, is_safe=True):
+        self.count += 1
+        slug = "c" + self.prefix + str(self.count)
+        url = "https://conformance.invalid/" + self.prefix + "/" + str(self.count)
+        self.slugs.append(slug)
+        return url, generate_url_hash(url), slug, is_safe, None if is_safe else "{}", generate_url_key(url)
+
+
+@pytest.fixture(params=["sqlite", "mysql"])
+def storage(request, tmp_path):
+    if request.param == "sqlite":
+        return SQLiteStorage(str(tmp_path / "conformance.sqlite3"))
+    storage = MySQLStorage()
+    try:
+        storage.connect().close()
+    except ValueError as e:
+        pytest.skip(f"MySQL not available: {e}")
+    return storage
+
+
+@pytest.fixture
+def db(storage):
+    db = storage.connect()
+    yield db
+    db.close()
+
+
+@pytest.fixture
+def rows(storage, db):
+    rows = Rows()
+    yield rows
+    storage.delete_urls(db, rows.slugs)
+
+
+def test_lookups(storage, db, rows):
+    row = rows.new()
+    storage.insert_urls(db, COLUMNS, [row])
+    assert storage.find_original_url(db, row[2]) == row[0]
+    assert storage.find_slug_by_hash(db, "urlx_hash", row[1]) == row[2]
+    assert storage.find_slug_by_hash(db, "urlx_hash_bin", row[5]) == row[2]
+    assert storage.find_original_url(db, rows.prefix + "missing") is None
+    assert storage.find_slug_by_hash(db, "urlx_hash", "0" * 64) is None
+
+
+def test_unsafe_urls(storage, db, rows):
+    row = rows.new(is_safe=False)
+    storage.insert_urls(db, COLUMNS, [row])
+    assert storage.find_original_url(db, row[2]) is None
+    assert storage.find_slug_by_hash(db, "urlx_hash", row[1]) == row[2]
+
+    storage.update_is_safe(db, row[2], True, None)
+    assert storage.find_original_url(db, row[2]) == row[0]
+    storage.update_is_safe(db, row[2], False, "{}")
+    assert storage.find_original_url(db, row[2]) is None
+
+
+def test_redirect_policy(storage, db, rows):
+    row = rows.new()
+    storage.insert_urls(db, COLUMNS, [row])
+    assert storage.find_redirect(db, row[2]) == (row[0], None, None)
+
+    storage.update_redirect_policy(db, row[2], 308, 86400)
+    assert storage.find_redirect(db, row[2]) == (row[0], 308, 86400)
+    storage.update_redirect_policy(db, row[2], None, None)
+    assert storage.find_redirect(db, row[2]) == (row[0], None, None)
+    assert storage.find_redirect(db, rows.prefix + "missing") is None
+
+
+def test_duplicate_keys(storage, db, rows):
+    row = rows.new()
+    storage.insert_urls(db, COLUMNS, [row])
+
+    # A failed batch inserts nothing
+    other, fresh = rows.new(), rows.new()
+    same_slug = fresh[:2] + (row[2],) + fresh[3:]
+    with pytest.raises(DuplicateKeyError) as error:
+        storage.insert_urls(db, COLUMNS, [other, same_slug])
+    assert error.value.key == "slug"
+    assert storage.find_original_url(db, other[2]) is None
+
+    same_url = (row[0], row[1], rows.new()[2]) + row[3:]
+    with pytest.raises(DuplicateKeyError) as error:
+        storage.insert_urls(db, COLUMNS, [same_url])
+    assert error.value.key == "hash"
+
+    # The connection stays usable after a failed insert
+    storage.insert_urls(db, COLUMNS, [other])
+    assert storage.find_original_url(db, other[2]) == other[0]
+
+
+def test_bulk_lookups(storage, db, rows):
+    # More rows than one batch of the backend
+    new_rows = [rows.new(is_safe=index % 2 == 0) for index in range(storage.batch_size + 5)]
+    storage.insert_urls(db, COLUMNS, new_rows)
+
+    existing = storage.find_urls_by_hashes(db, "urlx_hash", [row[1] for row in new_rows] + ["0" * 64])
+    assert existing == {row[1]: {"slug": row[2], "is_safe": row[3]} for row in new_rows}
+
+    existing = storage.find_urls_by_hashes(db, "urlx_hash_bin", [row[5] for row in new_rows])
+    assert sorted(existing) == sorted(row[5] for row in new_rows)
+    assert storage.find_urls_by_hashes(db, "urlx_hash", []) == {}
+
+
+def test_visit_counts(storage, db, rows):
+    safe_row, unsafe_row = rows.new(), rows.new(is_safe=False)
+    storage.insert_urls(db, COLUMNS, [safe_row, unsafe_row])
+
+    storage.increment_visits(db, {safe_row[2]: 3, unsafe_row[2]: 2, rows.prefix + "missing": 1})
+    storage.increment_visits(db, {safe_row[2]: 1})
+    assert storage.get_visit_count(db, safe_row[2]) == 4
+    assert storage.get_visit_count(db, unsafe_row[2]) == 0
+    assert storage.get_visit_count(db, rows.prefix + "missing") is None
+
+    # More slugs than one batch of the backend
+    new_rows = [rows.new() for _ in range(storage.batch_size + 5)]
+    storage.insert_urls(db, COLUMNS, new_rows)
+    storage.increment_visits(db, {row[2]: 2 for row in new_rows})
+    assert storage.get_visit_count(db, new_rows[-1][2]) == 2
+
+
+def test_slug_listing(storage, db, rows):
+    count = storage.count_safe_urls(db)
+    new_rows = [rows.new(is_safe=index != 1) for index in range(5)]
+    storage.insert_urls(db, COLUMNS, new_rows)
+    assert storage.count_safe_urls(db) == count + 4
+
+    # Pages in id order, resuming after the last id of the previous page
+    listed = []
+    after_id = 0
+    while True:
+        page = storage.find_safe_slugs(db, after_id, 3)
+        if not page:
+            break
+        assert page == sorted(page)
+        listed.extend(slug for _, slug in page)
+        after_id = page[-1][0]
+    new_slugs = {row[2] for row in new_rows}
+    assert [slug for slug in listed if slug in new_slugs] == [row[2] for row in new_rows if row[3]]
+
+
+def test_delete(storage, db, rows):
+    row = rows.new()
+    storage.insert_urls(db, COLUMNS, [row])
+    storage.delete_urls(db, [row[2]])
+    assert storage.find_original_url(db, row[2]) is None
+    assert storage.find_slug_by_hash(db, "urlx_hash", row[1]) is None
+
+
+def test_backends_implement_the_whole_interface():
+    class PartialStorage(Storage):
+        def connect(self):
+            return None
+
+    with pytest.raises(TypeError):
+        PartialStorage()
+
+
+# The app runs on SQLite here (see conftest.py) - MySQL-only features are refused or left out
+
+def test_block_allocator_is_refused_without_mysql():
+    with pytest.raises(ValueError, match="SLUG_ALLOCATOR=block"):
+        create_allocator("block")
+
+
+def test_visits_api_is_not_registered_without_mysql():
+    with TestClient(main.app) as client:
+        response = client.get("/api/v1/urls/abc/visits", headers={"X-API-Key": "test-key"})
+    assert response.status_code == 404